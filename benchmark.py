@@ -0,0 +1,391 @@
+import os
+import sys
+import csv
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+from xml.sax.saxutils import escape
+import gene_metadata
+from gene_metadata import (CSV_HEADERS, GeneDisease, extract_hgnc_gene_ids, filter_diseases, gene_rows,
+                           get_diseases, get_disease_matcher, get_gene_records, read_pdf_file)
+
+logger = logging.getLogger(__name__)
+
+# Version of the results format, bumped when stages or fields change meaning
+RESULTS_VERSION = 2
+
+WORDS = ("gene variant patient cohort expression kidney renal protein function analysis clinical phenotype "
+         "sequencing mutation pathway cell tissue sample study result model disease onset family").split()
+# Disease names are made of random syllables, so that only the diseases put in the text match it
+CONSONANTS = "bcdfghklmnprstvz"
+VOWELS = "aeiou"
+
+
+def pseudo_word(rng: random.Random) -> str:
+    return "".join(rng.choice(CONSONANTS) + rng.choice(VOWELS) for _ in range(rng.randint(2, 4)))
+
+
+def synthetic_publication(pages: int, genes: int, diseases_per_gene: int, mentioned_diseases: int,
+                          lines_per_page: int = 50, seed: int = 0) -> Tuple[List[List[str]], Dict[str, dict]]:
+    """Generate the lines of each page of a publication, and the catalog of the genes it mentions.
+
+    Every gene is mentioned by HGNC ID on a random page, with the first mentioned_diseases of its
+    diseases_per_gene ClinVar diseases on lines of their own, so they are matched. The catalog maps
+    each HGNC ID to the MyGene record and ClinVar traits the stub server returns for it.
+    """
+    rng = random.Random(seed)
+    lines = [[" ".join(rng.choice(WORDS) for _ in range(10)) for _ in range(lines_per_page)] for _ in range(pages)]
+    catalog = {}
+    for n in range(genes):
+        hgnc_id = f"HGNC:{1000 + n}"
+        symbol = f"SYN{n}"
+        diseases = [" ".join(pseudo_word(rng) for _ in range(3)) for _ in range(diseases_per_gene)]
+        catalog[hgnc_id] = {
+            'record': {'query': hgnc_id.split(':')[1], 'symbol': symbol, 'alias': [f"{symbol}A", f"{symbol}B"],
+                       'genomic_pos': {'chr': str(n % 22 + 1), 'start': 1000 * n, 'end': 1000 * n + 500},
+                       'genomic_pos_hg19': {'chr': str(n % 22 + 1), 'start': 1000 * n + 7, 'end': 1000 * n + 507}},
+            'diseases': diseases,
+        }
+        page = lines[rng.randrange(pages)]
+        mentions = [f"the {symbol} gene ({hgnc_id}) was sequenced in each {rng.choice(WORDS)}"]
+        mentions.extend(diseases[:mentioned_diseases])
+        for line in mentions:
+            page.insert(rng.randrange(len(page) + 1), line)
+    return lines, catalog
+
+
+def write_pdf(filename: str, pages: List[List[str]]):
+    """Write a minimal PDF with one line of Helvetica text per string of each page."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        text = "".join("(" + line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ") Tj T* "
+                       for line in lines)
+        stream = f"BT /F1 8 Tf 10 TL 36 806 Td {text}ET".encode('latin-1', 'replace')
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects)))
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+
+    with open(filename, 'wb') as pdf:
+        pdf.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, obj in enumerate(objects, 1):
+            offsets.append(pdf.tell())
+            pdf.write(b"%d 0 obj\n%s\nendobj\n" % (number, obj))
+        xref = pdf.tell()
+        pdf.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        pdf.write(b"".join(b"%010d 00000 n \n" % offset for offset in offsets))
+        pdf.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves canned MyGene and E-utilities responses from a catalog, after `latency` seconds."""
+    catalog: Dict[str, dict] = {}
+    latency = 0.0
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        self.respond(url.path, parse_qs(url.query))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+        self.respond(urlsplit(self.path).path, parse_qs(body))
+
+    def respond(self, path, params):
+        time.sleep(self.latency)
+        if path.rstrip('/').endswith('/query'):
+            # MyGene batch query
+            hits = []
+            for query in params['q'][0].split(','):
+                query = query.strip()
+                gene = self.catalog.get(f"HGNC:{query}")
+                hits.append(gene['record'] if gene else {'query': query, 'notfound': True})
+            body = json.dumps(hits).encode()
+        elif path.endswith('esearch.fcgi'):
+            symbol = params['term'][0].split('[')[0]
+            count = sum(len(g['diseases']) for g in self.catalog.values() if g['record']['symbol'] == symbol)
+            body = json.dumps({"esearchresult": {"count": str(count), "webenv": symbol, "querykey": "1"}}).encode()
+        else:
+            # esummary of a page of the variants found by esearch, one variant per disease
+            diseases = [d for g in self.catalog.values() if g['record']['symbol'] == params['WebEnv'][0]
+                        for d in g['diseases']]
+            retstart = int(params['retstart'][0])
+            docs = "".join(f"<DocumentSummary><trait_set><trait><trait_name>{escape(d)}</trait_name></trait>"
+                           f"</trait_set></DocumentSummary>"
+                           for d in diseases[retstart:retstart + int(params['retmax'][0])])
+            body = (f'<?xml version="1.0"?><eSummaryResult><DocumentSummarySet>{docs}'
+                    f'</DocumentSummarySet></eSummaryResult>').encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def stub_server(catalog: Dict[str, dict], latency: float = 0.0):
+    """Run a stub MyGene and E-utilities server in a thread, yielding its URL."""
+    handler = type('CatalogHandler', (StubHandler,), {'catalog': catalog, 'latency': latency})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+# Settings of gene_metadata every benchmark run starts from, whatever the environment, so that runs
+# only differ by the settings they are given: no caches, reference store, journal or gene names
+BENCHMARK_SETTINGS = {
+    'RESPONSE_CACHE': '',
+    'PDF_CACHE': '',
+    'REFERENCE_STORE': '',
+    'GENE_NAMES': False,
+    'DISEASE_WINDOW': '',
+    'CACHE_ONLY': False,
+    'JOURNAL_DIR': '',
+}
+
+# Functions of gene_metadata caching what they built from the settings or a text
+CACHED_FUNCTIONS = ['get_response_cache', 'get_pdf_cache', 'get_reference_store', 'get_gene_name_matcher',
+                    'get_disease_matcher', 'get_text_segments', 'get_document_mentions']
+
+
+def clear_pipeline_caches():
+    for name in CACHED_FUNCTIONS:
+        getattr(gene_metadata, name).cache_clear()
+
+
+@contextmanager
+def pipeline_settings(**settings):
+    """Point gene_metadata at BENCHMARK_SETTINGS and other settings, e.g. the stub server, restoring
+    them all afterwards.
+
+    The caches built from the settings are dropped on the way in and out.
+    """
+    settings = dict(BENCHMARK_SETTINGS, **settings)
+    saved = {name: getattr(gene_metadata, name) for name in settings}
+    for name, value in settings.items():
+        setattr(gene_metadata, name, value)
+    clear_pipeline_caches()
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(gene_metadata, name, value)
+        clear_pipeline_caches()
+
+
+def timed(fn: Callable, repeat: int, setup: Optional[Callable] = None) -> Tuple[object, dict]:
+    """Run fn repeat times, after setup each time when given, which is not timed.
+    Returns its last result and the wall clock seconds of the runs."""
+    runs = []
+    result = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        result = fn()
+        runs.append(time.perf_counter() - start)
+    return result, {'min': min(runs), 'median': statistics.median(runs), 'runs': runs}
+
+
+@contextmanager
+def scratch_database():
+    """A database created from init.sql next to the one of the DB_* variables, which populate_db loads
+    into while the block runs, so the benchmark never writes to the tables of the pipeline. Yields a
+    function emptying its tables. The database is dropped afterwards."""
+    import psycopg2
+    from db_pool import close_pools, get_db_config
+    config = get_db_config()
+    name = f"benchmark_{os.getpid()}"
+    admin = psycopg2.connect(**config)
+    admin.autocommit = True
+    admin.cursor().execute(f"CREATE DATABASE {name}")
+    saved = os.environ.get('DB_NAME')
+    try:
+        conn = psycopg2.connect(**dict(config, database=name))
+        conn.autocommit = True
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'init.sql'), encoding='utf-8') as file:
+            conn.cursor().execute(file.read())
+        os.environ['DB_NAME'] = name
+
+        def truncate():
+            conn.cursor().execute("TRUNCATE hgnc_gene, gene_diseases, gene_aliases, disease, alias RESTART IDENTITY")
+        try:
+            yield truncate
+        finally:
+            conn.close()
+    finally:
+        if saved is None:
+            os.environ.pop('DB_NAME', None)
+        else:
+            os.environ['DB_NAME'] = saved
+        close_pools()
+        admin.cursor().execute(f"DROP DATABASE IF EXISTS {name}")
+        admin.close()
+
+
+def git_commit() -> Optional[str]:
+    """Commit of the working tree, if it is a git repository."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(pages: int = 20, genes: int = 20, diseases_per_gene: int = 200, mentioned_diseases: int = 2,
+                  latency: float = 0.0, repeat: int = 3, workers: int = 4, db: bool = False, seed: int = 0) -> dict:
+    """Time each pipeline stage on a synthetic publication, against a stub server.
+
+    The response and PDF caches are disabled, so every run goes through the stub. populate_db is
+    only timed with db=True, on the server of the DB_* environment variables, into a scratch database
+    whose tables are emptied before each run, so every run times a load of new rows.
+    """
+    params = {'pages': pages, 'genes': genes, 'diseases_per_gene': diseases_per_gene,
+              'mentioned_diseases': mentioned_diseases, 'latency': latency, 'repeat': repeat,
+              'workers': workers, 'db': db, 'seed': seed}
+    lines, catalog = synthetic_publication(pages, genes, diseases_per_gene, mentioned_diseases, seed=seed)
+    stages = {}
+    counts = {}
+    with tempfile.TemporaryDirectory() as work_dir, stub_server(catalog, latency) as url, \
+            pipeline_settings(EUTILS_URL=url, MYGENE_URL=url):
+        pdf = os.path.join(work_dir, 'publication.pdf')
+        write_pdf(pdf, lines)
+        counts['pdf_bytes'] = os.path.getsize(pdf)
+
+        text, stages['read_pdf_file'] = timed(lambda: read_pdf_file(pdf), repeat)
+        hgnc_ids, stages['extract_hgnc_gene_ids'] = timed(lambda: extract_hgnc_gene_ids(text), repeat)
+        hgnc_ids = sorted(hgnc_ids)
+        counts['hgnc_ids'] = len(hgnc_ids)
+
+        records, stages['get_gene_records'] = timed(lambda: get_gene_records(hgnc_ids), repeat)
+        # the symbol of each resolved ID, so IDs that did not resolve shift no gene onto another
+        symbols = {hgnc_id: records[hgnc_id]['symbol'] for hgnc_id in hgnc_ids if hgnc_id in records}
+        counts['genes'] = len(symbols)
+
+        def fetch_diseases():
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                return dict(zip(symbols, executor.map(get_diseases, symbols.values())))
+
+        diseases, stages['get_diseases'] = timed(fetch_diseases, repeat)
+        # a failed lookup is None
+        counts['diseases'] = sum(len(d or ()) for d in diseases.values())
+
+        def match_diseases():
+            # the matcher is built from the text once per run, as in a fresh process
+            get_disease_matcher.cache_clear()
+            matched = []
+            for hgnc_id, symbol in symbols.items():
+                gene = GeneDisease(symbol=symbol, hgnc_id=hgnc_id, aliases=records[hgnc_id].get('alias'), hg38='N/A',
+                                   hg19='N/A', diseases=sorted(diseases[hgnc_id] or ()))
+                filter_diseases(gene, text)
+                matched.append(gene)
+            return matched
+
+        matched, stages['filter_diseases'] = timed(match_diseases, repeat)
+        counts['matched_diseases'] = sum(len(gene.flt_diseases) for gene in matched)
+
+        if db:
+            # imported here, so the benchmark runs without a database driver when db is off
+            from main import populate_db
+            write_csvs(work_dir, matched)
+            with scratch_database() as truncate:
+                _, stages['populate_db'] = timed(lambda: populate_db(work_dir), repeat, setup=truncate)
+
+    return {
+        'version': RESULTS_VERSION,
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': params,
+        'stages': stages,
+        'counts': counts,
+    }
+
+
+def write_csvs(output_dir: str, genes: List[GeneDisease]):
+    """Write the CSV files populate_db loads for these genes."""
+    for table, header in CSV_HEADERS.items():
+        with open(os.path.join(output_dir, f"{table}.csv"), 'w', encoding='utf-8', newline='') as file:
+            writer = csv.writer(file, quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
+            writer.writerow(header)
+            for gene in genes:
+                writer.writerows(gene_rows(gene)[table])
+
+
+def compare(results: dict, baseline: dict, tolerance: float = 0.2) -> List[str]:
+    """Stages whose median time regressed by more than tolerance against a baseline run.
+
+    Counts that differ are reported too, since timings of different work are not comparable.
+    """
+    regressions = []
+    if results['params'] != baseline.get('params'):
+        regressions.append("parameters differ from the baseline, timings are not comparable")
+    for name, count in results['counts'].items():
+        if name in baseline.get('counts', {}) and baseline['counts'][name] != count:
+            regressions.append(f"{name}: {count} instead of {baseline['counts'][name]}")
+    for stage, timing in results['stages'].items():
+        old = baseline.get('stages', {}).get(stage)
+        if old and timing['median'] > old['median'] * (1 + tolerance):
+            regressions.append(f"{stage}: median {timing['median']:.4f}s against {old['median']:.4f}s "
+                               f"({timing['median'] / old['median'] - 1:+.0%})")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Time each pipeline stage on a synthetic publication.")
+    parser.add_argument('--pages', type=int, default=20, help="pages of the publication")
+    parser.add_argument('--genes', type=int, default=20, help="genes mentioned in the publication")
+    parser.add_argument('--diseases-per-gene', type=int, default=200, help="ClinVar diseases of each gene")
+    parser.add_argument('--mentioned-diseases', type=int, default=2, help="diseases of each gene in the text")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds the stub server waits per request")
+    parser.add_argument('--repeat', type=int, default=3, help="runs of each stage")
+    parser.add_argument('--workers', type=int, default=4, help="threads fetching diseases")
+    parser.add_argument('--db', action='store_true', help="also time populate_db, into a scratch database on the DB_* server")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic publication")
+    parser.add_argument('--output', help="JSON file to write the results to, default stdout")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="slowdown over the baseline that fails")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    results = run_benchmark(pages=args.pages, genes=args.genes, diseases_per_gene=args.diseases_per_gene,
+                            mentioned_diseases=args.mentioned_diseases, latency=args.latency, repeat=args.repeat,
+                            workers=args.workers, db=args.db, seed=args.seed)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,7 @@
+import os
+
+# Settings shared by the CLI and the pipeline modules. This module imports nothing else, so that
+# main.py reads them without importing the pipeline.
+
+# Directory of the CSV files the pipeline writes and the load reads
+OUTPUT_DIR = os.getenv('OUTPUT_DIR', 'output')
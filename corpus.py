@@ -0,0 +1,215 @@
+import csv
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import metrics
+from config import OUTPUT_DIR
+from gene_metadata import (CSV_HEADERS, JOURNAL_DIR, GeneDisease, gene_rows, get_disease_window, get_gene_records,
+                           get_response_cache, hgnc_sort_key, load_pdf, match_gene_diseases, resolve_journaled_gene)
+from run_journal import RunJournal, content_run, open_journal
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def list_publications(source: str) -> List[Tuple[str, str]]:
+    """List the PDFs of a corpus as (publication, path) pairs.
+
+    source is either a directory, searched recursively for .pdf files, or a manifest file with
+    one PDF path per line, relative to the manifest. Blank lines and lines starting with # are
+    ignored. The publication is the path relative to the directory, or as written in the manifest.
+    """
+    if os.path.isdir(source):
+        publications = []
+        for root, _, files in os.walk(source):
+            for name in files:
+                if name.lower().endswith('.pdf'):
+                    path = os.path.join(root, name)
+                    publications.append((os.path.relpath(path, source), path))
+        return sorted(publications)
+
+    if not os.path.exists(source):
+        logger.error(f"Corpus {source} does not exist.")
+        raise FileNotFoundError(f"Corpus {source} does not exist")
+    base_dir = os.path.dirname(source)
+    publications = []
+    with open(source, 'r', encoding='utf-8') as manifest:
+        for line in manifest:
+            entry = line.strip()
+            if entry and not entry.startswith('#'):
+                publications.append((entry, os.path.join(base_dir, entry)))
+    return publications
+
+
+def scan_publication(path: str) -> List[str]:
+    """Extract the HGNC gene IDs of one publication, in a worker process."""
+    _, hgnc_ids = load_pdf(path, workers=1)
+    return sorted(hgnc_ids, key=hgnc_sort_key)
+
+
+def match_publication(path: str, genes: Dict[str, GeneDisease]) -> Dict[str, List[str]]:
+    """Find which diseases of each gene occur in one publication, in a worker process."""
+    text, _ = load_pdf(path, workers=1)
+    return {hgnc_id: match_gene_diseases(gene, text) for hgnc_id, gene in genes.items()}
+
+
+def resolve_corpus_gene(hgnc_id: str, gene_data: Optional[dict],
+                        journal: Optional[RunJournal] = None) -> Optional[GeneDisease]:
+    """Resolve a gene of the corpus, in a fetch thread."""
+    with metrics.gene(hgnc_id):
+        return resolve_journaled_gene(hgnc_id, gene_data, journal)
+
+
+@metrics.stage('parse_corpus')
+def parse_corpus(source: str, output_dir: Optional[str] = None, workers: Optional[int] = None,
+                 fetch_workers: Optional[int] = None, loader=None, write_csv: bool = True,
+                 journal_dir: Optional[str] = None):
+    """Parse a corpus of PDFs, fetch metadata once per unique gene, and write CSV files.
+
+    PDFs are scanned for HGNC IDs by a pool of `workers` processes (env CORPUS_WORKERS, default
+    one per CPU). Metadata and ClinVar diseases of each unique gene are fetched once, by
+    `fetch_workers` threads, and diseases are then matched against each publication. Besides
+    hgnc_gene.csv, gene_aliases.csv and gene_diseases.csv, which hold each gene and each
+    gene-disease pair once, publications.csv records the publication every gene and matched
+    disease came from. Reading each PDF twice is cheap when the PDF cache is enabled.
+    Rows are also streamed to a db_loader.StagingLoader when one is given: those of each gene as
+    it is resolved, and the gene diseases of each publication as it is matched. Resolved genes are
+    journaled as in parse_pdf, so an interrupted corpus run resumes without fetching them again.
+    """
+    logger.info(f"Starting corpus parsing for {source}")
+    get_disease_window()
+    publications = list_publications(source)
+    logger.info(f"Found {len(publications)} publications in {source}")
+    if workers is None:
+        workers = int(os.getenv('CORPUS_WORKERS', str(os.cpu_count() or 1)))
+    if fetch_workers is None:
+        fetch_workers = int(os.getenv('FETCH_WORKERS', '4'))
+
+    # a single worker runs in-process, where a pool would cost more than it saves
+    executor_class = ProcessPoolExecutor if workers > 1 else ThreadPoolExecutor
+
+    # Scan every publication for HGNC IDs
+    publication_genes: Dict[str, List[str]] = {}
+    with metrics.stage('scan_publications'), executor_class(max_workers=max(1, workers)) as executor:
+        futures = [(publication, executor.submit(scan_publication, path)) for publication, path in publications]
+        for publication, future in futures:
+            try:
+                publication_genes[publication] = future.result()
+            except Exception as e:
+                logger.error(f"Skipping publication {publication}: {e}")
+    hgnc_gene_ids = sorted({hgnc_id for ids in publication_genes.values() for hgnc_id in ids}, key=hgnc_sort_key)
+    logger.info(f"Found {len(hgnc_gene_ids)} unique HGNC IDs in {len(publication_genes)} publications")
+
+    # Resolve each unique gene once, skipping those an interrupted run already resolved
+    if journal_dir is None:
+        journal_dir = JOURNAL_DIR
+    # the publications that could be read, as the others could not be digested either
+    scanned = [path for publication, path in publications if publication in publication_genes]
+    journal = open_journal(journal_dir, content_run('corpus', source, scanned)) if journal_dir else None
+    try:
+        journaled = set(journal.keys()) if journal else set()
+        gene_records = get_gene_records([hgnc_id for hgnc_id in hgnc_gene_ids if hgnc_id not in journaled])
+        resolved = [hgnc_id for hgnc_id in hgnc_gene_ids if hgnc_id in gene_records or hgnc_id in journaled]
+        genes: Dict[str, GeneDisease] = {}
+        with ThreadPoolExecutor(max_workers=max(1, fetch_workers)) as executor:
+            for hgnc_id, gene in zip(resolved, executor.map(
+                    lambda i: resolve_corpus_gene(i, gene_records.get(i), journal), resolved)):
+                if gene:
+                    genes[hgnc_id] = gene
+                    if loader:
+                        load_gene_rows(loader, gene)
+        logger.info(f"Resolved {len(genes)} of {len(hgnc_gene_ids)} genes")
+
+        # Match the diseases of each publication's genes against its text
+        paths = dict(publications)
+        matches: Dict[str, Dict[str, List[str]]] = {}
+        loaded = set()
+        with metrics.stage('match_publications'), executor_class(max_workers=max(1, workers)) as executor:
+            futures = []
+            for publication, hgnc_ids in publication_genes.items():
+                resolved_genes = {hgnc_id: genes[hgnc_id] for hgnc_id in hgnc_ids if hgnc_id in genes}
+                futures.append((publication, executor.submit(match_publication, paths[publication], resolved_genes)))
+            for publication, future in futures:
+                try:
+                    matches[publication] = future.result()
+                except Exception as e:
+                    logger.error(f"Skipping disease matching for publication {publication}: {e}")
+                    continue
+                if loader:
+                    load_matched_rows(loader, matches[publication], loaded)
+
+        if output_dir is None:
+            output_dir = OUTPUT_DIR
+        if write_csv:
+            write_corpus_csvs(output_dir, genes, matches)
+        if journal:
+            journal.complete()
+        cache = get_response_cache()
+        if cache:
+            cache.log_stats()
+    finally:
+        if journal:
+            journal.close()
+    logger.info(f"Completed parsing corpus {source}")
+
+
+def load_gene_rows(loader, gene: GeneDisease):
+    """Stream the hgnc_gene and gene_aliases rows of a resolved gene to a loader."""
+    rows = gene_rows(gene)
+    loader.add_rows('hgnc_gene', rows['hgnc_gene'])
+    loader.add_rows('gene_aliases', rows['gene_aliases'])
+
+
+def load_matched_rows(loader, diseases: Dict[str, List[str]], loaded: set):
+    """Stream the gene_diseases rows of a publication's matches to a loader, skipping the pairs in loaded.
+
+    loaded collects the gene-disease pairs streamed so far, so each pair of the corpus is loaded once.
+    """
+    rows = []
+    for hgnc_id in sorted(diseases, key=hgnc_sort_key):
+        for disease in diseases[hgnc_id]:
+            if (hgnc_id, disease) not in loaded:
+                loaded.add((hgnc_id, disease))
+                rows.append([hgnc_id, disease])
+    loader.add_rows('gene_diseases', rows)
+
+
+@metrics.stage('write_corpus')
+def write_corpus_csvs(output_dir: str, genes: Dict[str, GeneDisease], matches: Dict[str, Dict[str, List[str]]]):
+    """Write the genes, aliases, diseases and publications of a corpus to CSV files."""
+    gene_diseases = set()
+    publication_rows = []
+    for publication in sorted(matches):
+        for hgnc_id in sorted(matches[publication], key=hgnc_sort_key):
+            diseases = matches[publication][hgnc_id]
+            # genes without matched diseases still record that the publication mentions them
+            for disease in diseases or ['']:
+                publication_rows.append([publication, hgnc_id, disease])
+            gene_diseases.update((hgnc_id, disease) for disease in diseases)
+
+    tables = {table: [] for table in CSV_HEADERS}
+    for hgnc_id in sorted(genes, key=hgnc_sort_key):
+        rows = gene_rows(genes[hgnc_id])
+        tables['hgnc_gene'].extend(rows['hgnc_gene'])
+        tables['gene_aliases'].extend(rows['gene_aliases'])
+    tables['gene_diseases'] = [[hgnc_id, disease] for hgnc_id, disease in
+                               sorted(gene_diseases, key=lambda pair: (hgnc_sort_key(pair[0]), pair[1]))]
+
+    if not os.path.exists(output_dir):
+        logger.info(f"Creating output directory {output_dir}.")
+        os.makedirs(output_dir)
+    write_csv_file(os.path.join(output_dir, "publications.csv"), ['publication', 'hgnc_id', 'disease'],
+                   publication_rows)
+    for table, header in CSV_HEADERS.items():
+        write_csv_file(os.path.join(output_dir, f"{table}.csv"), header, tables[table])
+    logger.info(f"Wrote {len(genes)} genes and {len(gene_diseases)} gene diseases for {len(matches)} publications")
+
+
+def write_csv_file(path: str, header: List[str], rows: List[list]):
+    """Write a CSV file with a header line."""
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file, quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
+        writer.writerow(header)
+        writer.writerows(rows)
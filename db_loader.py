@@ -0,0 +1,256 @@
+import io
+import csv
+import logging
+from contextlib import contextmanager
+from typing import Dict, IO, Iterable, Iterator, List, Optional, Sequence
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Tables loaded by the pipeline, in load order, with their columns and key columns
+TABLES = [
+    ('hgnc_gene', ['hgnc_id', 'hgnc_gene_name', 'hg38', 'hg19',
+                   'hg38_chr', 'hg38_start', 'hg38_end', 'hg38_strand',
+                   'hg19_chr', 'hg19_start', 'hg19_end', 'hg19_strand'], ['hgnc_id']),
+    ('gene_diseases', ['hgnc_id', 'disease'], ['hgnc_id', 'disease']),
+    ('gene_aliases', ['hgnc_id', 'alias'], ['hgnc_id', 'alias']),
+]
+
+# Tables whose names are stored once in a dimension table: the staged name column, the dimension and its key
+DIMENSIONS = {
+    'gene_diseases': ('disease', 'disease', 'disease_id'),
+    'gene_aliases': ('alias', 'alias', 'alias_id'),
+}
+
+# Tables a load writes to, the dimensions included, whose secondary indexes can be dropped during it
+LOAD_TABLES = [table for table, _, _ in TABLES] + [dimension for _, dimension, _ in DIMENSIONS.values()]
+
+# Rows buffered per table before they are COPYed to the database
+COPY_BATCH_ROWS = 10000
+
+
+def stage_table_sql(table: str, columns: List[str], on_commit: str = 'DROP') -> str:
+    """SQL creating a table's staging table, which holds the rows as they are in the CSV files.
+
+    The staging table is dropped when the transaction commits, or kept for the session with
+    on_commit='PRESERVE ROWS'.
+    """
+    if table in DIMENSIONS:
+        column = DIMENSIONS[table][0]
+        definition = ", ".join(f"{c} TEXT" if c == column else f"{c} VARCHAR(255)" for c in columns)
+        return f"CREATE TEMP TABLE stage_{table} ({definition}) ON COMMIT {on_commit}"
+    return f"CREATE TEMP TABLE stage_{table} (LIKE {table}) ON COMMIT {on_commit}"
+
+
+def dimension_sql(table: str) -> str:
+    """SQL adding the names of a table's staging table that are not yet in its dimension.
+
+    Names already there are filtered out first, so identity values are only drawn for new names,
+    and only names of known genes are added.
+    """
+    column, dimension, _ = DIMENSIONS[table]
+    return (f"INSERT INTO {dimension} (name) "
+            f"SELECT DISTINCT s.{column} FROM stage_{table} s "
+            f"WHERE EXISTS (SELECT 1 FROM hgnc_gene g WHERE g.hgnc_id = s.hgnc_id) "
+            f"AND NOT EXISTS (SELECT 1 FROM {dimension} n WHERE n.name = s.{column}) "
+            f"ORDER BY s.{column} ON CONFLICT (name) DO NOTHING")
+
+
+def merge_sql(table: str, columns: List[str], keys: List[str]) -> str:
+    """SQL merging a table's staging table into it.
+
+    Rows are deduplicated on the key, rows of unknown genes are left out, rows whose key exists are
+    only updated when a value changed, and each inserted or updated row returns whether it was inserted.
+    Names of tables with a dimension are resolved to their keys in the same statement.
+    """
+    cols = ", ".join(columns)
+    key_cols = ", ".join(keys)
+    values = [c for c in columns if c not in keys]
+    where = "" if table == 'hgnc_gene' else \
+        " WHERE EXISTS (SELECT 1 FROM hgnc_gene g WHERE g.hgnc_id = s.hgnc_id)"
+    if table in DIMENSIONS:
+        column, dimension, key = DIMENSIONS[table]
+        return (f"INSERT INTO {table} (hgnc_id, {key}) "
+                f"SELECT DISTINCT s.hgnc_id, n.{key} FROM stage_{table} s JOIN {dimension} n ON n.name = s.{column}"
+                f"{where} ON CONFLICT (hgnc_id, {key}) DO NOTHING RETURNING (xmax = 0) AS inserted")
+    if values:
+        conflict = (f"DO UPDATE SET {', '.join(f'{c} = EXCLUDED.{c}' for c in values)} "
+                    f"WHERE ({', '.join(f'{table}.{c}' for c in values)}) IS DISTINCT FROM "
+                    f"({', '.join(f'EXCLUDED.{c}' for c in values)})")
+    else:
+        conflict = "DO NOTHING"
+    return (f"INSERT INTO {table} ({cols}) "
+            f"SELECT DISTINCT ON ({key_cols}) {cols} FROM stage_{table} s{where} ORDER BY {key_cols} "
+            f"ON CONFLICT ({key_cols}) {conflict} RETURNING (xmax = 0) AS inserted")
+
+
+class StagingLoader:
+    """Loads rows into the gene tables through temporary staging tables.
+
+    Rows are COPYed into the staging tables as they arrive, either from CSV files or in batches
+    encoded in memory, and merge() then upserts them into the tables. Everything happens in the
+    connection's current transaction, which the caller commits or rolls back. A loader given
+    tables only stages and merges those, so tables can be loaded over separate connections.
+
+    With session=True the staging tables last for the session instead, so rows can be COPYed by a
+    connection in autocommit mode while they are produced, and merged in a transaction of their own
+    once they all arrived. drop() then removes the staging tables.
+    """
+
+    def __init__(self, conn, batch_rows: int = COPY_BATCH_ROWS, tables: Optional[Iterable[str]] = None,
+                 session: bool = False):
+        self.batch_rows = batch_rows
+        self.cursor = conn.cursor()
+        self.tables = [entry for entry in TABLES if tables is None or entry[0] in tables]
+        self.columns = {table: columns for table, columns, _ in self.tables}
+        self._buffers: Dict[str, io.StringIO] = {}
+        self._writers = {}
+        self._buffered: Dict[str, int] = {}
+        for table, columns, _ in self.tables:
+            self.cursor.execute(stage_table_sql(table, columns, 'PRESERVE ROWS' if session else 'DROP'))
+            self._buffers[table] = io.StringIO()
+            self._writers[table] = csv.writer(self._buffers[table], quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
+            self._buffered[table] = 0
+
+    def copy_file(self, table: str, f: IO[str]):
+        """COPY a CSV file, without its header line, into a staging table."""
+        self.cursor.copy_expert(
+            f"COPY stage_{table} ({', '.join(self.columns[table])}) FROM STDIN "
+            f"WITH (FORMAT CSV, DELIMITER ',', QUOTE '\"', ESCAPE '\"')",
+            f
+        )
+
+    def add_rows(self, table: str, rows: Iterable[Sequence]):
+        """Buffer rows for a staging table, COPYing them once a batch is full."""
+        for row in rows:
+            self._writers[table].writerow(row)
+            self._buffered[table] += 1
+        if self._buffered[table] >= self.batch_rows:
+            self.flush(table)
+
+    def flush(self, table: str):
+        """COPY the buffered rows of a staging table."""
+        if not self._buffered[table]:
+            return
+        buffer = self._buffers[table]
+        buffer.seek(0)
+        self.copy_file(table, buffer)
+        logger.info(f"Copied {self._buffered[table]} rows into stage_{table}")
+        buffer.seek(0)
+        buffer.truncate()
+        self._buffered[table] = 0
+
+    @metrics.stage('merge')
+    def merge(self) -> Dict[str, Dict[str, int]]:
+        """Merge the staging tables into the tables. Returns the rows inserted, updated and skipped per table."""
+        stats = {}
+        for table, columns, keys in self.tables:
+            self.flush(table)
+            self.cursor.execute(f"SELECT count(*) FROM stage_{table}")
+            staged = self.cursor.fetchone()[0]
+            if table in DIMENSIONS:
+                self.cursor.execute(dimension_sql(table))
+                logger.info(f"Added {self.cursor.rowcount} names to {DIMENSIONS[table][1]}")
+            self.cursor.execute(merge_sql(table, columns, keys))
+            merged = [row[0] for row in self.cursor.fetchall()]
+            inserted = sum(1 for row in merged if row)
+            updated = len(merged) - inserted
+            stats[table] = {'inserted': inserted, 'updated': updated, 'skipped': staged - inserted - updated}
+            metrics.inc('rows_copied', staged, table=table)
+            metrics.inc('rows_merged', inserted, table=table, action='inserted')
+            metrics.inc('rows_merged', updated, table=table, action='updated')
+            logger.info("Merged %s: %d inserted, %d updated, %d skipped.", table, inserted, updated,
+                        staged - inserted - updated)
+        return stats
+
+    def drop(self):
+        """Drop the staging tables, e.g. those of a session loader once they are merged."""
+        for table, _, _ in self.tables:
+            self.cursor.execute(f"DROP TABLE IF EXISTS stage_{table}")
+
+
+# Secondary indexes of the tables, i.e. those that back no primary key or unique constraint, such as
+# the UNIQUE (name) of the dimensions their inserts resolve conflicts on
+SECONDARY_INDEXES_SQL = (
+    "SELECT i.indexname, i.indexdef FROM pg_indexes i WHERE i.schemaname = current_schema() "
+    "AND i.tablename = ANY(%s) AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conname = i.indexname)"
+)
+# Foreign keys of the tables, with the definitions they are added back with
+FOREIGN_KEYS_SQL = (
+    "SELECT c.conrelid::regclass::text, c.conname, pg_get_constraintdef(c.oid) FROM pg_constraint c "
+    "WHERE c.contype = 'f' AND c.connamespace = current_schema()::regnamespace "
+    "AND c.conrelid::regclass::text = ANY(%s)"
+)
+
+
+# Statements adding back the indexes and foreign keys dropped for a load, kept in the database until
+# they have run, so a load that is killed before rebuilding them loses nothing
+DROPPED_INDEXES_SQL = ("CREATE TABLE IF NOT EXISTS dropped_indexes "
+                       "(position SERIAL PRIMARY KEY, statement TEXT NOT NULL)")
+
+
+def drop_secondary_indexes(conn, tables: List[str]) -> List[str]:
+    """Drop the secondary indexes and foreign keys of tables. Returns the statements that add them back,
+    which are also saved to dropped_indexes in the same transaction."""
+    cursor = conn.cursor()
+    cursor.execute(SECONDARY_INDEXES_SQL, (tables,))
+    indexes = cursor.fetchall()
+    cursor.execute(FOREIGN_KEYS_SQL, (tables,))
+    foreign_keys = cursor.fetchall()
+    statements = ([definition for _, definition in indexes] +
+                  [f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}"
+                   for table, name, definition in foreign_keys])
+    cursor.execute(DROPPED_INDEXES_SQL)
+    for statement in statements:
+        cursor.execute("INSERT INTO dropped_indexes (statement) VALUES (%s)", (statement,))
+    for table, name, _ in foreign_keys:
+        cursor.execute(f"ALTER TABLE {table} DROP CONSTRAINT {name}")
+    for name, _ in indexes:
+        cursor.execute(f"DROP INDEX {name}")
+    logger.info(f"Dropped {len(indexes)} indexes and {len(foreign_keys)} foreign keys for the load")
+    return statements
+
+
+def restore_secondary_indexes(conn) -> int:
+    """Add back the indexes and foreign keys saved to dropped_indexes. Returns how many were added back."""
+    cursor = conn.cursor()
+    cursor.execute(DROPPED_INDEXES_SQL)
+    cursor.execute("SELECT statement FROM dropped_indexes ORDER BY position")
+    statements = [row[0] for row in cursor.fetchall()]
+    for statement in statements:
+        cursor.execute(statement)
+    cursor.execute("DELETE FROM dropped_indexes")
+    return len(statements)
+
+
+def restore_dropped_indexes(pool) -> int:
+    """Add back the indexes and foreign keys a killed or failed load left dropped, in one transaction."""
+    with metrics.stage('rebuild_indexes'), pool.connection() as conn, conn:
+        restored = restore_secondary_indexes(conn)
+    if restored:
+        logger.info(f"Rebuilt {restored} indexes and foreign keys")
+    return restored
+
+
+@contextmanager
+def secondary_indexes_dropped(pool, tables: List[str]) -> Iterator[None]:
+    """Drop the secondary indexes and foreign keys of tables for the duration of a bulk load.
+
+    They are built again once the load ends, failed or not, each index in one pass over its table
+    rather than row by row, and each foreign key checked in one query. Merges still leave out the
+    rows of unknown genes, so the foreign keys hold again when they are added back. Their definitions
+    stay in dropped_indexes until they are rebuilt, so if the process dies first, or the rebuild
+    fails, restore_dropped_indexes adds them back at the start of the next load.
+    """
+    with pool.connection() as conn, conn:
+        drop_secondary_indexes(conn, tables)
+    try:
+        yield
+    except BaseException:
+        # the load error is the one raised, a failed rebuild is retried by the next load
+        try:
+            restore_dropped_indexes(pool)
+        except Exception as e:
+            logger.error(f"Failed to rebuild the indexes dropped for the load, the next load rebuilds them: {e}")
+        raise
+    restore_dropped_indexes(pool)
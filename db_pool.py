@@ -0,0 +1,125 @@
+import os
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Most connections a pool opens to a database
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '4'))
+
+
+class ConnectionPool:
+    """A small thread-safe pool of database connections.
+
+    Connections are opened on demand up to maxconn, and callers wait for one to be returned
+    beyond that. A connection opened elsewhere, e.g. while waiting for the database to start,
+    can be adopted so that it is reused rather than closed.
+    """
+
+    def __init__(self, connect: Callable[[], object], maxconn: int = DB_POOL_SIZE):
+        self._connect = connect
+        self.maxconn = max(1, maxconn)
+        self._idle: List[object] = []
+        self._open = 0
+        self._available = threading.Condition()
+
+    def adopt(self, conn):
+        """Add an open connection to the pool, or close it when the pool is full."""
+        with self._available:
+            if self._open < self.maxconn:
+                self._open += 1
+                self._idle.append(conn)
+                self._available.notify()
+                return
+        conn.close()
+
+    def getconn(self):
+        """Take a connection from the pool, opening one if none is idle and the pool is not full."""
+        with self._available:
+            while True:
+                while self._idle:
+                    conn = self._idle.pop()
+                    if not conn.closed:
+                        return conn
+                    # closed by the server while idle
+                    self._open -= 1
+                if self._open < self.maxconn:
+                    break
+                self._available.wait()
+            self._open += 1
+        try:
+            return self._connect()
+        except Exception:
+            with self._available:
+                self._open -= 1
+                self._available.notify()
+            raise
+
+    def putconn(self, conn):
+        """Return a connection to the pool. Closed connections are dropped, and open transactions rolled back."""
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except Exception as e:
+                logger.warning(f"Dropping a pooled connection that failed to roll back: {e}")
+                conn.close()
+        with self._available:
+            if conn.closed:
+                self._open -= 1
+            else:
+                self._idle.append(conn)
+            self._available.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[object]:
+        """A connection of the pool for the duration of a with block."""
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        """Close the idle connections. Connections in use are closed when they are returned."""
+        with self._available:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn in idle:
+            conn.close()
+
+
+def get_db_config():
+    """Get database credentials from environment variables."""
+    return {
+        'host': os.getenv('DB_HOST', 'mydb'),
+        'port': os.getenv('DB_PORT', '5432'),
+        'database': os.getenv('DB_NAME', 'MYDB'),
+        'user': os.getenv('DB_USER', 'postgres'),
+        'password': os.getenv('DB_PASSWORD', 'postgres')
+    }
+
+
+_pools: Dict[Tuple, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(config: dict) -> ConnectionPool:
+    """The pool of connections to the database of a psycopg2 connect configuration, created on first use."""
+    key = tuple(sorted(config.items()))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            import psycopg2
+            pool = _pools[key] = ConnectionPool(lambda: psycopg2.connect(**config))
+        return pool
+
+
+def close_pools():
+    """Close the connections of every pool, e.g. at the end of a run."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.closeall()
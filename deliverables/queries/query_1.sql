@@ -1,4 +1,5 @@
 -- SQL query to retrieve HGNC IDs with connected diseases
-select hg.hgnc_id, gd.disease
+select hg.hgnc_id, d.name as disease
 from hgnc_gene hg join gene_diseases gd ON hg.hgnc_id =gd.hgnc_id
+join disease d on d.disease_id = gd.disease_id
 order by hg.hgnc_id ;
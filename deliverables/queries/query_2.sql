@@ -1,5 +1,4 @@
 -- SQL query to retrieve HGNC gene names with aliases
-select hg.hgnc_gene_name, ga.alias from gene_aliases ga join hgnc_gene hg on hg.hgnc_id =ga.hgnc_id
+select hg.hgnc_gene_name, a.name as alias from gene_aliases ga join hgnc_gene hg on hg.hgnc_id =ga.hgnc_id
+join alias a on a.alias_id = ga.alias_id
 order by ga.hgnc_id ;
-
-
@@ -1,29 +1,73 @@
-DROP TABLE IF EXISTS hgnc_gene;
+DROP TABLE IF EXISTS dropped_indexes;
 DROP TABLE IF EXISTS gene_aliases;
 DROP TABLE IF EXISTS gene_diseases;
+DROP TABLE IF EXISTS alias;
+DROP TABLE IF EXISTS disease;
+DROP TABLE IF EXISTS hgnc_gene;
+
+-- btree_gist lets the chromosome and the coordinate range share one GiST index
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+-- pg_trgm indexes disease and alias names for substring and similarity searches
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
 
 CREATE TABLE hgnc_gene
 (
     hgnc_id VARCHAR(255) PRIMARY KEY,
     hgnc_gene_name VARCHAR(255),
     hg38 VARCHAR(255),
-    hg19 VARCHAR(255)
+    hg19 VARCHAR(255),
+    -- positions as MyGene reports them: chromosome without the chr prefix, 1-based inclusive coordinates
+    hg38_chr VARCHAR(32),
+    hg38_start BIGINT,
+    hg38_end BIGINT,
+    hg38_strand SMALLINT,
+    hg19_chr VARCHAR(32),
+    hg19_start BIGINT,
+    hg19_end BIGINT,
+    hg19_strand SMALLINT
 );
+CREATE INDEX hgnc_gene_hg38_range ON hgnc_gene USING gist (hg38_chr, int8range(hg38_start, hg38_end, '[]'));
+CREATE INDEX hgnc_gene_hg19_range ON hgnc_gene USING gist (hg19_chr, int8range(hg19_start, hg19_end, '[]'));
+-- Each disease and alias name is stored once, and referenced by its integer key
+CREATE TABLE disease
+(
+    disease_id INTEGER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE INDEX disease_name_lower ON disease (lower(name));
+CREATE INDEX disease_name_trgm ON disease USING gin (name gin_trgm_ops);
+CREATE TABLE alias
+(
+    alias_id INTEGER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE INDEX alias_name_lower ON alias (lower(name));
+CREATE INDEX alias_name_trgm ON alias USING gin (name gin_trgm_ops);
 CREATE TABLE gene_aliases
 (
     hgnc_id VARCHAR(255),
-    alias VARCHAR(255),
-    PRIMARY KEY(hgnc_id,alias),
+    alias_id INTEGER,
+    PRIMARY KEY(hgnc_id,alias_id),
     CONSTRAINT fk_gene_alias_hgnc_id FOREIGN KEY (hgnc_id)
-    REFERENCES hgnc_gene(hgnc_id)
-
+    REFERENCES hgnc_gene(hgnc_id),
+    CONSTRAINT fk_gene_alias_alias_id FOREIGN KEY (alias_id)
+    REFERENCES alias(alias_id)
 );
+CREATE INDEX gene_aliases_alias_id ON gene_aliases (alias_id, hgnc_id);
 CREATE TABLE gene_diseases
 (
     hgnc_id VARCHAR(255),
-    disease VARCHAR(255),
-    PRIMARY KEY(hgnc_id,disease),
+    disease_id INTEGER,
+    PRIMARY KEY(hgnc_id,disease_id),
     CONSTRAINT fk_gene_disease_hgnc_id FOREIGN KEY (hgnc_id)
-    REFERENCES hgnc_gene(hgnc_id)
+    REFERENCES hgnc_gene(hgnc_id),
+    CONSTRAINT fk_gene_disease_disease_id FOREIGN KEY (disease_id)
+    REFERENCES disease(disease_id)
+);
+CREATE INDEX gene_diseases_disease_id ON gene_diseases (disease_id, hgnc_id);
+-- Indexes and foreign keys dropped by a load with DB_REBUILD_INDEXES, until they are built again
+CREATE TABLE dropped_indexes
+(
+    position SERIAL PRIMARY KEY,
+    statement TEXT NOT NULL
 );
-
@@ -0,0 +1,175 @@
+import bisect
+import logging
+from typing import Dict, Iterable, List, Tuple
+from fuzzywuzzy import fuzz
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# A disease matches a line of the publication when fuzz.ratio is above this value.
+SIMILARITY_THRESHOLD = 60
+
+# Number of bits set in each byte value
+POPCOUNT = bytes(bin(value).count('1') for value in range(256))
+# For each LCS length, a table translating each byte value to 1 when it reaches that length, 0 otherwise
+AT_LEAST = [bytes(value >= length for value in range(256)) for length in range(256)]
+# Lanes up to this many bytes hold fewer than 256 bits of lines, so their LCS lengths are summed as bytes
+MAX_SUMMED_LANE = 32
+
+
+class DiseaseMatcher:
+    """Matches disease names against the lines of a document.
+
+    fuzz.ratio is 2 * M / (len(a) + len(b)), where M is the number of matching
+    characters. M can never exceed the length of the longest common subsequence
+    (LCS) of the two strings, and both are bounded by the shorter length.
+
+    The text is lowercased, split into distinct lines and indexed once: each
+    line gets its own lane of bits in one large bitmap, and for every character
+    a bitmap marks where it occurs in every line. The LCS of a disease name with
+    the lines of a compatible length is then computed at once with the bit-parallel
+    algorithm of Allison-Dix/Hyyro, one big-integer step per character of the disease name.
+    fuzz.ratio is only computed for lines whose length and LCS can still clear
+    the threshold, so the results are the same as comparing every line.
+
+    Lines of the same lane width are contiguous, and the LCS lengths of all their
+    lanes are summed at once: the popcount of each byte, multiplied by a run of
+    ones as wide as a lane, leaves the sum of each lane in its last byte. Only the
+    lanes whose sum reaches the LCS the shortest of them needs are looked at one by one.
+    """
+
+    def __init__(self, text: str, threshold: int = SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        # fuzz.ratio rounds, so a match needs 100 * 2 * M / total >= threshold + 0.5
+        self._factor = 2 * threshold + 1
+        lines = {line.lower() for line in text.splitlines()}
+        # fuzz.ratio scores an empty string as 0, unless both strings are empty
+        self._blank_line = "" in lines
+        self._lines = sorted((line for line in lines if line), key=len)
+        self._lengths = [len(line) for line in self._lines]
+
+        # Lanes are byte aligned and keep at least one spare bit to absorb carries
+        self._offsets = []
+        offset = 0
+        for length in self._lengths:
+            self._offsets.append(offset)
+            offset += (length + 8) // 8
+        self._size = offset
+        # Runs of lines of the same lane width, as (width in bytes, first line, end line)
+        self._runs = []
+        for i, length in enumerate(self._lengths):
+            width = (length + 8) // 8
+            if self._runs and self._runs[-1][0] == width:
+                self._runs[-1][2] = i + 1
+            else:
+                self._runs.append([width, i, i + 1])
+        full = bytearray(self._size)
+        positions: Dict[str, bytearray] = {}
+        for line, start in zip(self._lines, self._offsets):
+            base = start * 8
+            for pos, ch in enumerate(line):
+                bit = base + pos
+                bitmap = positions.get(ch)
+                if bitmap is None:
+                    bitmap = positions[ch] = bytearray(self._size)
+                bitmap[bit >> 3] |= 1 << (bit & 7)
+                full[bit >> 3] |= 1 << (bit & 7)
+        self._full = bytes(full)
+        self._masks = {ch: bytes(bitmap) for ch, bitmap in positions.items()}
+
+        self._results: Dict[str, bool] = {}
+        logger.info(f"Indexed {len(self._lines)} distinct lines for disease matching")
+
+    def _length_window(self, length: int) -> Tuple[int, int]:
+        """Index range of the lines whose length is compatible with a disease name."""
+        shortest = -(-self._factor * length // (400 - self._factor))
+        longest = (400 - self._factor) * length // self._factor
+        lo = bisect.bisect_left(self._lengths, shortest)
+        hi = bisect.bisect_right(self._lengths, longest)
+        return lo, hi
+
+    def _candidates(self, counts: bytes, lo: int, hi: int, size: int) -> Iterable[Tuple[int, int]]:
+        """Lines between lo and hi whose LCS with a disease name of this size may clear the threshold, in order,
+        with their LCS length, from the popcounts of the bytes of the LCS bits of their lanes."""
+        base = self._offsets[lo]
+        for width, first, end in self._runs:
+            first, end = max(first, lo), min(end, hi)
+            if first >= end:
+                continue
+            start = self._offsets[first] - base
+            if width > MAX_SUMMED_LANE:
+                for i in range(first, end):
+                    offset = self._offsets[i] - base
+                    yield i, sum(counts[offset:offset + width])
+                continue
+            # the LCS needed by the shortest line of the run is needed by all of them
+            needed = -(-self._factor * (self._lengths[first] + size) // 400)
+            if needed > 255:
+                continue
+            n = (end - first) * width
+            ones = int.from_bytes(b'\x01' * width, 'little')
+            sums = (int.from_bytes(counts[start:start + n], 'little') * ones).to_bytes(n + width, 'little')
+            sums = sums[width - 1:n:width]
+            reached = sums.translate(AT_LEAST[needed])
+            j = reached.find(1)
+            while j >= 0:
+                yield first + j, sums[j]
+                j = reached.find(1, j + 1)
+
+    def _matches(self, disease: str) -> bool:
+        name = disease.lower()
+        if not name:
+            return self._blank_line
+        lo, hi = self._length_window(len(name))
+        if lo >= hi:
+            return False
+
+        # Only the lanes of the lines in the length window are computed
+        start = self._offsets[lo]
+        end = self._offsets[hi] if hi < len(self._offsets) else self._size
+        full = int.from_bytes(self._full[start:end], 'little')
+        masks = {}
+        v = full
+        for ch in name:
+            mask = masks.get(ch)
+            if mask is None:
+                bitmap = self._masks.get(ch)
+                mask = masks[ch] = int.from_bytes(bitmap[start:end], 'little') if bitmap else 0
+            if mask:
+                u = v & mask
+                v = ((v + u) | (v - u)) & full
+        # The LCS of each line is the number of bits cleared in its lane
+        counts = (v ^ full).to_bytes(end - start, 'little').translate(POPCOUNT)
+        size = len(name)
+        factor = self._factor
+        compared = 0
+        found = False
+        for i, lcs in self._candidates(counts, lo, hi, size):
+            length = self._lengths[i]
+            if 400 * lcs < factor * (length + size):
+                continue
+            compared += 1
+            if fuzz.ratio(self._lines[i], name) > self.threshold:
+                found = True
+                break
+        if compared:
+            metrics.inc('fuzzy_comparisons', compared)
+        return found
+
+    def matches(self, disease: str) -> bool:
+        """Whether the disease name is similar to any line of the document."""
+        result = self._results.get(disease)
+        if result is None:
+            result = self._results[disease] = self._matches(disease)
+        return result
+
+    def filter(self, diseases: Iterable[str]) -> List[str]:
+        """Return the distinct diseases that occur in the document, in input order."""
+        found = []
+        seen = set()
+        for d in diseases:
+            if d not in seen:
+                seen.add(d)
+                if self.matches(d):
+                    found.append(d)
+        return found
@@ -0,0 +1,245 @@
+import os
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional
+from db_loader import TABLES
+from db_pool import DB_POOL_SIZE, ConnectionPool, get_db_config
+
+logger = logging.getLogger(__name__)
+
+# Lookup results kept in memory per GeneLookup, least recently used evicted beyond it
+LOOKUP_CACHE_SIZE = int(os.getenv('LOOKUP_CACHE_SIZE', '10000'))
+# Rows of a page of aliases, diseases or genes when no limit is given
+LOOKUP_PAGE_SIZE = int(os.getenv('LOOKUP_PAGE_SIZE', '100'))
+# Seconds before listening for loads is tried again after it failed, lookups are not cached meanwhile
+LOOKUP_LISTEN_RETRY = float(os.getenv('LOOKUP_LISTEN_RETRY', '30'))
+# Channel populate_db notifies when it loaded the tables, so lookups in other processes drop their caches
+LOADED_CHANNEL = 'gene_tables_loaded'
+
+GENE_COLUMNS = next(columns for table, columns, _ in TABLES if table == 'hgnc_gene')
+
+# Statements prepared once per connection. Pages are read by keyset: rows after the last key of the
+# previous page, in key order, so deep pages cost no more than the first.
+STATEMENTS = {
+    'gene_by_id': f"SELECT {', '.join(GENE_COLUMNS)} FROM hgnc_gene WHERE hgnc_id = $1",
+    'gene_by_symbol': f"SELECT {', '.join(GENE_COLUMNS)} FROM hgnc_gene WHERE hgnc_gene_name = $1 "
+                      f"ORDER BY hgnc_id LIMIT 1",
+    'aliases': "SELECT n.name FROM gene_aliases a JOIN alias n ON n.alias_id = a.alias_id "
+               "WHERE a.hgnc_id = $1 AND n.name > $2 ORDER BY n.name LIMIT $3",
+    'diseases': "SELECT n.name FROM gene_diseases d JOIN disease n ON n.disease_id = d.disease_id "
+                "WHERE d.hgnc_id = $1 AND n.name > $2 ORDER BY n.name LIMIT $3",
+    # disease names match whatever their case, through the index on lower(name)
+    'genes_for_disease': f"SELECT DISTINCT {', '.join(f'g.{c}' for c in GENE_COLUMNS)} FROM disease n "
+                         f"JOIN gene_diseases d ON d.disease_id = n.disease_id JOIN hgnc_gene g ON g.hgnc_id = d.hgnc_id "
+                         f"WHERE lower(n.name) = lower($1) AND g.hgnc_id > $2 ORDER BY g.hgnc_id LIMIT $3",
+    # substrings are found through the trigram index on name
+    'find_diseases': "SELECT name FROM disease WHERE name ILIKE '%' || $1::text || '%' AND name > $2 ORDER BY name LIMIT $3",
+}
+
+
+@dataclass(frozen=True)
+class Gene:
+    hgnc_id: str
+    hgnc_gene_name: str
+    hg38: Optional[str]
+    hg19: Optional[str]
+    hg38_chr: Optional[str] = None
+    hg38_start: Optional[int] = None
+    hg38_end: Optional[int] = None
+    hg38_strand: Optional[int] = None
+    hg19_chr: Optional[str] = None
+    hg19_start: Optional[int] = None
+    hg19_end: Optional[int] = None
+    hg19_strand: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class Page:
+    """A page of lookup results. next_after is passed as after to read the next page, None on the last one."""
+    items: tuple
+    next_after: Optional[str]
+
+
+def connect_readonly(config: dict):
+    """A read-only connection in autocommit mode, so lookups need no transaction round trips."""
+    import psycopg2
+    conn = psycopg2.connect(**config)
+    conn.set_session(readonly=True, autocommit=True)
+    return conn
+
+
+_lookups = weakref.WeakSet()
+
+
+def invalidate_caches():
+    """Drop the cached results of every GeneLookup of this process, e.g. after the tables are loaded."""
+    for lookup in list(_lookups):
+        lookup.invalidate()
+
+
+def notify_loaded(conn):
+    """Tell GeneLookups listening in other processes that the tables were loaded. Sent when conn commits."""
+    conn.cursor().execute(f"NOTIFY {LOADED_CHANNEL}")
+
+
+class GeneLookup:
+    """Lookups of genes, their aliases and diseases, and the genes of a disease, in the loaded tables.
+
+    Queries run as prepared statements over a pool of read-only connections, and their results are
+    kept in an LRU cache. The cache is dropped when populate_db loads the tables, directly in this
+    process and through a LISTEN on LOADED_CHANNEL for loads run by other processes.
+    """
+
+    def __init__(self, config: Optional[dict] = None, pool: Optional[ConnectionPool] = None,
+                 cache_size: int = LOOKUP_CACHE_SIZE, page_size: int = LOOKUP_PAGE_SIZE, listen: bool = True,
+                 connect: Optional[Callable[[dict], object]] = None):
+        self.config = config or get_db_config()
+        self._connect = connect or connect_readonly
+        self.pool = pool or ConnectionPool(lambda: self._connect(self.config), maxconn=DB_POOL_SIZE)
+        self.cache_size = cache_size
+        self.page_size = page_size
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict = OrderedDict()
+        # bumped whenever the cache is dropped, so results read before are not cached after
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._listen = listen
+        self._listener = None
+        self._connecting = False
+        self._listen_retry_at = 0.0
+        _lookups.add(self)
+
+    def invalidate(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self._cache.clear()
+        self._generation += 1
+
+    def close(self):
+        """Close the connections of the lookup."""
+        _lookups.discard(self)
+        with self._lock:
+            if self._listener is not None:
+                self._listener.close()
+                self._listener = None
+        self.pool.closeall()
+
+    def _check_loaded(self) -> bool:
+        """Drop the cache when a load was notified since the last lookup. Returns whether results can be
+        cached, which they cannot while nothing listens for loads.
+
+        The listening connection is opened outside the lock, by one thread at a time, and after a failure
+        only once LOOKUP_LISTEN_RETRY seconds passed, so lookups never wait on connection attempts.
+        """
+        if not self._listen:
+            return True
+        with self._lock:
+            listener = self._listener
+            if listener is not None and not listener.closed:
+                try:
+                    listener.poll()
+                except Exception as e:
+                    logger.warning(f"Lost the connection listening for loads: {e}")
+                    self._listener = None
+                    self._clear()
+                    return False
+                if listener.notifies:
+                    listener.notifies.clear()
+                    self._clear()
+                return True
+            if self._connecting or time.monotonic() < self._listen_retry_at:
+                return False
+            self._connecting = True
+        try:
+            listener = self._connect(self.config)
+            listener.cursor().execute(f"LISTEN {LOADED_CHANNEL}")
+        except Exception as e:
+            logger.warning(f"Could not listen for loads, lookups are not cached for {LOOKUP_LISTEN_RETRY}s: {e}")
+            with self._lock:
+                self._connecting = False
+                self._listen_retry_at = time.monotonic() + LOOKUP_LISTEN_RETRY
+            return False
+        with self._lock:
+            self._connecting = False
+            self._listener = listener
+            # loads may have happened while nothing listened
+            self._clear()
+        return True
+
+    def _execute(self, name: str, *args) -> list:
+        """Rows of a prepared statement, preparing it first on connections that have not yet."""
+        from psycopg2.errors import InvalidSqlStatementName
+        call = f"EXECUTE lookup_{name} ({', '.join(['%s'] * len(args))})"
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(call, args)
+            except InvalidSqlStatementName:
+                # prepared statements outlive transactions, so they are prepared once per connection
+                conn.rollback()
+                cursor.execute(f"PREPARE lookup_{name} AS {STATEMENTS[name]}")
+                cursor.execute(call, args)
+            return cursor.fetchall()
+
+    def _cached(self, key: tuple, query: Callable[[], object]):
+        cacheable = self._check_loaded()
+        with self._lock:
+            if cacheable and key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            generation = self._generation
+        value = query()
+        with self._lock:
+            self.misses += 1
+            if cacheable and generation == self._generation:
+                self._cache[key] = value
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return value
+
+    def _page(self, name: str, key: str, after: str, limit: Optional[int], item: Callable) -> Page:
+        limit = limit or self.page_size
+
+        def query():
+            # one row more than the page tells whether there is a next page
+            rows = self._execute(name, key, after, limit + 1)
+            items = tuple(item(row) for row in rows[:limit])
+            return Page(items, rows[limit - 1][0] if len(rows) > limit else None)
+        return self._cached((name, key, after, limit), query)
+
+    def gene(self, hgnc_id: str) -> Optional[Gene]:
+        """The gene of an HGNC ID, None when it was not loaded."""
+        return self._cached(('gene_by_id', hgnc_id), lambda: self._gene('gene_by_id', hgnc_id))
+
+    def gene_by_symbol(self, symbol: str) -> Optional[Gene]:
+        """The gene of an HGNC symbol, None when it was not loaded."""
+        return self._cached(('gene_by_symbol', symbol), lambda: self._gene('gene_by_symbol', symbol))
+
+    def _gene(self, name: str, key: str) -> Optional[Gene]:
+        rows = self._execute(name, key)
+        return Gene(*rows[0]) if rows else None
+
+    def aliases(self, hgnc_id: str, after: str = '', limit: Optional[int] = None) -> Page:
+        """A page of the aliases of a gene, in alphabetical order, after the alias after."""
+        return self._page('aliases', hgnc_id, after, limit, lambda row: row[0])
+
+    def diseases(self, hgnc_id: str, after: str = '', limit: Optional[int] = None) -> Page:
+        """A page of the diseases of a gene, in alphabetical order, after the disease after."""
+        return self._page('diseases', hgnc_id, after, limit, lambda row: row[0])
+
+    def genes_for_disease(self, disease: str, after: str = '', limit: Optional[int] = None) -> Page:
+        """A page of the genes of a disease, in any case, in HGNC ID order, after the HGNC ID after."""
+        return self._page('genes_for_disease', disease, after, limit, lambda row: Gene(*row))
+
+    def find_diseases(self, text: str, after: str = '', limit: Optional[int] = None) -> Page:
+        """A page of the disease names containing text, in any case, in alphabetical order, after the name after."""
+        text = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return self._page('find_diseases', text, after, limit, lambda row: row[0])
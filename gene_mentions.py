@@ -0,0 +1,159 @@
+import logging
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Shortest symbol and alias matched. Shorter names are mostly abbreviations of other things.
+MIN_SYMBOL_LENGTH = 3
+MIN_ALIAS_LENGTH = 3
+
+# Transitions are keyed by state << CHAR_BITS | code point, which fits every Unicode character
+CHAR_BITS = 21
+
+
+@dataclass(frozen=True)
+class GeneMention:
+    """A gene named in a text, at text[start:end]. kind is 'id', 'symbol' or 'alias'."""
+    hgnc_id: str
+    start: int
+    end: int
+    name: str
+    kind: str
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum()
+
+
+class GeneNameMatcher:
+    """Finds the symbols and aliases of genes in a text in a single pass, with an Aho-Corasick automaton.
+
+    The automaton is built once from a gene dictionary. Its transitions are kept in one dict keyed
+    by state and character rather than a dict per state, which keeps a dictionary of the ~40k HGNC
+    symbols and their aliases to a few tens of MB. Each state stores the name that ends there, if
+    any, and a link to the longest proper suffix that is also a name, so every name ending at a
+    position is reported without walking failure links that end no name.
+
+    Names are matched case-sensitively and only as whole words: the characters around a mention
+    must not be letters or digits, so APOL1 is found in "APOL1-associated" but not in "APOL11".
+    Where mentions overlap, the longest one starting first is kept. A symbol always names its own
+    gene. Symbols shorter than MIN_SYMBOL_LENGTH are left out, as are aliases that are also a symbol,
+    belong to several genes, are shorter than MIN_ALIAS_LENGTH or are only digits, since they cannot be
+    mapped back to a single gene.
+    """
+
+    def __init__(self, genes: Iterable[Tuple[str, str, List[str]]]):
+        names = self._names(genes)
+        self._goto: Dict[int, int] = {}
+        self._fail: List[int] = [0]
+        self._depth: List[int] = [0]
+        # index in self._patterns of the name ending in each state, or -1
+        self._output: List[int] = [-1]
+        self._output_link: List[int] = [0]
+        self._patterns: List[Tuple[str, str, str]] = []
+        for name, (hgnc_id, kind) in names.items():
+            self._add(name, hgnc_id, kind)
+        self._link()
+        logger.info(f"Built gene name matcher of {len(self._patterns)} names with {len(self._depth)} states")
+
+    @staticmethod
+    def _names(genes: Iterable[Tuple[str, str, List[str]]]) -> Dict[str, Tuple[str, str]]:
+        symbols: Dict[str, str] = {}
+        aliases: Dict[str, set] = {}
+        for hgnc_id, symbol, gene_aliases in genes:
+            if symbol and len(symbol) >= MIN_SYMBOL_LENGTH:
+                symbols[symbol] = hgnc_id
+            for alias in gene_aliases or []:
+                if len(alias) >= MIN_ALIAS_LENGTH and not alias.isdigit():
+                    aliases.setdefault(alias, set()).add(hgnc_id)
+        names = {symbol: (hgnc_id, 'symbol') for symbol, hgnc_id in symbols.items()}
+        ambiguous = 0
+        for alias, hgnc_ids in aliases.items():
+            if alias in symbols:
+                continue
+            if len(hgnc_ids) > 1:
+                ambiguous += 1
+                continue
+            names[alias] = (next(iter(hgnc_ids)), 'alias')
+        if ambiguous:
+            logger.info(f"Left out {ambiguous} aliases shared by several genes")
+        return names
+
+    def _add(self, name: str, hgnc_id: str, kind: str):
+        state = 0
+        for ch in name:
+            key = state << CHAR_BITS | ord(ch)
+            next_state = self._goto.get(key)
+            if next_state is None:
+                next_state = len(self._depth)
+                self._goto[key] = next_state
+                self._fail.append(0)
+                self._depth.append(self._depth[state] + 1)
+                self._output.append(-1)
+                self._output_link.append(0)
+            state = next_state
+        self._output[state] = len(self._patterns)
+        self._patterns.append((name, hgnc_id, kind))
+
+    def _link(self):
+        """Compute the failure and output links, parents before children."""
+        mask = (1 << CHAR_BITS) - 1
+        edges = sorted(self._goto.items(), key=lambda edge: self._depth[edge[1]])
+        for key, state in edges:
+            parent, code = key >> CHAR_BITS, key & mask
+            if parent == 0:
+                continue
+            fallback = self._fail[parent]
+            while True:
+                target = self._goto.get(fallback << CHAR_BITS | code)
+                if target is not None:
+                    self._fail[state] = target
+                    break
+                if fallback == 0:
+                    break
+                fallback = self._fail[fallback]
+            suffix = self._fail[state]
+            self._output_link[state] = suffix if self._output[suffix] >= 0 else self._output_link[suffix]
+
+    def find(self, text: str) -> List[GeneMention]:
+        """Mentions of the dictionary's genes in text, by position."""
+        goto, fail, output, output_link = self._goto, self._fail, self._output, self._output_link
+        candidates = []
+        state = 0
+        for end, ch in enumerate(text, 1):
+            code = ord(ch)
+            while True:
+                next_state = goto.get(state << CHAR_BITS | code)
+                if next_state is not None:
+                    state = next_state
+                    break
+                if state == 0:
+                    break
+                state = fail[state]
+            match = state if output[state] >= 0 else output_link[state]
+            while match:
+                candidates.append((end, output[match]))
+                match = output_link[match]
+        return self._select(text, candidates)
+
+    def _select(self, text: str, candidates: List[Tuple[int, int]]) -> List[GeneMention]:
+        """Keep the whole-word candidates, and the longest of those that overlap."""
+        mentions = []
+        for end, index in candidates:
+            name, hgnc_id, kind = self._patterns[index]
+            start = end - len(name)
+            if start > 0 and _is_word_char(text[start - 1]) and _is_word_char(name[0]):
+                continue
+            if end < len(text) and _is_word_char(text[end]) and _is_word_char(name[-1]):
+                continue
+            mentions.append(GeneMention(hgnc_id, start, end, name, kind))
+        mentions.sort(key=lambda mention: (mention.start, -mention.end))
+        selected = []
+        for mention in mentions:
+            if not selected or mention.start >= selected[-1].end:
+                selected.append(mention)
+        return selected
+
+    def __len__(self) -> int:
+        return len(self._patterns)
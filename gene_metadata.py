@@ -2,18 +2,113 @@ import csv
 import os
 import re
 import logging
-from typing import Optional, List
-from dataclasses import dataclass, field
-import PyPDF2
+import itertools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, Optional, List, Tuple
+from dataclasses import asdict, dataclass, field
 import requests
-import mygene
 from xml.etree import ElementTree as ET
-from fuzzywuzzy import fuzz
+import http_client
+import metrics
+from config import OUTPUT_DIR
+from disease_matcher import DiseaseMatcher
+from response_cache import MISS, ResponseCache, cache_key
+from pdf_cache import PdfText, PdfTextCache, file_digest
+from reference_store import ReferenceStore, read_hgnc_genes
+from gene_mentions import GeneMention, GeneNameMatcher
+from text_windows import TextSegments, parse_window
+from run_journal import RunJournal, content_run, open_journal
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Processes extracting PDF pages, for PDFs with at least PDF_PARALLEL_MIN_PAGES pages
+PDF_WORKERS = int(os.getenv('PDF_WORKERS', str(os.cpu_count() or 1)))
+PDF_PARALLEL_MIN_PAGES = 32
+
+# Cache of the text and HGNC IDs extracted from each PDF, empty to disable. Bump
+# PDF_EXTRACTOR_REVISION whenever text or HGNC ID extraction changes, to invalidate it.
+PDF_CACHE = os.getenv('PDF_CACHE', os.path.join('cache', 'pdf'))
+PDF_EXTRACTOR_REVISION = 1
+
+# PyPDF2 is imported where it is used, so that stages which do not read PDFs (see main.py) do not
+# pay for importing it.
+
+# Headers of the CSV files
+POSITION_COLUMNS = ['chr', 'start', 'end', 'strand']
+CSV_HEADERS = {
+    'hgnc_gene': ['hgnc_id', 'hgnc_gene_name', 'hg38', 'hg19'] +
+                 [f'{assembly}_{column}' for assembly in ('hg38', 'hg19') for column in POSITION_COLUMNS],
+    'gene_aliases': ['hgnc_id', 'alias'],
+    'gene_diseases': ['hgnc_id', 'disease'],
+}
+
+# Journals of the genes resolved by unfinished runs, which a restarted run resumes from. Empty to disable.
+JOURNAL_DIR = os.getenv('JOURNAL_DIR', os.path.join('cache', 'journal'))
+
+# Upstream services, overridable to point at a mirror or a local stub server
+EUTILS_URL = os.getenv('EUTILS_URL', 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils')
+MYGENE_URL = os.getenv('MYGENE_URL', 'https://mygene.info/v3')
+
+# MyGene fields used to build a GeneDisease, and the most IDs MyGene resolves per request
+GENE_FIELDS = 'symbol,alias,genomic_pos_hg19,genomic_pos'
+MYGENE_BATCH_SIZE = 1000
+
+# Persistent cache of MyGene records and ClinVar diseases. An empty RESPONSE_CACHE disables it,
+# CACHE_ONLY=1 never goes to the network and skips whatever is not cached.
+RESPONSE_CACHE = os.getenv('RESPONSE_CACHE', os.path.join('cache', 'responses.sqlite'))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', str(7 * 24 * 3600)))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+CACHE_ONLY = os.getenv('CACHE_ONLY', '').lower() in ('1', 'true', 'yes')
+
+# Local store of HGNC genes and ClinVar traits built from bulk files (see reference_store.py). When
+# set, genes and diseases are looked up in it instead of MyGene and E-utilities.
+REFERENCE_STORE = os.getenv('REFERENCE_STORE', '')
+
+# GENE_NAMES=1 also finds genes named by symbol or alias, not only by HGNC ID. The names come from
+# the reference store when REFERENCE_STORE is set, else from the HGNC complete set in HGNC_COMPLETE_SET.
+GENE_NAMES = os.getenv('GENE_NAMES', '').lower() in ('1', 'true', 'yes')
+HGNC_COMPLETE_SET = os.getenv('HGNC_COMPLETE_SET', '')
+
+# Text diseases are matched in: 'document' (default) for the whole text, or only around the mentions of
+# each gene, 'section' for the sections it is mentioned in or a number of sentences on each side of them
+DISEASE_WINDOW = os.getenv('DISEASE_WINDOW', '')
+
+# Number of ClinVar variant summaries requested per esummary page, and bytes parsed at a time
+CLINVAR_BATCH_SIZE = int(os.getenv('CLINVAR_BATCH_SIZE', '500'))
+XML_CHUNK_SIZE = 64 * 1024
+
+HGNC_ID_PATTERN = re.compile(r"(HGNC:\d+)")
+
+
+@dataclass
+class GenomicPosition:
+    """Location of a gene on an assembly, 1-based and inclusive as MyGene reports it."""
+    chr: str
+    start: int
+    end: int
+    strand: Optional[int] = None
+
+    @classmethod
+    def from_mygene(cls, coords) -> Optional["GenomicPosition"]:
+        """The position in a MyGene genomic_pos field, the first one when there are several, or None."""
+        if isinstance(coords, list):
+            coords = coords[0] if coords else {}
+        try:
+            strand = coords.get('strand')
+            position = cls(chr=str(coords['chr']), start=int(coords['start']), end=int(coords['end']),
+                           strand=int(strand) if strand is not None else None)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return None
+        # the database indexes [start, end] ranges, which cannot be inverted
+        return position if position.start <= position.end else None
+
+    def columns(self) -> list:
+        return [self.chr, self.start, self.end, self.strand]
+
 
 @dataclass
 class GeneDisease:
@@ -24,81 +119,345 @@ class GeneDisease:
     hg38: Optional[str] = None
     hg19: Optional[str] = None
     diseases: Optional[List] = None
+    hg38_pos: Optional[GenomicPosition] = None
+    hg19_pos: Optional[GenomicPosition] = None
 
+    @classmethod
+    def from_dict(cls, data: dict) -> "GeneDisease":
+        """The GeneDisease of a dict made by dataclasses.asdict, e.g. read back from a run journal."""
+        data = dict(data)
+        for name in ('hg38_pos', 'hg19_pos'):
+            if data.get(name) is not None:
+                data[name] = GenomicPosition(**data[name])
+        return cls(**data)
 
-def read_pdf_file(filename: str) -> str:
-    """Reads a PDF file into text."""
+
+def _extract_page(page) -> Tuple[str, Optional[str]]:
+    """Extract the text of a PDF page, and the error if it failed."""
+    try:
+        return page.extract_text() or "", None
+    except Exception as e:
+        return "", str(e)
+
+
+def _extract_page_range(filename: str, start: int, stop: int) -> List[Tuple[str, Optional[str]]]:
+    """Extract the text of pages start to stop - 1 of a PDF file, in a worker process."""
+    import PyPDF2
+    with open(filename, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        return [_extract_page(reader.pages[i]) for i in range(start, stop)]
+
+
+def iter_pdf_pages(filename: str, workers: Optional[int] = None) -> Iterator[str]:
+    """Yield the text of each page of a PDF file, in order, as soon as it is extracted.
+
+    PDFs of at least PDF_PARALLEL_MIN_PAGES pages are split into page ranges extracted by a pool
+    of `workers` processes (env PDF_WORKERS, default one per CPU). Pages that fail are logged and
+    yield no text.
+    """
     logger.info(f"Starting PDF file reading for {filename}")
     if not os.path.exists(filename):
         logger.error(f"PDF file {filename} not found.")
         raise FileNotFoundError(f"PDF file {filename} not found")
+    if workers is None:
+        workers = PDF_WORKERS
 
+    import PyPDF2
     try:
         with open(filename, 'rb') as file:
             reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page_num, page in enumerate(reader.pages, 1):
-                try:
-                    page_text = page.extract_text() or ""
-                    text += page_text
-                except Exception as e:
-                    logger.warning(f"Failed to extract text from page {page_num} in {filename}: {e}")
-            logger.info(f"Completed PDF file reading for {filename}, extracted {len(text)} characters")
-            return text
+            page_count = len(reader.pages)
+            if workers <= 1 or page_count < PDF_PARALLEL_MIN_PAGES:
+                for page_num, page in enumerate(reader.pages, 1):
+                    page_text, error = _extract_page(page)
+                    if error:
+                        logger.warning(f"Failed to extract text from page {page_num} in {filename}: {error}")
+                    yield page_text
+                return
+
+        # a few ranges per worker, so that the first pages are yielded early
+        size = -(-page_count // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_extract_page_range, filename, start, min(start + size, page_count))
+                       for start in range(0, page_count, size)]
+            page_num = 0
+            for future in futures:
+                for page_text, error in future.result():
+                    page_num += 1
+                    if error:
+                        logger.warning(f"Failed to extract text from page {page_num} in {filename}: {error}")
+                    yield page_text
     except Exception as e:
         logger.error(f"Error reading PDF file {filename}: {e}")
         raise
 
 
-def get_diseases(gene_symbol: str) -> set:
-    """Get diseases associated with this gene using Entrez and ClinVar."""
-    logger.info(f"Fetching diseases for gene symbol {gene_symbol}")
-    try:
-        # Get ClinVar IDs for the gene
-        esearch_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
-        params = {
-            "schema": "clinvar",
-            "term": f"{gene_symbol}[gene]",
-            "retmax": 100,
-            "retmode": "json"
-        }
-        response = requests.get(esearch_url, params=params, timeout=10)
-        response.raise_for_status()
-        esearch_data = response.json()
-        id_list = esearch_data.get("esearchresult", {}).get("idlist", [])
-        if not id_list:
-            logger.info(f"No ClinVar IDs found for gene {gene_symbol}.")
-            return set()
-
-        # Get diseases for these variants from ClinVar
-        esummary_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi"
-        params = {
-            "schema": "clinvar",
-            "id": ",".join(id_list),
+def read_pdf_file(filename: str, workers: Optional[int] = None) -> str:
+    """Reads a PDF file into text."""
+    text = "".join(iter_pdf_pages(filename, workers))
+    logger.info(f"Completed PDF file reading for {filename}, extracted {len(text)} characters")
+    return text
+
+
+@lru_cache(maxsize=1)
+def get_pdf_cache() -> Optional[PdfTextCache]:
+    """Open the cache of extracted PDF text, or None when it is disabled."""
+    if not PDF_CACHE:
+        return None
+    import PyPDF2
+    return PdfTextCache(PDF_CACHE, f"{PDF_EXTRACTOR_REVISION}-PyPDF2-{PyPDF2.__version__}")
+
+
+@metrics.stage('load_pdf')
+def load_pdf(fname: str, workers: Optional[int] = None) -> Tuple[str, set]:
+    """Read a PDF file and extract its HGNC gene IDs, reusing a previous extraction of the same content.
+
+    With GENE_NAMES=1, genes named by symbol or alias are added. They are found in the text on
+    every run, so the cached extraction does not depend on the gene dictionary.
+    """
+    text, hgnc_ids = _load_pdf_text(fname, workers)
+    matcher = get_gene_name_matcher()
+    if matcher is not None:
+        with metrics.stage('find_gene_names'):
+            hgnc_ids |= {mention.hgnc_id for mention in matcher.find(text)}
+    return text, hgnc_ids
+
+
+def _load_pdf_text(fname: str, workers: Optional[int] = None) -> Tuple[str, set]:
+    cache = get_pdf_cache()
+    if cache is None:
+        text = read_pdf_file(fname, workers)
+        return text, extract_hgnc_gene_ids(text)
+
+    digest = file_digest(fname)
+    pdf_text = cache.get(digest)
+    if pdf_text is not None:
+        logger.info(f"Using cached text of PDF {fname} ({len(pdf_text.text)} characters)")
+        return pdf_text.text, set(pdf_text.hgnc_ids)
+    pages = list(iter_pdf_pages(fname, workers))
+    pdf_text = PdfText.from_pages(pages, [])
+    hgnc_ids = extract_hgnc_gene_ids(pdf_text.text)
+    pdf_text.hgnc_ids = sorted(hgnc_ids, key=hgnc_sort_key)
+    cache.put(digest, pdf_text)
+    logger.info(f"Completed PDF file reading for {fname}, extracted {len(pdf_text.text)} characters")
+    return pdf_text.text, hgnc_ids
+
+
+@lru_cache(maxsize=1)
+def get_response_cache() -> Optional[ResponseCache]:
+    """Open the persistent response cache, or None when it is disabled."""
+    if not RESPONSE_CACHE:
+        return None
+    cache_dir = os.path.dirname(RESPONSE_CACHE)
+    if cache_dir and not os.path.exists(cache_dir):
+        logger.info(f"Creating cache directory {cache_dir}.")
+        os.makedirs(cache_dir, exist_ok=True)
+    return ResponseCache(RESPONSE_CACHE, ttl=RESPONSE_CACHE_TTL, max_bytes=RESPONSE_CACHE_MAX_BYTES)
+
+
+@lru_cache(maxsize=1)
+def get_reference_store() -> Optional[ReferenceStore]:
+    """Open the local reference store, or None when genes are resolved online."""
+    if not REFERENCE_STORE:
+        return None
+    if not os.path.exists(REFERENCE_STORE):
+        raise FileNotFoundError(f"Reference store {REFERENCE_STORE} does not exist")
+    return ReferenceStore(REFERENCE_STORE)
+
+
+@lru_cache(maxsize=1)
+def get_gene_name_matcher() -> Optional[GeneNameMatcher]:
+    """Build the matcher of gene symbols and aliases, or None when genes are only found by HGNC ID."""
+    if not GENE_NAMES:
+        return None
+    store = get_reference_store()
+    if store is not None:
+        return GeneNameMatcher(store.gene_names())
+    if not HGNC_COMPLETE_SET:
+        raise ValueError("GENE_NAMES needs REFERENCE_STORE or HGNC_COMPLETE_SET for the gene symbols and aliases")
+    return GeneNameMatcher(read_hgnc_genes(HGNC_COMPLETE_SET))
+
+
+def fetch_clinvar_summaries(gene_symbol: str, batch_size: Optional[int] = None) -> Iterator[Iterator[bytes]]:
+    """Yield the ClinVar esummary XML of all variants of a gene, one page of batch_size variants at a time.
+
+    The search results are kept on the E-utilities history server, so the variant IDs never
+    travel in URLs. Each page is yielded as an iterator over the chunks of the response body,
+    which must be consumed before the next page is requested.
+    """
+    if batch_size is None:
+        batch_size = CLINVAR_BATCH_SIZE
+    # Get ClinVar IDs for the gene
+    esearch_url = f"{EUTILS_URL}/esearch.fcgi"
+    params = {
+        "db": "clinvar",
+        "term": f"{gene_symbol}[gene]",
+        "usehistory": "y",
+        "retmax": 0,
+        "retmode": "json"
+    }
+    response = http_client.get(esearch_url, params=params, timeout=10)
+    response.raise_for_status()
+    esearch_result = response.json().get("esearchresult", {})
+    count = int(esearch_result.get("count", 0))
+    if not count:
+        logger.info(f"No ClinVar IDs found for gene {gene_symbol}.")
+        return
+    logger.info(f"Found {count} ClinVar IDs for gene {gene_symbol}")
+
+    # Get diseases for these variants from ClinVar
+    esummary_url = f"{EUTILS_URL}/esummary.fcgi"
+    for retstart in range(0, count, batch_size):
+        data = {
+            "db": "clinvar",
+            "query_key": esearch_result.get("querykey"),
+            "WebEnv": esearch_result.get("webenv"),
+            "retstart": retstart,
+            "retmax": batch_size,
             "retmode": "xml"
         }
-        response = requests.get(esummary_url, params=params, timeout=10)
-        response.raise_for_status()
-        diseases = []
-        root = ET.fromstring(response.content)
-        for doc in root.findall(".//DocumentSummary"):
-            trait_set = doc.find(".//trait_set")
-            if trait_set is not None:
+        with http_client.post(esummary_url, data=data, timeout=30, stream=True) as response:
+            response.raise_for_status()
+            yield metrics.count_bytes('esummary', response.iter_content(chunk_size=XML_CHUNK_SIZE))
+
+
+def collect_traits(esummary_xml: Iterable[bytes], traits: set):
+    """Add the disease names of a ClinVar esummary XML page to traits.
+
+    The XML is parsed incrementally from its chunks. For each DocumentSummary, the names of the
+    traits in its first trait_set are collected as soon as that trait_set is complete, and the
+    DocumentSummary is discarded once it ends, so memory does not grow with the number of variants.
+    """
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    path = []
+    trait_set = None
+    for chunk in itertools.chain(esummary_xml, [None]):
+        if chunk is None:
+            parser.close()
+        else:
+            parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == 'start':
+                path.append(elem)
+                if elem.tag == 'DocumentSummary':
+                    trait_set = None
+                elif elem.tag == 'trait_set' and trait_set is None:
+                    trait_set = elem
+                continue
+            path.pop()
+            if elem is trait_set:
                 for trait in trait_set.findall(".//trait"):
                     trait_name = trait.find(".//trait_name")
                     if trait_name is not None and trait_name.text:
                         if trait_name.text not in ['not specified', 'not provided']:
-                            diseases.append(trait_name.text)
-        logger.info(f"Retrieved {len(diseases)} diseases for gene {gene_symbol}")
-        return set(diseases)
+                            traits.add(trait_name.text)
+            elif elem.tag == 'DocumentSummary':
+                elem.clear()
+                if path:
+                    path[-1].remove(elem)
+
+
+@metrics.stage('get_diseases')
+def get_diseases(gene_symbol: str) -> Optional[set]:
+    """Get diseases associated with this gene using Entrez and ClinVar.
+
+    Returns None when they could not be fetched, so a failed lookup is not taken for a gene without diseases.
+    """
+    logger.info(f"Fetching diseases for gene symbol {gene_symbol}")
+    store = get_reference_store()
+    if store:
+        diseases = store.traits(gene_symbol)
+        logger.info(f"Retrieved {len(diseases)} diseases for gene {gene_symbol} from the reference store")
+        return diseases
+    cache = get_response_cache()
+    key = cache_key('clinvar', term=f"{gene_symbol.upper()}[gene]", retmax=None)
+    if cache:
+        diseases = cache.get(key)
+        if diseases is not MISS:
+            logger.info(f"Retrieved {len(diseases)} cached diseases for gene {gene_symbol}")
+            return set(diseases)
+    if CACHE_ONLY:
+        logger.warning(f"Diseases for gene {gene_symbol} are not cached, skipping in cache-only mode.")
+        return None
+
+    try:
+        traits = set()
+        for page in fetch_clinvar_summaries(gene_symbol):
+            collect_traits(page, traits)
+        logger.info(f"Retrieved {len(traits)} diseases for gene {gene_symbol}")
+        if cache:
+            cache.put(key, sorted(traits))
+        return traits
     except requests.RequestException as e:
         logger.error(f"Network error while fetching diseases for {gene_symbol}: {e}")
-        return set()
+        return None
     except Exception as e:
         logger.error(f"Unexpected error while fetching diseases for {gene_symbol}: {e}")
-        return set()
+        return None
+
+
+@lru_cache(maxsize=4)
+def get_disease_matcher(text: str) -> DiseaseMatcher:
+    """Index the text for disease matching, once per document."""
+    return DiseaseMatcher(text)
+
+
+@lru_cache(maxsize=4)
+def get_text_segments(text: str) -> TextSegments:
+    """Split the text into sentences and sections, once per document."""
+    return TextSegments(text)
+
+
+@lru_cache(maxsize=4)
+def get_document_mentions(text: str) -> Dict[str, List[int]]:
+    """Offsets of the mentions of each gene in the text, found once per document."""
+    offsets: Dict[str, List[int]] = {}
+    for mention in find_gene_mentions(text):
+        offsets.setdefault(mention.hgnc_id, []).append(mention.start)
+    return offsets
+
+
+def gene_mention_offsets(gd: GeneDisease, text: str) -> List[int]:
+    """Offsets of the mentions of a gene in text, by HGNC ID and, with or without GENE_NAMES, by its symbol
+    and aliases."""
+    offsets = list(get_document_mentions(text).get(gd.hgnc_id, []))
+    if get_gene_name_matcher() is None and gd.symbol:
+        offsets.extend(mention.start for mention in GeneNameMatcher([(gd.hgnc_id, gd.symbol, gd.aliases)]).find(text))
+    return sorted(offsets)
 
 
+def get_disease_window() -> Tuple[bool, Optional[int]]:
+    """The parsed DISEASE_WINDOW. Runs check it before any work, so an invalid value fails the run
+    instead of failing every gene."""
+    try:
+        return parse_window(DISEASE_WINDOW)
+    except ValueError as e:
+        logger.error(f"{e}")
+        raise
+
+
+def disease_window(gd: GeneDisease, text: str) -> Optional[str]:
+    """The text to match a gene's diseases in with DISEASE_WINDOW, or None to match them in the whole text."""
+    windowed, sentences = get_disease_window()
+    if not windowed:
+        return None
+    return get_text_segments(text).window(gene_mention_offsets(gd, text), sentences)
+
+
+def match_gene_diseases(gd: GeneDisease, text: str) -> List[str]:
+    """The diseases of a gene found in text, or only in the text around its mentions with DISEASE_WINDOW."""
+    window = disease_window(gd, text)
+    if window is None:
+        matcher = get_disease_matcher(text)
+    else:
+        # windows are a few paragraphs, quicker to index than to look up in a cache
+        matcher = DiseaseMatcher(window)
+        logger.info(f"Matching diseases of {gd.symbol} in {len(window)} of {len(text)} characters")
+    metrics.inc('disease_text_chars', len(text if window is None else window))
+    return matcher.filter(gd.diseases or [])
+
+
+@metrics.stage('filter_diseases')
 def filter_diseases(gd: GeneDisease, text: str):
     """Filter disease associations by presence in text."""
     logger.info(f"Filtering diseases for gene {gd.symbol}")
@@ -106,25 +465,123 @@ def filter_diseases(gd: GeneDisease, text: str):
         logger.info(f"No diseases to filter for gene {gd.symbol}.")
         return
 
-    for d in gd.diseases:
-        for line in text.splitlines():
-            similarity = fuzz.ratio(line.lower(), d.lower())
-            if similarity > 60:
-                if d not in gd.flt_diseases:
-                    gd.flt_diseases.append(d)
+    for d in match_gene_diseases(gd, text):
+        if d not in gd.flt_diseases:
+            gd.flt_diseases.append(d)
+    metrics.inc('diseases_filtered', len(gd.diseases))
+    metrics.inc('diseases_matched', len(gd.flt_diseases))
     logger.info(f"Filtered {len(gd.flt_diseases)} diseases for gene {gd.symbol}")
 
 
-def add_metadata_to_gene(hgnc_id: str, text: str) -> Optional[GeneDisease]:
-    """Get metadata for this HGNC gene and create GeneDisease object."""
+def query_mygene(method: str, **params):
+    """Send a query to MyGene through http_client, so it is rate limited and retried like other upstreams.
+
+    A GET queries a single term, a POST a batch of comma-separated terms.
+    """
+    if method == 'GET':
+        response = http_client.get(f"{MYGENE_URL}/query", params=params, timeout=30, upstream='mygene')
+    else:
+        response = http_client.post(f"{MYGENE_URL}/query", data=params, timeout=30, upstream='mygene')
+    response.raise_for_status()
+    return response.json()
+
+
+def gene_record_key(hgnc_id: str) -> str:
+    """Cache key of the MyGene record of an HGNC ID."""
+    return cache_key('mygene', hgnc_id=hgnc_id, species='human', fields=GENE_FIELDS)
+
+
+@metrics.stage('get_gene_records')
+def get_gene_records(hgnc_ids: List[str], batch_size: int = MYGENE_BATCH_SIZE) -> Dict[str, dict]:
+    """Resolve HGNC IDs to MyGene records, batch_size IDs per request.
+
+    Cached records are used first, only the remaining IDs are sent to MyGene. A batch that still fails
+    once http_client gave up retrying it is queried again one ID at a time, so that a failure only
+    leaves out the IDs it concerns, each logged. With a reference store, all IDs are looked up in it instead.
+    """
+    store = get_reference_store()
+    if store:
+        records = store.gene_records(hgnc_ids)
+        logger.info(f"Resolved {len(records)} of {len(hgnc_ids)} HGNC IDs with the reference store")
+        return records
+    logger.info(f"Resolving {len(hgnc_ids)} HGNC IDs with MyGene")
+    cache = get_response_cache()
+    records = {}
+    if cache:
+        for hgnc_id in hgnc_ids:
+            record = cache.get(gene_record_key(hgnc_id))
+            if record is not MISS:
+                records[hgnc_id] = record
+    missing = [hgnc_id for hgnc_id in hgnc_ids if hgnc_id not in records]
+    if missing and CACHE_ONLY:
+        logger.warning(f"{len(missing)} HGNC IDs are not cached, skipping them in cache-only mode.")
+        missing = []
+
+    for start in range(0, len(missing), batch_size):
+        # MyGene stores HGNC IDs without the HGNC: prefix
+        batch = {hgnc_id.split(':')[1]: hgnc_id for hgnc_id in missing[start:start + batch_size]}
+        try:
+            hits = query_mygene('POST', q=','.join(batch), scopes='HGNC', species='human', fields=GENE_FIELDS)
+        except Exception as e:
+            logger.warning(f"Error resolving HGNC IDs {start + 1}-{start + len(batch)} with MyGene, "
+                           f"querying them one at a time: {e}")
+            for hgnc_id in batch.values():
+                try:
+                    record = query_gene_record(hgnc_id)
+                except Exception as e:
+                    logger.error(f"Error resolving HGNC ID {hgnc_id} with MyGene, skipping it: {e}")
+                    continue
+                if record is not None:
+                    records[hgnc_id] = record
+            continue
+        for hit in hits:
+            hgnc_id = batch.get(str(hit.get('query')))
+            # keep the first hit for each ID, as a single query would
+            if hgnc_id and not hit.get('notfound') and hgnc_id not in records:
+                records[hgnc_id] = hit
+                if cache:
+                    cache.put(gene_record_key(hgnc_id), hit)
+    logger.info(f"Resolved {len(records)} of {len(hgnc_ids)} HGNC IDs with MyGene")
+    return records
+
+
+def query_gene_record(hgnc_id: str) -> Optional[dict]:
+    """Get the MyGene record of a single HGNC ID."""
+    store = get_reference_store()
+    if store:
+        return store.gene_records([hgnc_id]).get(hgnc_id)
+    cache = get_response_cache()
+    key = gene_record_key(hgnc_id)
+    if cache:
+        record = cache.get(key)
+        if record is not MISS:
+            return record
+    if CACHE_ONLY:
+        logger.warning(f"Gene info for HGNC ID {hgnc_id} is not cached, skipping in cache-only mode.")
+        return None
+    gene_info = query_mygene('GET', q=hgnc_id, species='human', fields=GENE_FIELDS)
+    if not gene_info.get('hits'):
+        return None
+    record = gene_info['hits'][0]
+    if cache:
+        cache.put(key, record)
+    return record
+
+
+@metrics.stage('resolve_gene')
+def resolve_gene(hgnc_id: str, gene_data: Optional[dict] = None) -> Optional[GeneDisease]:
+    """Get metadata and all ClinVar diseases for this HGNC gene, before filtering them by any text.
+
+    gene_data is the gene's MyGene record when it was already resolved by get_gene_records,
+    otherwise it is queried here.
+    """
     logger.info(f"Retrieving metadata for HGNC ID {hgnc_id}")
     try:
-        mg = mygene.MyGeneInfo()
-        gene_info = mg.query(hgnc_id, species='human', fields='symbol,alias,genomic_pos_hg19,genomic_pos')
-        if not gene_info.get('hits'):
-            logger.warning(f"No gene info found for HGNC ID {hgnc_id}.")
-            return None
-        gene_data = gene_info['hits'][0]
+        if gene_data is None:
+            gene_data = query_gene_record(hgnc_id)
+            if gene_data is None:
+                logger.warning(f"No gene info found for HGNC ID {hgnc_id}.")
+                return None
         gene_symbol = gene_data.get('symbol')
         if not gene_symbol:
             logger.error(f"Unable to get symbol for gene {hgnc_id}.")
@@ -154,22 +611,70 @@ def add_metadata_to_gene(hgnc_id: str, text: str) -> Optional[GeneDisease]:
             aliases=aliases,
             hg19=hg19_str,
             hg38=hg38_str,
-            diseases=list(diseases)
+            # None when the lookup failed, so the gene is not journaled as complete
+            diseases=sorted(diseases) if diseases is not None else None,
+            hg38_pos=GenomicPosition.from_mygene(hg38_coords),
+            hg19_pos=GenomicPosition.from_mygene(hg19_coords)
         )
-        filter_diseases(gene_disease, text)
-        logger.info(
-            f"Created GeneDisease object for {gene_symbol} with {len(gene_disease.flt_diseases)} filtered diseases")
         return gene_disease
     except Exception as e:
         logger.error(f"Error retrieving metadata for {hgnc_id}: {e}")
         return None
 
 
+def resolve_journaled_gene(hgnc_id: str, gene_data: Optional[dict] = None,
+                           journal: Optional[RunJournal] = None) -> Optional[GeneDisease]:
+    """Resolve a gene as resolve_gene does, or replay it from the journal of an interrupted run.
+
+    Genes resolved here are recorded in the journal before they are used, so a restarted run
+    does not fetch them again. Genes that could not be resolved, or whose diseases could not be
+    fetched, are not, and are retried.
+    """
+    if journal is not None:
+        entry = journal.get(hgnc_id)
+        if entry is not None:
+            logger.info(f"Resuming HGNC ID {hgnc_id} from the run journal")
+            return GeneDisease.from_dict(entry)
+    gene_disease = resolve_gene(hgnc_id, gene_data)
+    if journal is not None and gene_disease is not None:
+        if gene_disease.diseases is None:
+            logger.warning(f"Not journaling HGNC ID {hgnc_id}, its diseases are retried by a resumed run")
+        else:
+            journal.record(hgnc_id, asdict(gene_disease))
+    return gene_disease
+
+
+def add_metadata_to_gene(hgnc_id: str, text: str, gene_data: Optional[dict] = None,
+                         journal: Optional[RunJournal] = None) -> Optional[GeneDisease]:
+    """Get metadata for this HGNC gene and create GeneDisease object with the diseases found in text."""
+    with metrics.gene(hgnc_id):
+        gene_disease = resolve_journaled_gene(hgnc_id, gene_data, journal)
+        if gene_disease is None:
+            return None
+        try:
+            filter_diseases(gene_disease, text)
+        except Exception as e:
+            logger.error(f"Error filtering diseases for {hgnc_id}: {e}")
+            return None
+    logger.info(
+        f"Created GeneDisease object for {gene_disease.symbol} with {len(gene_disease.flt_diseases)} filtered diseases")
+    return gene_disease
+
+
+def find_gene_mentions(text: str) -> List[GeneMention]:
+    """Mentions of genes in text with their offsets: HGNC IDs, and symbols and aliases with GENE_NAMES=1."""
+    mentions = [GeneMention(match.group(1), match.start(1), match.end(1), match.group(1), 'id')
+                for match in HGNC_ID_PATTERN.finditer(text)]
+    matcher = get_gene_name_matcher()
+    if matcher is not None:
+        mentions.extend(matcher.find(text))
+    return sorted(mentions, key=lambda mention: (mention.start, mention.end))
+
+
 def extract_hgnc_gene_ids(text: str) -> set:
     """Extract HGNC gene IDs from text."""
     logger.info(f"Extracting HGNC gene IDs from text")
-    gene_pattern = re.compile(r"(HGNC:\d+)")
-    hgnc_gene_ids = gene_pattern.findall(text)
+    hgnc_gene_ids = HGNC_ID_PATTERN.findall(text)
     logger.info(f"Extracted {len(hgnc_gene_ids)} HGNC gene IDs")
     return set(hgnc_gene_ids)
 
@@ -185,63 +690,104 @@ def del_file(fname: str):
         logger.error(f"Error deleting file {fname}: {e}")
 
 
-def parse_pdf(fname: str = "pub.pdf"):
-    """Parse PDF file for HGNC gene names, fetch metadata, and write to CSV files."""
+def hgnc_sort_key(hgnc_id: str) -> int:
+    """Sort key ordering HGNC IDs such as HGNC:618 by their number."""
+    return int(hgnc_id.split(':')[1])
+
+
+def gene_rows(gene_disease: GeneDisease) -> Dict[str, List[list]]:
+    """Rows of each output table for a gene. Unknown positions are left empty, which COPY loads as NULL."""
+    positions = []
+    for position in (gene_disease.hg38_pos, gene_disease.hg19_pos):
+        positions.extend(position.columns() if position else [None] * len(POSITION_COLUMNS))
+    return {
+        'hgnc_gene': [[gene_disease.hgnc_id, gene_disease.symbol, gene_disease.hg38, gene_disease.hg19] + positions],
+        'gene_aliases': [[gene_disease.hgnc_id, alias] for alias in gene_disease.aliases or []],
+        'gene_diseases': [[gene_disease.hgnc_id, disease] for disease in gene_disease.flt_diseases],
+    }
+
+
+@metrics.profiled('parse_pdf')
+@metrics.stage('parse_pdf')
+def parse_pdf(fname: str = "pub.pdf", workers: Optional[int] = None, loader=None, write_csv: bool = True,
+              output_dir: Optional[str] = None, journal_dir: Optional[str] = None):
+    """Parse PDF file for HGNC gene names, fetch metadata, and write to CSV files.
+
+    Gene metadata is fetched by a pool of `workers` threads (env FETCH_WORKERS, default 4).
+    Requests to each upstream host are rate limited by http_client, and rows are written
+    in HGNC ID order whatever order the fetches complete in. When a db_loader.StagingLoader
+    is given, each gene's rows are also streamed to it as soon as the gene is resolved, and
+    the CSV files can be skipped with write_csv=False.
+
+    Each resolved gene is recorded in a journal in `journal_dir` (env JOURNAL_DIR). If the run
+    is interrupted, the next run of the same PDF resolves only the genes missing from it and
+    writes the same output as an uninterrupted run. The journal is removed once the run completes.
+    """
     logger.info(f"Starting PDF parsing for {fname}")
+    get_disease_window()
     if not os.path.exists(fname):
         logger.error(f"PDF file {fname} does not exist.")
         raise FileNotFoundError(f"PDF file {fname} does not exist")
 
-    output_dir = "output"
-    if not os.path.exists(output_dir):
-        logger.info(f"Creating output directory {output_dir}.")
-        os.makedirs(output_dir)
-
-    genes_csv = os.path.join(output_dir, "hgnc_gene.csv")
-    aliases_csv = os.path.join(output_dir, "gene_aliases.csv")
-    diseases_csv = os.path.join(output_dir, "gene_diseases.csv")
-
-    del_file(genes_csv)
-    del_file(aliases_csv)
-    del_file(diseases_csv)
-
-    text = read_pdf_file(fname)
-    hgnc_gene_ids = extract_hgnc_gene_ids(text)
+    if output_dir is None:
+        output_dir = OUTPUT_DIR
+    csv_files = {table: os.path.join(output_dir, f"{table}.csv") for table in CSV_HEADERS}
+    if write_csv:
+        if not os.path.exists(output_dir):
+            logger.info(f"Creating output directory {output_dir}.")
+            os.makedirs(output_dir)
+        for csv_file in csv_files.values():
+            del_file(csv_file)
 
+    text, hgnc_gene_ids = load_pdf(fname)
+    hgnc_gene_ids = sorted(hgnc_gene_ids, key=hgnc_sort_key)
+    if workers is None:
+        workers = int(os.getenv('FETCH_WORKERS', '4'))
+    if journal_dir is None:
+        journal_dir = JOURNAL_DIR
+    journal = open_journal(journal_dir, content_run('pdf', fname, [fname])) if journal_dir else None
     try:
-        with open(genes_csv, 'a', encoding='utf-8', newline='') as genes_file:
-            with open(aliases_csv, 'a', encoding='utf-8', newline='') as aliases_file:
-                with open(diseases_csv, 'a', encoding='utf-8', newline='') as diseases_file:
-                    logger.info(f"Writing CSV files: {genes_csv}, {aliases_csv}, {diseases_csv}")
-
-                    genes_writer = csv.writer(genes_file, quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
-                    aliases_writer = csv.writer(aliases_file, quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
-                    diseases_writer = csv.writer(diseases_file, quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
+        journaled = set(journal.keys()) if journal else set()
+        gene_records = get_gene_records([hgnc_id for hgnc_id in hgnc_gene_ids if hgnc_id not in journaled])
+        for hgnc_id in hgnc_gene_ids:
+            if hgnc_id not in gene_records and hgnc_id not in journaled:
+                logger.warning(f"No gene info found for HGNC ID {hgnc_id}.")
+        hgnc_gene_ids = [hgnc_id for hgnc_id in hgnc_gene_ids if hgnc_id in gene_records or hgnc_id in journaled]
 
+        with ExitStack() as stack:
+            writers = {}
+            if write_csv:
+                logger.info(f"Writing CSV files: {', '.join(csv_files.values())}")
+                for table, header in CSV_HEADERS.items():
+                    csv_file = stack.enter_context(open(csv_files[table], 'a', encoding='utf-8', newline=''))
+                    writers[table] = csv.writer(csv_file, quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
                     # Write headers to CSV files
-                    genes_writer.writerow(['hgnc_id', 'hgnc_gene_name', 'hg38', 'hg19'])
-                    aliases_writer.writerow(['hgnc_id', 'alias'])
-                    diseases_writer.writerow(['hgnc_id', 'disease'])
-
-                    for hgnc_id in hgnc_gene_ids:
-                        gene_disease = add_metadata_to_gene(hgnc_id, text)
-                        if gene_disease:
-                            # Write to hgnc_gene.csv
-                            genes_writer.writerow([
-                                gene_disease.hgnc_id,
-                                gene_disease.symbol,
-                                gene_disease.hg38,
-                                gene_disease.hg19
-                            ])
-                            # Write to gene_aliases.csv
-                            for alias in gene_disease.aliases or []:
-                                aliases_writer.writerow([gene_disease.hgnc_id, alias])
-                            # Write to gene_diseases.csv
-                            for disease in gene_disease.flt_diseases:
-                                diseases_writer.writerow([gene_disease.hgnc_id, disease])
-                            logger.info(
-                                f"Generated CSV entries for {hgnc_id} with {len(gene_disease.aliases or [])} aliases and {len(gene_disease.flt_diseases)} diseases")
-        logger.info(f"Completed parsing PDF {fname} and writing CSVs")
+                    writers[table].writerow(header)
+
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                gene_diseases = executor.map(
+                    lambda hgnc_id: add_metadata_to_gene(hgnc_id, text, gene_records.get(hgnc_id), journal),
+                    hgnc_gene_ids)
+                for hgnc_id, gene_disease in zip(hgnc_gene_ids, gene_diseases):
+                    if not gene_disease:
+                        continue
+                    for table, rows in gene_rows(gene_disease).items():
+                        if write_csv:
+                            for row in rows:
+                                writers[table].writerow(row)
+                        if loader:
+                            loader.add_rows(table, rows)
+                    logger.info(f"Generated entries for {hgnc_id} with {len(gene_disease.aliases or [])} aliases "
+                                f"and {len(gene_disease.flt_diseases)} diseases")
+        if journal:
+            journal.complete()
+        logger.info(f"Completed parsing PDF {fname}")
+        cache = get_response_cache()
+        if cache:
+            cache.log_stats()
     except Exception as e:
-        logger.error(f"Error writing CSV files: {e}")
+        logger.error(f"Error writing output for {fname}: {e}")
         raise
+    finally:
+        if journal:
+            journal.close()
@@ -0,0 +1,127 @@
+import os
+import time
+import random
+import logging
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+import requests
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# NCBI allows 3 requests per second per client, or 10 with an API key.
+NCBI_HOST = "eutils.ncbi.nlm.nih.gov"
+NCBI_API_KEY = os.getenv('NCBI_API_KEY')
+
+# Responses with these status codes are retried.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """Spaces out calls so that at most `rate` of them start per second."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        """Block until the next call is allowed."""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+_limiters: Dict[str, Optional[RateLimiter]] = {}
+_limiters_lock = threading.Lock()
+_local = threading.local()
+
+
+def set_rate_limit(host: str, rate: Optional[float]):
+    """Set the number of requests per second allowed to a host, None for no limit."""
+    with _limiters_lock:
+        _limiters[host] = RateLimiter(rate) if rate else None
+
+
+def get_rate_limiter(host: str) -> Optional[RateLimiter]:
+    """Get the rate limiter shared by all requests to this host."""
+    with _limiters_lock:
+        if host not in _limiters:
+            if host == NCBI_HOST:
+                _limiters[host] = RateLimiter(10 if NCBI_API_KEY else 3)
+            else:
+                _limiters[host] = None
+        return _limiters[host]
+
+
+def upstream_name(url: str) -> str:
+    """Name of the upstream a URL belongs to in the metrics: the E-utility, e.g. esearch, or the host."""
+    parts = urlsplit(url)
+    name = parts.path.rstrip('/').rsplit('/', 1)[-1]
+    if name.endswith('.fcgi'):
+        return name[:-len('.fcgi')]
+    return parts.netloc
+
+
+def get_session() -> requests.Session:
+    """Get this thread's HTTP session, so connections are reused."""
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = _local.session = requests.Session()
+    return session
+
+
+def request(method: str, url: str, retries: Optional[int] = None, backoff: Optional[float] = None,
+            upstream: Optional[str] = None, **kwargs) -> requests.Response:
+    """Send a rate limited HTTP request, retrying network errors and throttled or failed responses.
+
+    Retries use exponential backoff with jitter. The last response is returned whatever its status,
+    so callers still call raise_for_status() on it. upstream names the service in the metrics,
+    by default as upstream_name() does.
+    """
+    if retries is None:
+        retries = int(os.getenv('HTTP_RETRIES', '3'))
+    if backoff is None:
+        backoff = float(os.getenv('HTTP_BACKOFF', '1.0'))
+    host = urlsplit(url).netloc
+    if host == NCBI_HOST and NCBI_API_KEY:
+        kwargs['params'] = dict(kwargs.get('params') or {}, api_key=NCBI_API_KEY)
+    limiter = get_rate_limiter(host)
+    if upstream is None:
+        upstream = upstream_name(url)
+
+    for attempt in range(retries + 1):
+        if limiter:
+            limiter.wait()
+        start = time.perf_counter()
+        try:
+            response = get_session().request(method, url, **kwargs)
+            # streamed bodies are counted by the caller as it reads them, see metrics.count_bytes
+            size = None if kwargs.get('stream') else len(response.content)
+            metrics.observe_request(upstream, time.perf_counter() - start, response.status_code, size)
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+            reason = f"HTTP {response.status_code}"
+            response.close()
+        except (requests.ConnectionError, requests.Timeout) as e:
+            metrics.observe_request(upstream, time.perf_counter() - start)
+            if attempt == retries:
+                raise
+            reason = str(e)
+        delay = backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+        logger.warning(f"Request to {host} failed ({reason}), retry {attempt + 1}/{retries} in {delay:.1f}s")
+        time.sleep(delay)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    """Send a rate limited GET request with retries."""
+    return request('GET', url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    """Send a rate limited POST request with retries."""
+    return request('POST', url, **kwargs)
@@ -1,23 +1,42 @@
 import os
+import sys
 import time
 import logging
-import psycopg2
-from psycopg2 import OperationalError
-from gene_metadata import parse_pdf
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Dict
+import metrics
+from config import OUTPUT_DIR
+from db_pool import close_pools, get_db_config, get_pool
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# psycopg2 and the pipeline modules are imported by the functions that use them, so that each
+# command of the CLI only imports what its stage needs: `load` never imports PyPDF2 or
+# fuzzywuzzy, and `extract` never imports psycopg2.
+
+# Tables loaded concurrently, each over its own connection, once hgnc_gene is loaded
+DB_LOAD_WORKERS = int(os.getenv('DB_LOAD_WORKERS', '2'))
+# Drop the secondary indexes and foreign keys of the tables during a load, and build them again after it
+DB_REBUILD_INDEXES = os.getenv('DB_REBUILD_INDEXES', '').lower() in ('1', 'true', 'yes')
+
 
 def wait_for_db(host, port, database, user, password, max_attempts=30, delay=2):
-    """Wait for the database to be ready."""
+    """Wait for the database to be ready.
+
+    The connection that succeeds is kept in the pool of the database, for the load to reuse.
+    """
+    import psycopg2
+    from psycopg2 import OperationalError
     for attempt in range(max_attempts):
         try:
             conn = psycopg2.connect(
                 database=database, user=user, password=password, host=host, port=port
             )
-            conn.close()
+            get_pool(dict(host=host, port=port, database=database, user=user, password=password)).adopt(conn)
             logger.info("Database is ready.")
             return True
         except OperationalError as e:
@@ -27,24 +46,59 @@ def wait_for_db(host, port, database, user, password, max_attempts=30, delay=2):
     return False
 
 
-def populate_db():
-    """Populate the database with data from CSV files."""
-    # Get database credentials from environment variables
-    db_config = {
-        'database': os.getenv('DB_NAME', 'MYDB'),
-        'user': os.getenv('DB_USER', 'postgres'),
-        'password': os.getenv('DB_PASSWORD', 'postgres'),
-        'host': os.getenv('DB_HOST', 'mydb'),
-        'port': os.getenv('DB_PORT', '5432')
-    }
-
-    # Define CSV file paths relative to /app/output
-    output_dir = os.path.join('/app', 'output')
-    csv_files = [
-        os.path.join(output_dir, 'hgnc_gene.csv'),
-        os.path.join(output_dir, 'gene_diseases.csv'),
-        os.path.join(output_dir, 'gene_aliases.csv')
-    ]
+def load_table(pool, table: str, csv_file: str) -> Dict[str, int]:
+    """COPY a CSV file into its table's staging table and merge it, in a transaction of its own."""
+    from db_loader import StagingLoader
+    with pool.connection() as conn, conn:
+        loader = StagingLoader(conn, tables=[table])
+        with open(csv_file, 'r') as f:
+            next(f)
+            loader.copy_file(table, f)
+        return loader.merge()[table]
+
+
+def tables_loaded(pool):
+    """Drop the cached lookups of this process, and notify those of other processes.
+
+    A failed notification is logged rather than raised, so it never hides the outcome of the load.
+    """
+    from gene_lookup import invalidate_caches, notify_loaded
+    invalidate_caches()
+    try:
+        with pool.connection() as conn, conn:
+            notify_loaded(conn)
+    except Exception as e:
+        logger.error(f"Failed to notify lookups in other processes of the load: {e}")
+
+
+def indexes_dropped_for_load(pool):
+    """A context dropping the secondary indexes and foreign keys of the loaded tables for the duration of a
+    load when DB_REBUILD_INDEXES is set, after rebuilding those a killed load left dropped.
+
+    Nothing is dropped, restored or created when it is not set.
+    """
+    if not DB_REBUILD_INDEXES:
+        return nullcontext()
+    from db_loader import LOAD_TABLES, restore_dropped_indexes, secondary_indexes_dropped
+    restore_dropped_indexes(pool)
+    return secondary_indexes_dropped(pool, LOAD_TABLES)
+
+
+@metrics.stage('populate_db')
+def populate_db(output_dir=None):
+    """Populate the database with data from CSV files.
+
+    Each CSV file is COPYed into a temporary staging table and merged into its table with
+    INSERT ... ON CONFLICT, so loads can be repeated and only touch new or changed rows.
+    hgnc_gene is loaded first, then the tables referencing it concurrently over connections of
+    the pool, each table in its own transaction. Returns the rows inserted, updated and skipped per table.
+    """
+    import psycopg2
+    from db_loader import TABLES
+    # CSV files are read from the directory parse_pdf wrote them to
+    if output_dir is None:
+        output_dir = OUTPUT_DIR
+    csv_files = [os.path.join(output_dir, f'{table}.csv') for table, _, _ in TABLES]
 
     # Check if output directory and CSV files exist
     if not os.path.exists(output_dir):
@@ -55,74 +109,168 @@ def populate_db():
             logger.error("CSV file %s does not exist.", csv_file)
             raise FileNotFoundError(f"CSV file {csv_file} does not exist")
 
-    # Connect to database
-    conn = psycopg2.connect(**db_config)
-    conn.autocommit = True
-    cursor = conn.cursor()
+    pool = get_pool(get_db_config())
+    (first, _, _), *rest = TABLES
+    stats = {}
     try:
-        # Populate hgnc_gene table
-        with open(csv_files[0], 'r') as f:
-            next(f)
-            cursor.copy_expert(
-                "COPY hgnc_gene (hgnc_id, hgnc_gene_name, hg38, hg19) FROM STDIN WITH (FORMAT CSV, DELIMITER ',', QUOTE '\"', ESCAPE '\"')",
-                f
-            )
+        with indexes_dropped_for_load(pool):
+            # genes first, as rows of the other tables are only merged for known genes
+            stats[first] = load_table(pool, first, csv_files[0])
+            with ThreadPoolExecutor(max_workers=max(1, DB_LOAD_WORKERS)) as executor:
+                futures = [(table, executor.submit(load_table, pool, table, csv_file))
+                           for (table, _, _), csv_file in zip(rest, csv_files[1:])]
+                for table, future in futures:
+                    stats[table] = future.result()
     except psycopg2.Error as e:
-        logger.warning(
-            f"Failed to populate hgnc_gene table due to duplicate keys or other error: {e}")
-    try:
-        # Populate gene_diseases table
-        with open(csv_files[1], 'r') as f:
-            next(f)
-            cursor.copy_expert(
-                "COPY gene_diseases (hgnc_id, disease) FROM STDIN WITH (FORMAT CSV, DELIMITER ',', QUOTE '\"', ESCAPE '\"')",
-                f
-            )
-    except psycopg2.Error as e:
-        logger.warning(
-            f"Failed to populate gene_diseases table due to duplicate keys or other error: {e}")
+        logger.error(f"Failed to populate database, tables loaded before the error were kept: {e}")
+        raise
+    finally:
+        # cached lookups are stale once any table was loaded
+        if stats:
+            tables_loaded(pool)
+
+    logger.info("Successfully populated database.")
+    return stats
+
 
+@metrics.stage('load_direct')
+def load_direct(corpus='', write_csv=False):
+    """Parse the PDF, or a corpus of PDFs, streaming rows straight into the database.
+
+    Rows are COPYed into the staging tables in batches while genes are resolved, instead of
+    being written to CSV files and read back, and merged in one transaction at the end. The
+    COPYs are autocommitted into staging tables kept for the session, so no transaction stays
+    open while genes are fetched, and a failed run closes its connection, dropping them.
+    The CSV files are still written when write_csv is set. With DB_REBUILD_INDEXES, the indexes
+    are dropped for the merge as populate_db drops them for its load. Returns the rows inserted,
+    updated and skipped per table.
+    """
+    import psycopg2
+    from db_loader import StagingLoader
+    from gene_metadata import parse_pdf
+    from corpus import parse_corpus
+    from gene_lookup import invalidate_caches, notify_loaded
     try:
-        # Populate gene_aliases table
-        with open(csv_files[2], 'r') as f:
-            next(f)
-            cursor.copy_expert(
-                "COPY gene_aliases (hgnc_id, alias) FROM STDIN WITH (FORMAT CSV, DELIMITER ',', QUOTE '\"', ESCAPE '\"')",
-                f
-            )
+        pool = get_pool(get_db_config())
+        with pool.connection() as conn:
+            conn.autocommit = True
+            try:
+                loader = StagingLoader(conn, session=True)
+                if corpus:
+                    parse_corpus(corpus, loader=loader, write_csv=write_csv)
+                else:
+                    parse_pdf(loader=loader, write_csv=write_csv)
+                conn.autocommit = False
+                with indexes_dropped_for_load(pool), conn:
+                    stats = loader.merge()
+                    loader.drop()
+                    notify_loaded(conn)
+            except BaseException:
+                conn.close()
+                raise
     except psycopg2.Error as e:
-        logger.warning(
-            f"Failed to populate gene_aliases table due to duplicate keys or other error: {e}")
+        logger.error(f"Failed to populate database, no rows were loaded: {e}")
+        raise
+    invalidate_caches()
 
     logger.info("Successfully populated database.")
+    return stats
+
 
+def update_reference_store():
+    """Bring the local reference store named by REFERENCE_STORE, if any, up to date with the bulk files it is
+    built from, before genes are resolved from it."""
+    reference_store = os.getenv('REFERENCE_STORE', '')
+    if reference_store:
+        from reference_store import update_from_env
+        update_from_env(reference_store)
 
+
+@metrics.profiled('main')
 def main():
-    """Main application entry point."""
+    """Run the whole pipeline as configured by the environment: parse, then load the database."""
+    from gene_metadata import parse_pdf
+    from corpus import parse_corpus
     logger.info("Starting application...")
 
     # Wait for database to be ready
-    db_config = {
-        'host': os.getenv('DB_HOST', 'mydb'),
-        'port': os.getenv('DB_PORT', '5432'),
-        'database': os.getenv('DB_NAME', 'MYDB'),
-        'user': os.getenv('DB_USER', 'postgres'),
-        'password': os.getenv('DB_PASSWORD', 'postgres')
-    }
-    if not wait_for_db(**db_config):
+    if not wait_for_db(**get_db_config()):
         logger.error("Application exiting due to database unavailability.")
         return
 
     try:
-        # Parse PDF to generate CSV files
-        parse_pdf()
-        # Populate database with CSV data
-        populate_db()
+        # Parse PDF, or a corpus of PDFs when PDF_CORPUS names a directory or manifest, to generate CSV files
+        corpus = os.getenv('PDF_CORPUS', '')
+        update_reference_store()
+        if os.getenv('DB_LOAD_MODE', 'csv') == 'direct':
+            # Stream rows into the database as genes are resolved, CSV files only on request
+            load_direct(corpus, write_csv=os.getenv('WRITE_CSV', '') == '1')
+        else:
+            if corpus:
+                parse_corpus(corpus)
+            else:
+                parse_pdf()
+            # Populate database with CSV data
+            populate_db()
         logger.info("Application completed successfully.")
     except Exception as e:
         logger.error("Application failed: %s", e)
         raise
+    finally:
+        close_pools()
+        metrics.export()
+
+
+def run_stage(name: str, args: argparse.Namespace):
+    """Run one stage of the pipeline on the artifacts of the previous stages in args.work_dir."""
+    if name == 'load':
+        if not wait_for_db(**get_db_config()):
+            raise RuntimeError("Database is not available")
+        populate_db(args.output_dir)
+        return
+    # the gene names of extract and the genes of fetch are read from the reference store, as in main
+    if name in ('extract', 'fetch'):
+        update_reference_store()
+    import stages
+    if name == 'extract':
+        stages.extract(args.source or os.getenv('PDF_CORPUS', '') or "pub.pdf", work_dir=args.work_dir)
+    elif name == 'fetch':
+        stages.fetch(work_dir=args.work_dir)
+    elif name == 'match':
+        stages.match(work_dir=args.work_dir, output_dir=args.output_dir)
+
+
+def cli(argv=None) -> int:
+    """Command line entry point. Without a command, runs the whole pipeline as main does."""
+    parser = argparse.ArgumentParser(description="Extract genes from publications, resolve them and load the database.")
+    parser.add_argument('--work-dir', default=None,
+                        help="directory of the artifacts passed between stages (env WORK_DIR, default work)")
+    parser.add_argument('--output-dir', default=None,
+                        help="directory of the CSV files (env OUTPUT_DIR, default output)")
+    commands = parser.add_subparsers(dest='command')
+    extract = commands.add_parser('extract', help="extract the text and HGNC IDs of the publications")
+    extract.add_argument('source', nargs='?',
+                         help="PDF, corpus directory or manifest (env PDF_CORPUS, default pub.pdf)")
+    commands.add_parser('fetch', help="resolve the extracted genes and their ClinVar diseases")
+    commands.add_parser('match', help="match the diseases of each gene in its publications and write the CSV files")
+    commands.add_parser('load', help="load the CSV files into the database")
+    commands.add_parser('all', help="run the whole pipeline, as configured by the environment (the default)")
+    args = parser.parse_args(argv)
+
+    if args.command in (None, 'all'):
+        main()
+        return 0
+    try:
+        run_stage(args.command, args)
+    except Exception as e:
+        logger.error(f"Stage {args.command} failed: {e}")
+        return 1
+    finally:
+        close_pools()
+        metrics.export()
+    logger.info(f"Stage {args.command} completed successfully.")
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(cli())
@@ -0,0 +1,291 @@
+import os
+import io
+import json
+import time
+import pstats
+import logging
+import cProfile
+import threading
+import functools
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Directory the Prometheus textfile and the JSON run summary are written to, empty to disable
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+PROMETHEUS_FILE = 'pipeline.prom'
+SUMMARY_FILE = 'run_summary.json'
+
+# Profilers wrapped around main and parse_pdf: a comma separated list of cpu (cProfile) and memory
+# (tracemalloc), written to PROFILE_DIR
+PROFILE = os.getenv('PROFILE', '')
+PROFILE_DIR = os.getenv('PROFILE_DIR', METRICS_DIR or '.')
+PROFILE_TOP = 25
+
+# Upper bounds of the HTTP latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Help text of the counters the pipeline increments
+COUNTERS = {
+    'http_requests': "HTTP requests to each upstream, by status.",
+    'http_response_bytes': "Bytes of the HTTP responses from each upstream.",
+    'fuzzy_comparisons': "Fuzzy comparisons of disease names with lines of text.",
+    'diseases_filtered': "ClinVar diseases filtered against the text.",
+    'diseases_matched': "ClinVar diseases found in the text.",
+    'disease_text_chars': "Characters of text the diseases of each gene were matched in.",
+    'rows_copied': "Rows COPYed into each staging table.",
+    'rows_merged': "Rows inserted or updated in each table.",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Labels], float] = {}
+_stages: Dict[str, Dict[str, float]] = {}
+_genes: Dict[str, Dict[str, float]] = {}
+_latencies: Dict[str, Dict[str, object]] = {}
+_profiling = threading.local()
+_started = time.time()
+_started_cpu = time.process_time()
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Add value to a counter."""
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def counter(name: str, **labels) -> float:
+    """Current value of a counter."""
+    with _lock:
+        return _counters.get((name, _labels(labels)), 0)
+
+
+@contextmanager
+def stage(name: str):
+    """Add the wall and CPU time of the block to a pipeline stage.
+
+    CPU time is that of the calling thread, so work handed to pools is counted by the stages
+    timed in the pool's threads, and stages running concurrently add up.
+    """
+    start, start_cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        wall, cpu = time.perf_counter() - start, time.thread_time() - start_cpu
+        with _lock:
+            timing = _stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'cpu_seconds': 0.0})
+            timing['calls'] += 1
+            timing['seconds'] += wall
+            timing['cpu_seconds'] += cpu
+
+
+@contextmanager
+def gene(hgnc_id: str):
+    """Record the wall and CPU time spent on one gene."""
+    start, start_cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        wall, cpu = time.perf_counter() - start, time.thread_time() - start_cpu
+        with _lock:
+            timing = _genes.setdefault(hgnc_id, {'seconds': 0.0, 'cpu_seconds': 0.0})
+            timing['seconds'] += wall
+            timing['cpu_seconds'] += cpu
+
+
+def observe_request(upstream: str, seconds: float, status: Optional[int] = None, size: Optional[int] = None):
+    """Record an HTTP request to an upstream: its latency, status (None for network errors) and response bytes."""
+    inc('http_requests', upstream=upstream, status=status if status is not None else 'error')
+    if size:
+        inc('http_response_bytes', size, upstream=upstream)
+    with _lock:
+        latency = _latencies.setdefault(upstream, {'buckets': [0] * len(LATENCY_BUCKETS), 'count': 0, 'sum': 0.0})
+        latency['count'] += 1
+        latency['sum'] += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                latency['buckets'][i] += 1
+
+
+def count_bytes(upstream: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Pass the chunks of a streamed response through, adding their size to the upstream's response bytes."""
+    size = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+    finally:
+        inc('http_response_bytes', size, upstream=upstream)
+
+
+def reset():
+    """Forget all metrics, e.g. between runs in one process."""
+    global _started, _started_cpu
+    with _lock:
+        _counters.clear()
+        _stages.clear()
+        _genes.clear()
+        _latencies.clear()
+        _started = time.time()
+        _started_cpu = time.process_time()
+
+
+def summary() -> dict:
+    """All metrics of the run as a JSON-serializable dict."""
+    with _lock:
+        counters = {}
+        for (name, labels), value in sorted(_counters.items()):
+            counters.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+        return {
+            'started': _started,
+            'seconds': time.time() - _started,
+            'cpu_seconds': time.process_time() - _started_cpu,
+            'stages': {name: dict(timing) for name, timing in _stages.items()},
+            'genes': {hgnc_id: dict(timing) for hgnc_id, timing in _genes.items()},
+            'counters': counters,
+            'http_latency': {upstream: {'count': latency['count'], 'sum': latency['sum'],
+                                        'buckets': dict(zip(map(str, LATENCY_BUCKETS), latency['buckets']))}
+                             for upstream, latency in _latencies.items()},
+        }
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    pairs = []
+    for key, value in labels:
+        value = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{key}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def prometheus(run: Optional[dict] = None) -> str:
+    """The metrics of the run in the Prometheus text exposition format.
+
+    Genes are summarized rather than labelled one by one, the JSON summary has each gene's times.
+    """
+    run = run or summary()
+    out = io.StringIO()
+
+    def family(name: str, kind: str, help_text: str):
+        out.write(f"# HELP pipeline_{name} {help_text}\n# TYPE pipeline_{name} {kind}\n")
+
+    family('run_seconds', 'gauge', "Wall time of the run.")
+    out.write(f"pipeline_run_seconds {run['seconds']}\n")
+    family('run_cpu_seconds', 'gauge', "CPU time of the process during the run.")
+    out.write(f"pipeline_run_cpu_seconds {run['cpu_seconds']}\n")
+    family('run_timestamp_seconds', 'gauge', "Time the run started.")
+    out.write(f"pipeline_run_timestamp_seconds {run['started']}\n")
+
+    for field, help_text in (('calls', "Times each stage ran."), ('seconds', "Wall time of each stage."),
+                             ('cpu_seconds', "CPU time of each stage, in the thread running it.")):
+        family(f'stage_{field}_total', 'counter', help_text)
+        for name, timing in sorted(run['stages'].items()):
+            out.write(f"pipeline_stage_{field}_total{_format_labels(_labels({'stage': name}))} {timing[field]}\n")
+
+    for field in ('seconds', 'cpu_seconds'):
+        family(f'gene_{field}', 'summary', f"{'Wall' if field == 'seconds' else 'CPU'} time spent on each gene.")
+        out.write(f"pipeline_gene_{field}_sum {sum(t[field] for t in run['genes'].values())}\n")
+        out.write(f"pipeline_gene_{field}_count {len(run['genes'])}\n")
+
+    family('http_request_seconds', 'histogram', "Latency of the HTTP requests to each upstream.")
+    for upstream, latency in sorted(run['http_latency'].items()):
+        for bound, count in latency['buckets'].items():
+            out.write(f"pipeline_http_request_seconds_bucket"
+                      f"{_format_labels(_labels({'upstream': upstream, 'le': bound}))} {count}\n")
+        labels = _format_labels(_labels({'upstream': upstream}))
+        inf = _format_labels(_labels({'upstream': upstream, 'le': '+Inf'}))
+        out.write(f"pipeline_http_request_seconds_bucket{inf} {latency['count']}\n")
+        out.write(f"pipeline_http_request_seconds_sum{labels} {latency['sum']}\n")
+        out.write(f"pipeline_http_request_seconds_count{labels} {latency['count']}\n")
+
+    for name, values in sorted(run['counters'].items()):
+        family(f'{name}_total', 'counter', COUNTERS.get(name, name.replace('_', ' ').capitalize() + "."))
+        for value in values:
+            out.write(f"pipeline_{name}_total{_format_labels(_labels(value['labels']))} {value['value']}\n")
+    return out.getvalue()
+
+
+def _write_atomic(path: str, content: str):
+    """Write a file through a temporary file and a rename, so readers never see it half written."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        file.write(content)
+    os.replace(tmp_path, path)
+
+
+def export(directory: Optional[str] = None):
+    """Write the Prometheus textfile and the JSON run summary, when a metrics directory is configured."""
+    directory = METRICS_DIR if directory is None else directory
+    run = summary()
+    for name, timing in sorted(run['stages'].items(), key=lambda item: -item[1]['seconds']):
+        logger.info(f"Stage {name}: {timing['calls']} calls, {timing['seconds']:.3f}s wall, "
+                    f"{timing['cpu_seconds']:.3f}s CPU")
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    _write_atomic(os.path.join(directory, PROMETHEUS_FILE), prometheus(run))
+    _write_atomic(os.path.join(directory, SUMMARY_FILE), json.dumps(run, indent=2, sort_keys=True))
+    logger.info(f"Wrote metrics to {directory}")
+
+
+@contextmanager
+def profile(name: str, modes: Optional[str] = None):
+    """Profile the block with cProfile and/or tracemalloc, as PROFILE selects.
+
+    The CPU profile is written to {name}.prof, for pstats or snakeviz, and the top allocations
+    to {name}.tracemalloc.txt. A profile nested in another one in the same thread is skipped,
+    so profiling main also covers the parse_pdf it calls.
+    """
+    modes = {mode.strip() for mode in (PROFILE if modes is None else modes).split(',') if mode.strip()}
+    if not modes or getattr(_profiling, 'active', False):
+        yield
+        return
+    _profiling.active = True
+    profiler = cProfile.Profile() if 'cpu' in modes else None
+    trace = 'memory' in modes and not tracemalloc.is_tracing()
+    if trace:
+        tracemalloc.start()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+        _profiling.active = False
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        if profiler:
+            path = os.path.join(PROFILE_DIR, f"{name}.prof")
+            profiler.dump_stats(path)
+            stats = io.StringIO()
+            pstats.Stats(profiler, stream=stats).sort_stats('cumulative').print_stats(PROFILE_TOP)
+            logger.info(f"CPU profile of {name} written to {path}\n{stats.getvalue()}")
+        if trace:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            lines = [f"current {current} bytes, peak {peak} bytes"]
+            lines.extend(str(stat) for stat in snapshot.statistics('lineno')[:PROFILE_TOP])
+            path = os.path.join(PROFILE_DIR, f"{name}.tracemalloc.txt")
+            _write_atomic(path, "\n".join(lines) + "\n")
+            logger.info(f"Memory profile of {name} written to {path}, peak {peak / 2 ** 20:.1f} MiB")
+
+
+def profiled(name: str):
+    """Decorator running a function under profile(name)."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with profile(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
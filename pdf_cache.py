@@ -0,0 +1,89 @@
+import os
+import gzip
+import json
+import hashlib
+import logging
+import tempfile
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PdfText:
+    """Text extracted from a PDF, with the offset in text where each page starts."""
+    text: str
+    page_offsets: List[int] = field(default_factory=list)
+    hgnc_ids: List[str] = field(default_factory=list)
+
+    @classmethod
+    def from_pages(cls, pages: List[str], hgnc_ids: List[str]) -> "PdfText":
+        offsets = []
+        offset = 0
+        for page in pages:
+            offsets.append(offset)
+            offset += len(page)
+        return cls(text="".join(pages), page_offsets=offsets, hgnc_ids=hgnc_ids)
+
+    def pages(self) -> List[str]:
+        """Split the text back into pages."""
+        ends = self.page_offsets[1:] + [len(self.text)]
+        return [self.text[start:end] for start, end in zip(self.page_offsets, ends)]
+
+
+def file_digest(filename: str) -> str:
+    """SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PdfTextCache:
+    """Directory of gzipped JSON files holding the PdfText of each PDF, named by content hash.
+
+    Entries written by another extractor version are ignored, so changing how text or
+    HGNC IDs are extracted invalidates them.
+    """
+
+    def __init__(self, directory: str, version: str):
+        self.directory = directory
+        self.version = version
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, f"{digest}.json.gz")
+
+    def get(self, digest: str) -> Optional[PdfText]:
+        """Get the cached text of a PDF, or None."""
+        try:
+            with gzip.open(self._path(digest), 'rt', encoding='utf-8') as file:
+                entry = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable PDF cache entry {digest}: {e}")
+            return None
+        if entry.get('version') != self.version:
+            logger.info(f"Ignoring PDF cache entry {digest} from extractor version {entry.get('version')}")
+            return None
+        return PdfText(text=entry['text'], page_offsets=entry['page_offsets'], hgnc_ids=entry['hgnc_ids'])
+
+    def put(self, digest: str, pdf_text: PdfText):
+        """Store the text of a PDF, replacing the entry atomically."""
+        entry = {
+            'version': self.version,
+            'text': pdf_text.text,
+            'page_offsets': pdf_text.page_offsets,
+            'hgnc_ids': pdf_text.hgnc_ids,
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', encoding='utf-8') as file:
+                json.dump(entry, file)
+            os.replace(tmp_path, self._path(digest))
+        except Exception:
+            os.remove(tmp_path)
+            raise
@@ -0,0 +1,262 @@
+import io
+import os
+import csv
+import sys
+import gzip
+import json
+import time
+import logging
+import sqlite3
+import argparse
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from pdf_cache import file_digest
+
+logger = logging.getLogger(__name__)
+
+# Chromosomes of the primary assembly, positions on patches and alternate haplotypes are skipped
+PRIMARY_CHROMOSOMES = {str(n) for n in range(1, 23)} | {'X', 'Y', 'MT'}
+
+# Trait names ClinVar uses for variants without a condition, left out as get_diseases does
+IGNORED_TRAITS = {'not specified', 'not provided'}
+
+# Columns of an Ensembl BioMart gene export with the HGNC ID, chromosome, start, end and strand attributes
+BIOMART_COLUMNS = ('HGNC ID', 'Chromosome/scaffold name', 'Gene start (bp)', 'Gene end (bp)', 'Strand')
+
+# The store is built from the files these variables name, see update_from_env
+SOURCE_VARIABLES = {
+    'hgnc': 'HGNC_COMPLETE_SET',
+    'clinvar': 'CLINVAR_VARIANT_SUMMARY',
+    'positions_hg38': 'GENE_POSITIONS_HG38',
+    'positions_hg19': 'GENE_POSITIONS_HG19',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (name TEXT PRIMARY KEY, digest TEXT NOT NULL, path TEXT, loaded REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS genes (hgnc_id TEXT PRIMARY KEY, symbol TEXT NOT NULL, aliases TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS positions (
+    hgnc_id TEXT NOT NULL, assembly TEXT NOT NULL, chr TEXT NOT NULL, start INTEGER NOT NULL, end INTEGER NOT NULL,
+    strand INTEGER, PRIMARY KEY (hgnc_id, assembly)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS traits (symbol TEXT NOT NULL, trait TEXT NOT NULL, PRIMARY KEY (symbol, trait)) WITHOUT ROWID;
+"""
+
+
+def _open_text(path: str) -> io.TextIOBase:
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def read_hgnc_genes(path: str) -> Iterator[Tuple[str, str, List[str]]]:
+    """Yield the HGNC ID, symbol and aliases of each gene of the HGNC complete set TSV.
+
+    Aliases are the alias symbols followed by the previous symbols, as MyGene lists both.
+    """
+    with _open_text(path) as file:
+        for row in csv.DictReader(file, delimiter='\t'):
+            hgnc_id, symbol = row.get('hgnc_id'), row.get('symbol')
+            if not hgnc_id or not symbol:
+                continue
+            aliases = []
+            for column in ('alias_symbol', 'prev_symbol'):
+                for alias in (row.get(column) or '').strip('"').split('|'):
+                    alias = alias.strip()
+                    if alias and alias not in aliases:
+                        aliases.append(alias)
+            yield hgnc_id, symbol, aliases
+
+
+def read_clinvar_traits(path: str) -> Iterator[Tuple[str, str]]:
+    """Yield (gene symbol, trait name) pairs from ClinVar's variant_summary.txt.gz.
+
+    Each variant is listed once per assembly, and a variant in several genes lists them separated
+    by semicolons. Traits in PhenotypeList are separated by | between sets and ; within them.
+    """
+    with _open_text(path) as file:
+        header = file.readline().lstrip('#').rstrip('\n').split('\t')
+        symbol_index = header.index('GeneSymbol')
+        phenotype_index = header.index('PhenotypeList')
+        for line in file:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) <= max(symbol_index, phenotype_index):
+                continue
+            symbols = [s for s in fields[symbol_index].split(';') if s and s != '-']
+            if not symbols:
+                continue
+            traits = {t.strip() for t in fields[phenotype_index].replace(';', '|').split('|')}
+            traits = {t for t in traits if t and t != '-' and t not in IGNORED_TRAITS}
+            for symbol in symbols:
+                for trait in traits:
+                    yield symbol, trait
+
+
+def read_biomart_positions(path: str) -> Iterator[Tuple[str, str, int, int, Optional[int]]]:
+    """Yield the HGNC ID, chromosome, start, end and strand of genes in an Ensembl BioMart TSV export.
+
+    Only the first position of a gene on a primary chromosome is kept.
+    """
+    seen = set()
+    with _open_text(path) as file:
+        reader = csv.DictReader(file, delimiter='\t')
+        missing = [column for column in BIOMART_COLUMNS if column not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"{path} is missing BioMart columns {', '.join(missing)}")
+        hgnc, chromosome, start, end, strand = BIOMART_COLUMNS
+        for row in reader:
+            hgnc_id = row[hgnc]
+            if not hgnc_id or hgnc_id in seen or row[chromosome] not in PRIMARY_CHROMOSOMES:
+                continue
+            seen.add(hgnc_id)
+            yield hgnc_id, row[chromosome], int(row[start]), int(row[end]), int(row[strand]) if row[strand] else None
+
+
+class ReferenceStore:
+    """Local SQLite store of HGNC genes, their positions and their ClinVar traits, built from bulk files.
+
+    Each source file is only loaded again when its content changed, and then only the rows that
+    differ from the previous load are written.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def _sync(self, table: str, keys: List[str], values: List[str], rows: Iterable[tuple],
+              scope: Tuple[str, tuple] = ("1", ())) -> Dict[str, int]:
+        """Make the rows of a table in scope equal to rows, writing only the differences.
+
+        rows are streamed into a temporary table, the last row of each key winning, and compared with
+        the table in SQL, so neither side has to fit in memory.
+        """
+        where, params = scope
+        columns = keys + values
+        cols = ', '.join(columns)
+        same_key = ' AND '.join(f"s.{k} = {table}.{k}" for k in keys)
+        self._conn.execute("DROP TABLE IF EXISTS temp.sync_rows")
+        self._conn.execute(f"CREATE TEMP TABLE sync_rows ({cols}, PRIMARY KEY ({', '.join(keys)})) WITHOUT ROWID")
+        try:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO sync_rows ({cols}) VALUES ({', '.join('?' * len(columns))})", rows)
+            total = self._conn.execute("SELECT count(*) FROM sync_rows").fetchone()[0]
+            # IS compares NULL strands as equal
+            unchanged = ' AND '.join([same_key] + [f"s.{v} IS {table}.{v}" for v in values])
+            written = self._conn.execute(
+                f"INSERT OR REPLACE INTO {table} ({cols}) SELECT {cols} FROM sync_rows s "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {unchanged})").rowcount
+            deleted = self._conn.execute(
+                f"DELETE FROM {table} WHERE {where} AND NOT EXISTS (SELECT 1 FROM sync_rows s WHERE {same_key})",
+                params).rowcount
+        finally:
+            self._conn.execute("DROP TABLE temp.sync_rows")
+        return {'written': written, 'deleted': deleted, 'total': total}
+
+    def update(self, name: str, path: str, force: bool = False) -> Optional[Dict[str, int]]:
+        """Load a source file (hgnc, clinvar, positions_hg38 or positions_hg19) if its content changed.
+
+        Returns the rows written and deleted, or None when the file was already loaded.
+        """
+        digest = file_digest(path)
+        with self._lock:
+            row = self._conn.execute("SELECT digest FROM sources WHERE name = ?", (name,)).fetchone()
+            if row and row[0] == digest and not force:
+                logger.info(f"Reference source {name} is up to date with {path}")
+                return None
+            start = time.perf_counter()
+            try:
+                stats = self._load(name, path)
+            except Exception:
+                self._conn.rollback()
+                raise
+            self._conn.execute("INSERT OR REPLACE INTO sources (name, digest, path, loaded) VALUES (?, ?, ?, ?)",
+                               (name, digest, path, time.time()))
+            self._conn.commit()
+        logger.info(f"Loaded reference source {name} from {path} in {time.perf_counter() - start:.1f}s: "
+                    f"{stats['written']} rows written, {stats['deleted']} deleted, {stats['total']} in total")
+        return stats
+
+    def _load(self, name: str, path: str) -> Dict[str, int]:
+        if name == 'hgnc':
+            return self._sync('genes', ['hgnc_id'], ['symbol', 'aliases'],
+                              ((hgnc_id, symbol, json.dumps(aliases))
+                               for hgnc_id, symbol, aliases in read_hgnc_genes(path)))
+        if name == 'clinvar':
+            return self._sync('traits', ['symbol', 'trait'], [], read_clinvar_traits(path))
+        if name.startswith('positions_'):
+            assembly = name[len('positions_'):]
+            return self._sync('positions', ['hgnc_id', 'assembly'], ['chr', 'start', 'end', 'strand'],
+                              ((hgnc_id, assembly, chromosome, start, end, strand) for
+                               hgnc_id, chromosome, start, end, strand in read_biomart_positions(path)),
+                              scope=("assembly = ?", (assembly,)))
+        raise ValueError(f"Unknown reference source {name}")
+
+    def gene_records(self, hgnc_ids: List[str]) -> Dict[str, dict]:
+        """MyGene-like records of the HGNC IDs in the store, with symbol, alias, genomic_pos and genomic_pos_hg19."""
+        records = {}
+        with self._lock:
+            for hgnc_id in hgnc_ids:
+                row = self._conn.execute("SELECT symbol, aliases FROM genes WHERE hgnc_id = ?", (hgnc_id,)).fetchone()
+                if row is None:
+                    continue
+                record = {'query': hgnc_id.split(':')[-1], 'symbol': row[0], 'alias': json.loads(row[1])}
+                for assembly, chromosome, start, end, strand in self._conn.execute(
+                        "SELECT assembly, chr, start, end, strand FROM positions WHERE hgnc_id = ?", (hgnc_id,)):
+                    field = 'genomic_pos' if assembly == 'hg38' else f'genomic_pos_{assembly}'
+                    record[field] = {'chr': chromosome, 'start': start, 'end': end, 'strand': strand}
+                records[hgnc_id] = record
+        return records
+
+    def gene_names(self) -> List[Tuple[str, str, List[str]]]:
+        """HGNC ID, symbol and aliases of every gene in the store, as read_hgnc_genes yields them."""
+        with self._lock:
+            return [(hgnc_id, symbol, json.loads(aliases)) for hgnc_id, symbol, aliases in
+                    self._conn.execute("SELECT hgnc_id, symbol, aliases FROM genes ORDER BY hgnc_id")]
+
+    def traits(self, symbol: str) -> set:
+        """ClinVar trait names of the variants of a gene."""
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT trait FROM traits WHERE symbol = ?", (symbol,))}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def update_store(path: str, sources: Dict[str, str], force: bool = False) -> Dict[str, Optional[Dict[str, int]]]:
+    """Create or update the store at path from source files by name, loading those that changed."""
+    store_dir = os.path.dirname(path)
+    if store_dir:
+        os.makedirs(store_dir, exist_ok=True)
+    store = ReferenceStore(path)
+    try:
+        return {name: store.update(name, source, force=force) for name, source in sources.items() if source}
+    finally:
+        store.close()
+
+
+def update_from_env(path: str) -> Dict[str, Optional[Dict[str, int]]]:
+    """Update the store at path from the files named by the HGNC_COMPLETE_SET, CLINVAR_VARIANT_SUMMARY,
+    GENE_POSITIONS_HG38 and GENE_POSITIONS_HG19 variables."""
+    return update_store(path, {name: os.getenv(variable, '') for name, variable in SOURCE_VARIABLES.items()})
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Build or update the local reference store from bulk files.")
+    parser.add_argument('--store', default=os.getenv('REFERENCE_STORE', '') or os.path.join('cache', 'reference.sqlite'),
+                        help="SQLite file of the store")
+    parser.add_argument('--hgnc', help="HGNC complete set TSV (hgnc_complete_set.txt)")
+    parser.add_argument('--clinvar', help="ClinVar variant_summary.txt.gz")
+    parser.add_argument('--positions-hg38', help="Ensembl BioMart export of GRCh38 gene positions")
+    parser.add_argument('--positions-hg19', help="Ensembl BioMart export of GRCh37 gene positions")
+    parser.add_argument('--force', action='store_true', help="reload files even if they did not change")
+    args = parser.parse_args(argv)
+
+    update_store(args.store, {name: getattr(args, name) for name in SOURCE_VARIABLES}, force=args.force)
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
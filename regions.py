@@ -0,0 +1,70 @@
+import re
+import logging
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Assemblies with position columns in hgnc_gene, see init.sql
+ASSEMBLIES = ('hg38', 'hg19')
+
+REGION_PATTERN = re.compile(r"^\s*(?:chr)?([0-9A-Za-z_.]+)\s*:\s*([\d,]+)\s*-\s*([\d,]+)\s*$", re.IGNORECASE)
+
+
+@dataclass
+class GeneRegion:
+    hgnc_id: str
+    symbol: str
+    chr: str
+    start: int
+    end: int
+    strand: Optional[int] = None
+
+
+def normalize_chromosome(chromosome: str) -> str:
+    """Chromosome name as stored in hgnc_gene: without the chr prefix, and MT for the mitochondrial genome."""
+    name = chromosome.strip()
+    if name.lower().startswith('chr'):
+        name = name[3:]
+    name = name.upper() if len(name) <= 2 else name
+    return 'MT' if name == 'M' else name
+
+
+def parse_region(region: str) -> Tuple[str, int, int]:
+    """Parse a region like chr1:1,000-2,000 into its chromosome, start and end."""
+    match = REGION_PATTERN.match(region)
+    if not match:
+        raise ValueError(f"Invalid region {region!r}, expected chromosome:start-end")
+    start, end = (int(value.replace(',', '')) for value in match.group(2, 3))
+    if start > end:
+        raise ValueError(f"Invalid region {region!r}, start is after end")
+    return normalize_chromosome(match.group(1)), start, end
+
+
+def genes_overlapping(conn, chromosome: str, start: int, end: int, assembly: str = 'hg38') -> List[GeneRegion]:
+    """Genes whose position on an assembly overlaps chromosome:start-end, both ends included, by start.
+
+    The query matches the expression of the GiST index on (chr, int8range(start, end)) of that
+    assembly, so it does not scan the table.
+    """
+    if assembly not in ASSEMBLIES:
+        raise ValueError(f"Unknown assembly {assembly}, expected one of {', '.join(ASSEMBLIES)}")
+    if start > end:
+        raise ValueError(f"Invalid region {chromosome}:{start}-{end}, start is after end")
+    chromosome = normalize_chromosome(chromosome)
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"SELECT hgnc_id, hgnc_gene_name, {assembly}_chr, {assembly}_start, {assembly}_end, {assembly}_strand "
+            f"FROM hgnc_gene WHERE {assembly}_chr = %s "
+            f"AND int8range({assembly}_start, {assembly}_end, '[]') && int8range(%s, %s, '[]') "
+            f"ORDER BY {assembly}_start, hgnc_id",
+            (chromosome, start, end)
+        )
+        genes = [GeneRegion(*row) for row in cursor.fetchall()]
+    logger.info(f"Found {len(genes)} genes overlapping {assembly} {chromosome}:{start}-{end}")
+    return genes
+
+
+def genes_in_region(conn, region: str, assembly: str = 'hg38') -> List[GeneRegion]:
+    """Genes overlapping a region written as chromosome:start-end, e.g. chr22:36,600,000-36,700,000."""
+    return genes_overlapping(conn, *parse_region(region), assembly=assembly)
@@ -0,0 +1,91 @@
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import Counter
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# Sentinel returned by ResponseCache.get for missing or expired entries, since None can be cached.
+MISS = object()
+
+
+def cache_key(namespace: str, **params) -> str:
+    """Build a cache key from a request, independent of parameter order."""
+    request = json.dumps({'namespace': namespace, 'params': params}, sort_keys=True)
+    return f"{namespace}:{hashlib.sha256(request.encode('utf-8')).hexdigest()}"
+
+
+class ResponseCache:
+    """Persistent cache of JSON-serializable responses in a SQLite file.
+
+    Entries older than ttl seconds are treated as missing. When the stored values exceed
+    max_bytes, the least recently used entries are evicted. Hits and misses are counted
+    per namespace, the part of the key before the first colon.
+    """
+
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600, max_bytes: int = 512 * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = Counter()
+        self.misses = Counter()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Any:
+        """Get the cached value for a key, or MISS."""
+        namespace = key.split(':', 1)[0]
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses[namespace] += 1
+                return MISS
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits[namespace] += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any):
+        """Store a value, evicting the least recently used entries if the cache is full."""
+        data = json.dumps(value).encode('utf-8')
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now))
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        logger.info(f"Evicted {evicted} entries from response cache {self.path}")
+
+    def log_stats(self):
+        """Log hit and miss counts per namespace."""
+        for namespace in sorted(set(self.hits) | set(self.misses)):
+            logger.info(f"Response cache {namespace}: {self.hits[namespace]} hits, {self.misses[namespace]} misses")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
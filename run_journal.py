@@ -0,0 +1,120 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from typing import Dict, Iterable, Optional
+from pdf_cache import file_digest
+
+logger = logging.getLogger(__name__)
+
+# Version of the journal format, journals of another version are started over
+JOURNAL_VERSION = 1
+
+
+class RunJournal:
+    """Append-only journal of the work a run completed, so a restarted run can skip it.
+
+    The journal is a JSON lines file: a header naming the run, then one entry per completed
+    item. Every entry is flushed and fsynced before record returns, and a partly written last
+    entry, from a crash during the write, is dropped when the journal is reopened.
+    """
+
+    def __init__(self, path: str, run: str):
+        self.path = path
+        self.run = run
+        self._lock = threading.Lock()
+        self._entries: Dict[str, object] = {}
+        header = {'version': JOURNAL_VERSION, 'run': run}
+        valid_bytes = self._load(header)
+        if valid_bytes:
+            self._file = open(path, 'r+b')
+            self._file.truncate(valid_bytes)
+            self._file.seek(valid_bytes)
+            logger.info(f"Resuming run {run} from journal {path} with {len(self._entries)} completed items")
+        else:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(path, 'wb')
+            self._append(header)
+
+    @classmethod
+    def for_run(cls, directory: str, run: str) -> "RunJournal":
+        """Open the journal of a run in a directory, named after the run."""
+        name = hashlib.sha256(run.encode('utf-8')).hexdigest()[:16]
+        return cls(os.path.join(directory, f"{name}.jsonl"), run)
+
+    def _load(self, header: dict) -> int:
+        """Read the entries of an existing journal of this run. Returns the bytes of valid entries, 0 to start over."""
+        try:
+            file = open(self.path, 'rb')
+        except FileNotFoundError:
+            return 0
+        valid_bytes = 0
+        with file:
+            for number, line in enumerate(file):
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError("incomplete line")
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Dropping the incomplete end of journal {self.path}")
+                    break
+                if number == 0:
+                    if entry != header:
+                        logger.info(f"Journal {self.path} is of another run, starting over")
+                        return 0
+                else:
+                    self._entries[entry['key']] = entry['value']
+                valid_bytes += len(line)
+        return valid_bytes
+
+    def _append(self, entry: dict):
+        self._file.write(json.dumps(entry, sort_keys=True).encode('utf-8') + b'\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def keys(self) -> Iterable[str]:
+        return list(self._entries)
+
+    def get(self, key: str):
+        """The value recorded for a completed item, or None."""
+        return self._entries.get(key)
+
+    def record(self, key: str, value):
+        """Durably record that an item completed, with the value needed to replay it."""
+        with self._lock:
+            self._append({'key': key, 'value': value})
+            self._entries[key] = value
+
+    def close(self):
+        """Close the journal, keeping it for the next run to resume from."""
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def complete(self):
+        """Remove the journal once the run has written all its output."""
+        self.close()
+        os.remove(self.path)
+        logger.info(f"Run {self.run} completed, removed journal {self.path}")
+
+
+def open_journal(directory: Optional[str], run: str) -> Optional[RunJournal]:
+    """Open the journal of a run, or None when journaling is disabled by an empty directory."""
+    if not directory:
+        return None
+    return RunJournal.for_run(directory, run)
+
+
+def content_run(kind: str, path: str, files: Iterable[str]) -> str:
+    """Name of the run of a PDF, corpus or work directory: its path and the digest of the content of
+    its files, so a run of files changed in place starts over rather than resuming another's genes."""
+    digest = hashlib.sha256()
+    for file in files:
+        digest.update(file_digest(file).encode())
+    return f"{kind}:{os.path.abspath(path)}:{digest.hexdigest()}"
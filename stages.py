@@ -0,0 +1,192 @@
+import os
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import asdict
+from typing import Dict, List, Optional, Tuple
+import metrics
+from config import OUTPUT_DIR
+from corpus import list_publications, load_gene_rows, load_matched_rows, resolve_corpus_gene, write_corpus_csvs
+from gene_metadata import (JOURNAL_DIR, GeneDisease, get_disease_window, get_gene_records, get_response_cache,
+                           hgnc_sort_key, load_pdf, match_gene_diseases)
+from run_journal import content_run, open_journal
+
+logger = logging.getLogger(__name__)
+
+# Directory of the artifacts each stage writes for the next one
+WORK_DIR = os.getenv('WORK_DIR', 'work')
+PUBLICATIONS_FILE = 'publications.json'
+GENES_FILE = 'genes.json'
+MATCHES_FILE = 'matches.json'
+TEXT_DIR = 'text'
+
+
+def write_artifact(work_dir: str, name: str, data: dict):
+    """Write a JSON artifact through a temporary file, so a failed stage never leaves half of one."""
+    os.makedirs(work_dir, exist_ok=True)
+    path = os.path.join(work_dir, name)
+    with open(f"{path}.tmp", 'w', encoding='utf-8') as file:
+        json.dump(data, file, indent=1, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+    logger.info(f"Wrote {path}")
+
+
+def read_artifact(work_dir: str, name: str) -> dict:
+    """Read the JSON artifact of an earlier stage."""
+    path = os.path.join(work_dir, name)
+    if not os.path.exists(path):
+        logger.error(f"Artifact {path} does not exist, run the stage that writes it first.")
+        raise FileNotFoundError(f"Artifact {path} does not exist")
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def extract_publication(path: str, workers: Optional[int] = None) -> Tuple[str, List[str]]:
+    """Read a publication and find its HGNC IDs, in a worker process."""
+    text, hgnc_ids = load_pdf(path, workers)
+    return text, sorted(hgnc_ids, key=hgnc_sort_key)
+
+
+def match_publication_text(text_path: str, genes: Dict[str, GeneDisease]) -> Dict[str, List[str]]:
+    """Find which diseases of each gene occur in the extracted text of a publication, in a worker process."""
+    with open(text_path, 'r', encoding='utf-8') as file:
+        text = file.read()
+    return {hgnc_id: match_gene_diseases(gene, text) for hgnc_id, gene in genes.items()}
+
+
+@metrics.stage('extract')
+def extract(source: str = "pub.pdf", work_dir: Optional[str] = None, workers: Optional[int] = None) -> dict:
+    """Extract the text and HGNC IDs of a PDF, or of every PDF of a corpus directory or manifest.
+
+    Writes the text of each publication to text/ as it is extracted, and publications.json, which
+    lists the name, path, text file and HGNC IDs of each one. A publication that cannot be read is
+    logged and skipped, as parse_corpus does.
+    """
+    if work_dir is None:
+        work_dir = WORK_DIR
+    if os.path.isfile(source) and source.lower().endswith('.pdf'):
+        publications = [(os.path.basename(source), source)]
+    else:
+        publications = list_publications(source)
+    if workers is None:
+        workers = int(os.getenv('CORPUS_WORKERS', str(os.cpu_count() or 1)))
+    logger.info(f"Extracting {len(publications)} publications from {source}")
+
+    text_dir = os.path.join(work_dir, TEXT_DIR)
+    os.makedirs(text_dir, exist_ok=True)
+    entries = {}
+    # a single publication is extracted in-process, with its pages split over PDF_WORKERS
+    single = len(publications) == 1
+    executor_class = ProcessPoolExecutor if workers > 1 and not single else ThreadPoolExecutor
+    with executor_class(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(extract_publication, path, None if single else 1): (number, name, path)
+                   for number, (name, path) in enumerate(publications, 1)}
+        # each text is written as soon as it is extracted, and dropped with its future
+        for future in as_completed(futures):
+            number, name, path = futures.pop(future)
+            try:
+                text, hgnc_ids = future.result()
+            except Exception as e:
+                logger.error(f"Skipping publication {name}: {e}")
+                continue
+            text_file = os.path.join(TEXT_DIR, f"{number:05d}.txt")
+            with open(os.path.join(work_dir, text_file), 'w', encoding='utf-8') as file:
+                file.write(text)
+            entries[number] = {'name': name, 'path': path, 'text': text_file, 'hgnc_ids': hgnc_ids}
+
+    artifact = {'source': source, 'publications': [entries[number] for number in sorted(entries)]}
+    write_artifact(work_dir, PUBLICATIONS_FILE, artifact)
+    return artifact
+
+
+@metrics.stage('fetch')
+def fetch(work_dir: Optional[str] = None, workers: Optional[int] = None, journal_dir: Optional[str] = None) -> dict:
+    """Resolve every gene of the extracted publications once, with its metadata and ClinVar diseases.
+
+    Reads publications.json and writes genes.json, the GeneDisease of each resolved gene before
+    its diseases are matched. Genes are journaled as in parse_pdf, so an interrupted fetch resumes.
+    """
+    if work_dir is None:
+        work_dir = WORK_DIR
+    if workers is None:
+        workers = int(os.getenv('FETCH_WORKERS', '4'))
+    if journal_dir is None:
+        journal_dir = JOURNAL_DIR
+    publications = read_artifact(work_dir, PUBLICATIONS_FILE)['publications']
+    hgnc_gene_ids = sorted({hgnc_id for entry in publications for hgnc_id in entry['hgnc_ids']}, key=hgnc_sort_key)
+
+    # the genes to fetch are those of publications.json, so its content names the run
+    journal = open_journal(journal_dir, content_run('fetch', work_dir, [os.path.join(work_dir, PUBLICATIONS_FILE)])) \
+        if journal_dir else None
+    try:
+        journaled = set(journal.keys()) if journal else set()
+        gene_records = get_gene_records([hgnc_id for hgnc_id in hgnc_gene_ids if hgnc_id not in journaled])
+        resolved = [hgnc_id for hgnc_id in hgnc_gene_ids if hgnc_id in gene_records or hgnc_id in journaled]
+        genes = {}
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for hgnc_id, gene in zip(resolved, executor.map(
+                    lambda i: resolve_corpus_gene(i, gene_records.get(i), journal), resolved)):
+                if gene:
+                    genes[hgnc_id] = asdict(gene)
+        logger.info(f"Resolved {len(genes)} of {len(hgnc_gene_ids)} genes")
+
+        artifact = {'genes': genes}
+        write_artifact(work_dir, GENES_FILE, artifact)
+        if journal:
+            journal.complete()
+    finally:
+        if journal:
+            journal.close()
+    cache = get_response_cache()
+    if cache:
+        cache.log_stats()
+    return artifact
+
+
+@metrics.stage('match')
+def match(work_dir: Optional[str] = None, output_dir: Optional[str] = None, workers: Optional[int] = None,
+          loader=None, write_csv: bool = True) -> dict:
+    """Match the diseases of each publication's genes against its text, and write the CSV files.
+
+    Reads publications.json, genes.json and the extracted text, and writes matches.json with the
+    diseases of each gene found in each publication. The CSV files are written to output_dir as
+    parse_corpus writes them, and rows are streamed to a db_loader.StagingLoader when one is given,
+    the gene diseases of each publication as it is matched.
+    """
+    get_disease_window()
+    if work_dir is None:
+        work_dir = WORK_DIR
+    if output_dir is None:
+        output_dir = OUTPUT_DIR
+    if workers is None:
+        workers = int(os.getenv('CORPUS_WORKERS', str(os.cpu_count() or 1)))
+    publications = read_artifact(work_dir, PUBLICATIONS_FILE)['publications']
+    genes = {hgnc_id: GeneDisease.from_dict(gene)
+             for hgnc_id, gene in read_artifact(work_dir, GENES_FILE)['genes'].items()}
+
+    if loader:
+        for gene in genes.values():
+            load_gene_rows(loader, gene)
+
+    matches: Dict[str, Dict[str, List[str]]] = {}
+    loaded = set()
+    executor_class = ProcessPoolExecutor if workers > 1 and len(publications) > 1 else ThreadPoolExecutor
+    with executor_class(max_workers=max(1, workers)) as executor:
+        futures = []
+        for entry in publications:
+            resolved_genes = {hgnc_id: genes[hgnc_id] for hgnc_id in entry['hgnc_ids'] if hgnc_id in genes}
+            futures.append((entry['name'], executor.submit(
+                match_publication_text, os.path.join(work_dir, entry['text']), resolved_genes)))
+        for name, future in futures:
+            try:
+                matches[name] = future.result()
+            except Exception as e:
+                logger.error(f"Skipping disease matching for publication {name}: {e}")
+                continue
+            if loader:
+                load_matched_rows(loader, matches[name], loaded)
+
+    write_artifact(work_dir, MATCHES_FILE, {'matches': matches})
+    if write_csv:
+        write_corpus_csvs(output_dir, genes, matches)
+    return matches
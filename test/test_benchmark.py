@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+import gene_metadata
+from benchmark import (compare, pipeline_settings, run_benchmark, scratch_database, synthetic_publication, timed,
+                       write_pdf)
+from gene_metadata import read_pdf_file
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_write_pdf(self):
+        ''' test the text of a synthetic publication is read back from its PDF '''
+
+        lines, catalog = synthetic_publication(pages=2, genes=3, diseases_per_gene=5, mentioned_diseases=1,
+                                               lines_per_page=5)
+        with tempfile.TemporaryDirectory() as tmp:
+            pdf = os.path.join(tmp, "synthetic.pdf")
+            write_pdf(pdf, lines)
+            text = read_pdf_file(pdf, workers=1)
+
+        for hgnc_id, gene in catalog.items():
+            self.assertIn(f"({hgnc_id})", text)
+            self.assertIn(gene['diseases'][0], text)
+
+    def test_run_benchmark(self):
+        ''' test each stage is timed against the stub server, and regressions are reported '''
+
+        results = run_benchmark(pages=2, genes=3, diseases_per_gene=10, mentioned_diseases=2, repeat=2)
+
+        self.assertEqual(results['counts']['genes'], 3)
+        self.assertEqual(results['counts']['diseases'], 30)
+        self.assertEqual(results['counts']['matched_diseases'], 6)
+        self.assertEqual(list(results['stages']), ['read_pdf_file', 'extract_hgnc_gene_ids', 'get_gene_records',
+                                                   'get_diseases', 'filter_diseases'])
+        self.assertEqual(len(results['stages']['get_diseases']['runs']), 2)
+        self.assertEqual(compare(results, results), [])
+
+        baseline = dict(results, stages={stage: dict(timing, median=timing['median'] / 2)
+                                         for stage, timing in results['stages'].items()})
+        regressions = compare(results, baseline, tolerance=0.5)
+        self.assertEqual(len(regressions), len(results['stages']))
+
+    def test_pipeline_settings(self):
+        ''' test every setting of a run is pinned, whatever the environment, and restored after it '''
+
+        with patch.multiple(gene_metadata, REFERENCE_STORE='store.db', GENE_NAMES=True, DISEASE_WINDOW='2',
+                            CACHE_ONLY=True, JOURNAL_DIR='journal', EUTILS_URL='https://eutils'):
+            with pipeline_settings(EUTILS_URL='http://stub'):
+                self.assertEqual(gene_metadata.REFERENCE_STORE, '')
+                self.assertFalse(gene_metadata.GENE_NAMES)
+                self.assertEqual(gene_metadata.DISEASE_WINDOW, '')
+                self.assertFalse(gene_metadata.CACHE_ONLY)
+                self.assertEqual(gene_metadata.JOURNAL_DIR, '')
+                self.assertEqual(gene_metadata.EUTILS_URL, 'http://stub')
+                self.assertIsNone(gene_metadata.get_reference_store())
+
+            self.assertEqual(gene_metadata.REFERENCE_STORE, 'store.db')
+            self.assertTrue(gene_metadata.GENE_NAMES)
+            self.assertEqual(gene_metadata.DISEASE_WINDOW, '2')
+            self.assertTrue(gene_metadata.CACHE_ONLY)
+            self.assertEqual(gene_metadata.JOURNAL_DIR, 'journal')
+            self.assertEqual(gene_metadata.EUTILS_URL, 'https://eutils')
+
+
+    @patch.dict(os.environ, {'DB_NAME': 'MYDB'})
+    @patch("psycopg2.connect")
+    def test_scratch_database(self, mock_connect):
+        ''' test populate_db is timed in a scratch database emptied before each run, and never in DB_NAME '''
+
+        admin, scratch = MagicMock(), MagicMock()
+        mock_connect.side_effect = [admin, scratch]
+        names = []
+
+        with scratch_database() as truncate:
+            timed(lambda: names.append(os.environ['DB_NAME']), 2, setup=truncate)
+
+        admin_sql = [c.args[0] for c in admin.cursor.return_value.execute.call_args_list]
+        name = f"benchmark_{os.getpid()}"
+        self.assertEqual(admin_sql, [f"CREATE DATABASE {name}", f"DROP DATABASE IF EXISTS {name}"])
+        self.assertEqual(mock_connect.call_args.kwargs['database'], name)
+        self.assertEqual(names, [name, name])
+        scratch_sql = [c.args[0] for c in scratch.cursor.return_value.execute.call_args_list]
+        self.assertIn("CREATE TABLE hgnc_gene", scratch_sql[0])
+        self.assertEqual(sum(sql.startswith("TRUNCATE") for sql in scratch_sql), 2)
+        self.assertEqual(os.environ['DB_NAME'], 'MYDB')
+
+
+if __name__ == '__main__':
+    unittest.main()
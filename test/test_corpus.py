@@ -0,0 +1,126 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock, call, patch
+from corpus import list_publications, parse_corpus
+from gene_metadata import GeneDisease
+
+PUB_PDF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pub.pdf")
+
+
+class TestCorpus(unittest.TestCase):
+    def setUp(self):
+        # setup a corpus of two copies of the publication
+        self.tmp_dir = tempfile.mkdtemp()
+        self.corpus_dir = os.path.join(self.tmp_dir, "corpus")
+        self.output_dir = os.path.join(self.tmp_dir, "output")
+        os.makedirs(os.path.join(self.corpus_dir, "kidney"))
+        shutil.copy(PUB_PDF, os.path.join(self.corpus_dir, "a.pdf"))
+        shutil.copy(PUB_PDF, os.path.join(self.corpus_dir, "kidney", "b.pdf"))
+        with open(os.path.join(self.corpus_dir, "notes.txt"), "w") as f:
+            f.write("not a pdf")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read_csv(self, name):
+        with open(os.path.join(self.output_dir, name), newline='') as f:
+            return list(csv.reader(f))
+
+    def test_list_publications_directory(self):
+        ''' test PDFs are found recursively '''
+
+        result = list_publications(self.corpus_dir)
+
+        self.assertEqual(result, [("a.pdf", os.path.join(self.corpus_dir, "a.pdf")),
+                                  (os.path.join("kidney", "b.pdf"), os.path.join(self.corpus_dir, "kidney", "b.pdf"))])
+
+    def test_list_publications_manifest(self):
+        ''' test PDFs are read from a manifest relative to it '''
+
+        manifest = os.path.join(self.corpus_dir, "manifest.txt")
+        with open(manifest, "w") as f:
+            f.write("# corpus\nkidney/b.pdf\n\na.pdf\n")
+
+        result = list_publications(manifest)
+
+        self.assertEqual(result, [("kidney/b.pdf", os.path.join(self.corpus_dir, "kidney/b.pdf")),
+                                  ("a.pdf", os.path.join(self.corpus_dir, "a.pdf"))])
+
+    @patch("gene_metadata.get_pdf_cache", return_value=None)
+    @patch("corpus.get_response_cache", return_value=None)
+    @patch("gene_metadata.resolve_gene")
+    @patch("corpus.get_gene_records")
+    def test_parse_corpus(self, mock_get_records, mock_resolve_gene, mock_cache, mock_pdf_cache):
+        ''' test genes are resolved once for the corpus and diseases are matched per publication '''
+
+        mock_get_records.side_effect = lambda hgnc_ids: {hgnc_id: {} for hgnc_id in hgnc_ids if hgnc_id != "HGNC:11621"}
+        mock_resolve_gene.side_effect = lambda hgnc_id, gene_data: GeneDisease(
+            symbol=hgnc_id, hgnc_id=hgnc_id, aliases=["ALIAS"], hg38="N/A", hg19="N/A",
+            diseases=["Nephrotic syndrome", "Retinitis pigmentosa"] if hgnc_id == "HGNC:13394" else [])
+
+        # invoke method for testing
+        parse_corpus(self.corpus_dir, self.output_dir, workers=1, journal_dir=os.path.join(self.tmp_dir, "journal"))
+
+        # run assertions
+        mock_get_records.assert_called_once_with(["HGNC:618", "HGNC:2204", "HGNC:11621", "HGNC:13394", "HGNC:19903"])
+        self.assertEqual(mock_resolve_gene.call_count, 4)
+        genes = self.read_csv("hgnc_gene.csv")
+        self.assertEqual([row[0] for row in genes], ["hgnc_id", "HGNC:618", "HGNC:2204", "HGNC:13394", "HGNC:19903"])
+        self.assertEqual(self.read_csv("gene_diseases.csv"), [["hgnc_id", "disease"], ["HGNC:13394", "Nephrotic syndrome"]])
+        publications = self.read_csv("publications.csv")
+        self.assertIn(["a.pdf", "HGNC:13394", "Nephrotic syndrome"], publications)
+        self.assertIn([os.path.join("kidney", "b.pdf"), "HGNC:13394", "Nephrotic syndrome"], publications)
+        self.assertIn(["a.pdf", "HGNC:618", ""], publications)
+        self.assertEqual(len(publications), 9)
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir, "journal")), [])
+
+    @patch("gene_metadata.get_pdf_cache", return_value=None)
+    @patch("corpus.get_response_cache", return_value=None)
+    @patch("gene_metadata.resolve_gene")
+    @patch("corpus.get_gene_records")
+    def test_parse_corpus_loader(self, mock_get_records, mock_resolve_gene, mock_cache, mock_pdf_cache):
+        ''' test rows are streamed to a loader as genes resolve and publications match, each gene disease once '''
+
+        mock_get_records.side_effect = lambda hgnc_ids: {hgnc_id: {} for hgnc_id in hgnc_ids if hgnc_id == "HGNC:13394"}
+        mock_resolve_gene.side_effect = lambda hgnc_id, gene_data: GeneDisease(
+            symbol="NPHS2", hgnc_id=hgnc_id, aliases=["SRN1"], hg38="N/A", hg19="N/A",
+            diseases=["Nephrotic syndrome", "Retinitis pigmentosa"])
+        loader = MagicMock()
+
+        # invoke method for testing
+        parse_corpus(self.corpus_dir, self.output_dir, workers=1, loader=loader, write_csv=False, journal_dir="")
+
+        # run assertions
+        self.assertEqual(loader.add_rows.call_args_list, [
+            call('hgnc_gene', [['HGNC:13394', 'NPHS2', 'N/A', 'N/A'] + [None] * 8]),
+            call('gene_aliases', [['HGNC:13394', 'SRN1']]),
+            call('gene_diseases', [['HGNC:13394', 'Nephrotic syndrome']]),
+            call('gene_diseases', []),
+        ])
+        self.assertFalse(os.path.exists(self.output_dir))
+
+    @patch("gene_metadata.get_pdf_cache", return_value=None)
+    @patch("corpus.write_corpus_csvs", side_effect=OSError("disk full"))
+    @patch("gene_metadata.resolve_gene")
+    @patch("corpus.get_gene_records")
+    @patch("corpus.open_journal")
+    def test_parse_corpus_closes_journal(self, mock_open_journal, mock_get_records, mock_resolve_gene, mock_write,
+                                         mock_pdf_cache):
+        ''' test the journal is closed, and kept, when a corpus run fails '''
+
+        journal = mock_open_journal.return_value
+        journal.keys.return_value = []
+        mock_get_records.return_value = {}
+
+        with self.assertRaises(OSError):
+            parse_corpus(self.corpus_dir, self.output_dir, workers=1, journal_dir=os.path.join(self.tmp_dir, "journal"))
+
+        journal.close.assert_called_once()
+        journal.complete.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+from unittest.mock import MagicMock
+from db_loader import (StagingLoader, dimension_sql, drop_secondary_indexes, merge_sql,
+                       secondary_indexes_dropped)
+
+
+class TestDbLoader(unittest.TestCase):
+    def setUp(self):
+        self.conn = MagicMock()
+        self.cursor = self.conn.cursor.return_value
+        self.copied = []
+        # read the buffer when COPY is called, since it is reused afterwards
+        self.cursor.copy_expert.side_effect = lambda sql, f: self.copied.append((sql, f.read()))
+
+    def test_add_rows_copies_full_batches(self):
+        ''' test buffered rows are COPYed once a batch is full, and the rest on merge '''
+
+        loader = StagingLoader(self.conn, batch_rows=2)
+        loader.add_rows('gene_aliases', [['HGNC:618', 'APOL2']])
+        self.assertEqual(self.copied, [])
+        loader.add_rows('gene_aliases', [['HGNC:618', 'APOL3']])
+        self.assertEqual(len(self.copied), 1)
+        self.assertTrue(self.copied[0][0].startswith("COPY stage_gene_aliases (hgnc_id, alias) FROM STDIN"))
+        self.assertEqual(self.copied[0][1], "HGNC:618,APOL2\nHGNC:618,APOL3\n")
+
+        loader.add_rows('gene_diseases', [['HGNC:618', 'Focal segmental glomerulosclerosis, 4']])
+        self.cursor.fetchone.side_effect = [(0,), (1,), (2,)]
+        self.cursor.fetchall.side_effect = [[], [(True,)], [(True,), (True,)]]
+        stats = loader.merge()
+
+        self.assertEqual(self.copied[1][1], 'HGNC:618,"Focal segmental glomerulosclerosis, 4"\n')
+        self.assertEqual(len(self.copied), 2)  # nothing left to copy for empty tables
+        self.assertEqual(stats['gene_aliases'], {'inserted': 2, 'updated': 0, 'skipped': 0})
+
+    def test_tables(self):
+        ''' test a loader given tables only stages and merges those '''
+
+        loader = StagingLoader(self.conn, tables=['gene_aliases'])
+        self.cursor.fetchone.return_value = (0,)
+        self.cursor.fetchall.return_value = []
+
+        self.assertEqual(list(loader.merge()), ['gene_aliases'])
+        statements = [c.args[0] for c in self.cursor.execute.call_args_list]
+        self.assertEqual([sql for sql in statements if sql.startswith("CREATE TEMP TABLE")],
+                         ["CREATE TEMP TABLE stage_gene_aliases (hgnc_id VARCHAR(255), alias TEXT) ON COMMIT DROP"])
+        # names are added to their dimension before the rows are merged
+        self.assertTrue(statements[-2].startswith("INSERT INTO alias (name) SELECT DISTINCT s.alias"))
+        self.assertTrue(statements[-1].startswith("INSERT INTO gene_aliases (hgnc_id, alias_id)"))
+
+    def test_merge_sql(self):
+        ''' test genes are updated when changed, and rows of unknown genes are left out '''
+
+        sql = merge_sql('hgnc_gene', ['hgnc_id', 'hgnc_gene_name'], ['hgnc_id'])
+        self.assertIn("ON CONFLICT (hgnc_id) DO UPDATE SET hgnc_gene_name = EXCLUDED.hgnc_gene_name", sql)
+        self.assertNotIn("WHERE EXISTS", sql)
+        sql = merge_sql('gene_aliases', ['hgnc_id', 'alias'], ['hgnc_id', 'alias'])
+        self.assertIn("WHERE EXISTS (SELECT 1 FROM hgnc_gene g WHERE g.hgnc_id = s.hgnc_id)", sql)
+        self.assertIn("DO NOTHING", sql)
+
+    def test_dimension_sql(self):
+        ''' test disease names are stored once and resolved to their keys in bulk '''
+
+        sql = dimension_sql('gene_diseases')
+        self.assertIn("INSERT INTO disease (name) SELECT DISTINCT s.disease FROM stage_gene_diseases s", sql)
+        self.assertIn("NOT EXISTS (SELECT 1 FROM disease n WHERE n.name = s.disease)", sql)
+        sql = merge_sql('gene_diseases', ['hgnc_id', 'disease'], ['hgnc_id', 'disease'])
+        self.assertIn("SELECT DISTINCT s.hgnc_id, n.disease_id FROM stage_gene_diseases s "
+                      "JOIN disease n ON n.name = s.disease", sql)
+        self.assertIn("ON CONFLICT (hgnc_id, disease_id) DO NOTHING", sql)
+
+
+    def test_drop_secondary_indexes(self):
+        ''' test dropped indexes and foreign keys are saved, in the same transaction, before they are dropped '''
+
+        index = "CREATE INDEX gene_diseases_disease_id ON public.gene_diseases USING btree (disease_id, hgnc_id)"
+        foreign_key = "FOREIGN KEY (disease_id) REFERENCES disease(disease_id)"
+        self.cursor.fetchall.side_effect = [[('gene_diseases_disease_id', index)],
+                                            [('gene_diseases', 'fk_gene_disease_disease_id', foreign_key)]]
+
+        statements = drop_secondary_indexes(self.conn, ['gene_diseases'])
+
+        add_foreign_key = f"ALTER TABLE gene_diseases ADD CONSTRAINT fk_gene_disease_disease_id {foreign_key}"
+        self.assertEqual(statements, [index, add_foreign_key])
+        executed = [c.args for c in self.cursor.execute.call_args_list]
+        self.assertEqual(executed[2][0], "CREATE TABLE IF NOT EXISTS dropped_indexes "
+                                         "(position SERIAL PRIMARY KEY, statement TEXT NOT NULL)")
+        self.assertEqual(executed[3:], [
+            ("INSERT INTO dropped_indexes (statement) VALUES (%s)", (index,)),
+            ("INSERT INTO dropped_indexes (statement) VALUES (%s)", (add_foreign_key,)),
+            ("ALTER TABLE gene_diseases DROP CONSTRAINT fk_gene_disease_disease_id",),
+            ("DROP INDEX gene_diseases_disease_id",)])
+
+    def test_failed_rebuild_keeps_load_error(self):
+        ''' test a failed rebuild is logged, and the error of the load raised '''
+
+        pool = MagicMock()
+        pool.connection.return_value.__enter__.return_value = self.conn
+        self.cursor.fetchall.side_effect = [[], [], RuntimeError("rebuild failed")]
+
+        with self.assertLogs('db_loader', level='ERROR') as logs, self.assertRaises(ValueError):
+            with secondary_indexes_dropped(pool, ['gene_diseases']):
+                raise ValueError("load failed")
+        self.assertIn("rebuild failed", logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import threading
+from unittest.mock import MagicMock
+from db_pool import ConnectionPool
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.opened = []
+
+    def connect(self):
+        conn = MagicMock(closed=0)
+        self.opened.append(conn)
+        return conn
+
+    def test_reuses_connections(self):
+        ''' test returned connections are reused, and adopted ones before opening new ones '''
+
+        pool = ConnectionPool(self.connect, maxconn=2)
+        adopted = MagicMock(closed=0)
+        pool.adopt(adopted)
+
+        with pool.connection() as conn:
+            self.assertIs(conn, adopted)
+            with pool.connection() as other:
+                self.assertIs(other, self.opened[0])
+        with pool.connection() as conn:
+            self.assertIn(conn, (adopted, self.opened[0]))
+        self.assertEqual(len(self.opened), 1)
+        adopted.rollback.assert_called()
+
+    def test_drops_closed_connections(self):
+        ''' test connections closed while in use or while idle are replaced '''
+
+        pool = ConnectionPool(self.connect, maxconn=1)
+        with pool.connection() as conn:
+            conn.closed = 1
+        with pool.connection() as conn:
+            self.assertIs(conn, self.opened[1])
+        conn.closed = 2
+        with pool.connection() as conn:
+            self.assertIs(conn, self.opened[2])
+
+    def test_waits_when_full(self):
+        ''' test a full pool makes callers wait for a connection to be returned '''
+
+        pool = ConnectionPool(self.connect, maxconn=1)
+        conn = pool.getconn()
+        taken = []
+        waiter = threading.Thread(target=lambda: taken.append(pool.getconn()))
+        waiter.start()
+        waiter.join(0.1)
+        self.assertEqual(taken, [])
+
+        pool.putconn(conn)
+        waiter.join(1)
+        self.assertEqual(taken, [conn])
+        self.assertEqual(len(self.opened), 1)
+
+    def test_adopt_full_and_closeall(self):
+        ''' test connections adopted by a full pool are closed, and closeall closes idle connections '''
+
+        pool = ConnectionPool(self.connect, maxconn=1)
+        with pool.connection():
+            extra = MagicMock(closed=0)
+            pool.adopt(extra)
+            extra.close.assert_called_once()
+        pool.closeall()
+        self.opened[0].close.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+from fuzzywuzzy import fuzz
+import metrics
+from disease_matcher import DiseaseMatcher
+
+
+class TestDiseaseMatcher(unittest.TestCase):
+    def setUp(self):
+        # setup data for testing
+        self.sample_text = """Diagnostic yield of exome sequencing
+        Patients with steroid resistant nephrotic syndrome
+        Nephrotic syndrome
+        Alport syndrome (COL4A3)
+
+        Kidney cysts were reported in two families.
+        """
+        self.diseases = [
+            "NEPHROTIC SYNDROME, TYPE 2",
+            "Autosomal recessive Alport syndrome",
+            "Inborn genetic diseases",
+            "Hereditary cancer-predisposing syndrome",
+            "Polycystic kidney disease",
+            "Alport syndrome",
+            "",
+        ]
+
+    def test_filter(self):
+        ''' test diseases found in text keep input order and are not repeated '''
+
+        matcher = DiseaseMatcher(self.sample_text)
+
+        result = matcher.filter(self.diseases + ["NEPHROTIC SYNDROME, TYPE 2"])
+
+        self.assertEqual(result, ["NEPHROTIC SYNDROME, TYPE 2", "Alport syndrome", ""])
+
+    def test_filter_same_as_fuzz_ratio(self):
+        ''' test results agree with comparing every line using fuzz.ratio '''
+
+        matcher = DiseaseMatcher(self.sample_text)
+        words = self.sample_text.lower().split()
+        candidates = self.diseases + [" ".join(words[i:i + n]) for n in range(1, 6) for i in range(len(words))]
+
+        expected = [d for d in dict.fromkeys(candidates)
+                    if any(fuzz.ratio(line.lower(), d.lower()) > 60 for line in self.sample_text.splitlines())]
+
+        self.assertEqual(matcher.filter(candidates), expected)
+
+    def test_filter_same_as_fuzz_ratio_long_lines(self):
+        ''' test results agree with fuzz.ratio for lines of every lane width, up to lines too long to be summed '''
+
+        words = self.sample_text.lower().split()
+        lines = [" ".join(words[i % len(words):] + words * 3)[:length] for i, length in enumerate(range(1, 400, 3))]
+        # a line only similar to the names made from it, and too long for its LCS to be summed in a byte
+        numbers = " ".join(str(n) for n in range(100))
+        text = "\n".join(lines + [numbers])
+        matcher = DiseaseMatcher(text)
+        candidates = self.diseases + [line[:n].upper() for line in lines[::7] for n in (10, 80, 150, 300)]
+        candidates += [numbers[:n] for n in (100, 200, 280)]
+
+        expected = [d for d in dict.fromkeys(candidates)
+                    if any(fuzz.ratio(line.lower(), d.lower()) > 60 for line in text.splitlines())]
+
+        self.assertEqual(matcher.filter(candidates), expected)
+        self.assertGreater(len(expected), len(self.diseases))
+        self.assertIn(numbers[:280], expected)
+
+    def test_matches_is_cached(self):
+        ''' test each disease is only scored once '''
+
+        matcher = DiseaseMatcher(self.sample_text)
+
+        self.assertTrue(matcher.matches("Alport syndrome"))
+        comparisons = metrics.counter('fuzzy_comparisons')
+        self.assertTrue(matcher.matches("Alport syndrome"))
+
+        self.assertGreater(comparisons, 0)
+        self.assertEqual(metrics.counter('fuzzy_comparisons'), comparisons)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from psycopg2.errors import InvalidSqlStatementName
+from db_pool import ConnectionPool
+from gene_lookup import Gene, GeneLookup, invalidate_caches
+
+GENE_ROW = ('HGNC:13394', 'NPHS2', 'chr1:179550539-179575952', 'chr1:179519674-179545087',
+            '1', 179550539, 179575952, -1, '1', 179519674, 179545087, -1)
+
+
+class FakeDatabase:
+    """Connections answering lookups from rows per prepared statement, which must be prepared first."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.statements = []
+        self.connections = []
+
+    def connect(self, config):
+        conn = MagicMock(closed=0, notifies=[])
+        prepared = set()
+        cursor = conn.cursor.return_value
+
+        def execute(sql, args=None):
+            self.statements.append(sql)
+            if sql.startswith("PREPARE"):
+                prepared.add(sql.split()[1])
+            elif sql.startswith("EXECUTE"):
+                name = sql.split()[1]
+                if name not in prepared:
+                    raise InvalidSqlStatementName(f"prepared statement \"{name}\" does not exist")
+                cursor.fetchall.return_value = self.rows[name](*args)
+        cursor.execute.side_effect = execute
+        self.connections.append(conn)
+        return conn
+
+    def executed(self):
+        return [sql for sql in self.statements if sql.startswith("EXECUTE")]
+
+
+class TestGeneLookup(unittest.TestCase):
+    def setUp(self):
+        diseases = ['Focal segmental glomerulosclerosis', 'Nephrotic syndrome', 'Nephrotic syndrome, type 2']
+        self.db = FakeDatabase({
+            'lookup_gene_by_id': lambda hgnc_id: [GENE_ROW] if hgnc_id == 'HGNC:13394' else [],
+            'lookup_gene_by_symbol': lambda symbol: [GENE_ROW] if symbol == 'NPHS2' else [],
+            'lookup_diseases': lambda hgnc_id, after, limit: [(d,) for d in diseases if d > after][:limit],
+            'lookup_find_diseases': lambda text, after, limit: [(d,) for d in diseases if text in d and d > after][:limit],
+            'lookup_genes_for_disease': lambda disease, after, limit: [GENE_ROW] if GENE_ROW[0] > after else [],
+        })
+        self.lookup = GeneLookup(config={}, connect=self.db.connect, cache_size=2)
+
+    def tearDown(self):
+        self.lookup.close()
+
+    def test_gene(self):
+        ''' test genes are looked up by HGNC ID or symbol, over a statement prepared once per connection '''
+
+        gene = self.lookup.gene('HGNC:13394')
+        self.assertEqual(gene, Gene(*GENE_ROW))
+        self.assertEqual(self.lookup.gene_by_symbol('NPHS2'), gene)
+        self.assertIsNone(self.lookup.gene('HGNC:1'))
+
+        prepares = [sql for sql in self.db.statements if sql.startswith("PREPARE")]
+        self.assertEqual(len(prepares), 2)
+        self.assertTrue(prepares[0].startswith("PREPARE lookup_gene_by_id AS SELECT hgnc_id, hgnc_gene_name"))
+        self.assertIn("LISTEN gene_tables_loaded", self.db.statements)
+
+    def test_pages(self):
+        ''' test pages continue after the last key of the previous page '''
+
+        page = self.lookup.diseases('HGNC:13394', limit=2)
+        self.assertEqual(page.items, ('Focal segmental glomerulosclerosis', 'Nephrotic syndrome'))
+        self.assertEqual(page.next_after, 'Nephrotic syndrome')
+        page = self.lookup.diseases('HGNC:13394', after=page.next_after, limit=2)
+        self.assertEqual(page.items, ('Nephrotic syndrome, type 2',))
+        self.assertIsNone(page.next_after)
+
+        page = self.lookup.find_diseases('type 2')
+        self.assertEqual(page.items, ('Nephrotic syndrome, type 2',))
+        self.assertEqual(self.lookup.find_diseases('100%_').items, ())
+        self.assertIn('100\\%\\_', [c.args[1][0] for c in self.db.connections[1].cursor.return_value.execute.call_args_list
+                                   if c.args[0].startswith("EXECUTE lookup_find_diseases")])
+
+        page = self.lookup.genes_for_disease('Nephrotic syndrome')
+        self.assertEqual([gene.hgnc_gene_name for gene in page.items], ['NPHS2'])
+        self.assertIsNone(page.next_after)
+
+    def test_cache(self):
+        ''' test results are cached, least recently used evicted first '''
+
+        self.lookup.gene('HGNC:13394')
+        self.lookup.gene('HGNC:13394')
+        self.assertEqual(len(self.db.executed()), 2)  # the first EXECUTE prepares the statement
+        self.assertEqual((self.lookup.hits, self.lookup.misses), (1, 1))
+
+        self.lookup.gene_by_symbol('NPHS2')
+        self.lookup.gene('HGNC:1')
+        self.lookup.gene('HGNC:13394')
+        self.assertEqual(self.lookup.misses, 4)
+
+    def test_invalidated_on_load(self):
+        ''' test the cache is dropped on loads in this process, and on loads notified by other processes '''
+
+        self.lookup.gene('HGNC:13394')
+        invalidate_caches()
+        self.lookup.gene('HGNC:13394')
+        self.assertEqual(self.lookup.misses, 2)
+
+        listener = self.db.connections[0]
+        listener.notifies.append(MagicMock(channel='gene_tables_loaded'))
+        self.lookup.gene('HGNC:13394')
+        self.assertEqual(self.lookup.misses, 3)
+        listener.poll.assert_called()
+        self.assertEqual(listener.notifies, [])
+
+        self.lookup.gene('HGNC:13394')
+        self.assertEqual(self.lookup.hits, 1)
+
+
+    def test_listen_failure(self):
+        ''' test lookups are served uncached while listening fails, and listening is only retried after a while '''
+
+        attempts = []
+
+        def refuse(config):
+            attempts.append(config)
+            raise OSError("connection refused")
+        lookup = GeneLookup(config={}, pool=ConnectionPool(lambda: self.db.connect({})), connect=refuse)
+
+        with self.assertLogs('gene_lookup', level='WARNING'):
+            self.assertEqual(lookup.gene('HGNC:13394').hgnc_gene_name, 'NPHS2')
+        self.assertEqual(lookup.gene('HGNC:13394').hgnc_gene_name, 'NPHS2')
+        self.assertEqual((lookup.hits, lookup.misses), (0, 2))
+        self.assertEqual(len(attempts), 1)
+
+        with patch("gene_lookup.LOOKUP_LISTEN_RETRY", 0), self.assertLogs('gene_lookup', level='WARNING'):
+            lookup._listen_retry_at = 0
+            lookup.gene('HGNC:13394')
+        self.assertEqual(len(attempts), 2)
+        lookup.close()
+
+if __name__ == '__main__':
+    unittest.main()
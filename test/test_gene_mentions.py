@@ -0,0 +1,69 @@
+import unittest
+from gene_mentions import GeneMention, GeneNameMatcher
+
+GENES = [
+    ("HGNC:618", "APOL1", ["APO-L", "APOL", "FSGS4"]),
+    ("HGNC:13394", "NPHS2", ["SRN1", "PDCN", "podocin"]),
+    ("HGNC:2204", "COL4A3", ["ATS2", "TUMSTATIN"]),
+    ("HGNC:19903", "RRAGD", ["DKFZP761H171", "bA11D8.2.1", "TUMSTATIN", "NPHS2"]),
+    ("HGNC:11621", "HNF1A", ["TCF1", "LFB1", "HNF1", "MODY3", "12"]),
+    ("HGNC:1", "HNF1", []),
+]
+
+
+class TestGeneNameMatcher(unittest.TestCase):
+    def setUp(self):
+        self.matcher = GeneNameMatcher(GENES)
+
+    def test_find(self):
+        ''' test symbols and aliases are mapped back to their genes with their offsets '''
+
+        text = "Variants in APOL1 and NPHS2 (podocin) cause FSGS4."
+
+        result = self.matcher.find(text)
+
+        self.assertEqual(result, [GeneMention("HGNC:618", 12, 17, "APOL1", "symbol"),
+                                  GeneMention("HGNC:13394", 22, 27, "NPHS2", "symbol"),
+                                  GeneMention("HGNC:13394", 29, 36, "podocin", "alias"),
+                                  GeneMention("HGNC:618", 44, 49, "FSGS4", "alias")])
+        self.assertEqual([text[m.start:m.end] for m in result], ["APOL1", "NPHS2", "podocin", "FSGS4"])
+
+    def test_word_boundaries(self):
+        ''' test names are only found as whole words, and the longest of overlapping names is kept '''
+
+        result = self.matcher.find("APOL1-associated APOL11 XAPOL1 apol1 APOL HNF1A HNF1")
+
+        self.assertEqual([(m.name, m.start) for m in result], [("APOL1", 0), ("APOL", 37), ("HNF1A", 42), ("HNF1", 48)])
+        self.assertEqual(result[-1].hgnc_id, "HGNC:1")
+
+    def test_ambiguous_aliases(self):
+        ''' test aliases of several genes, that are a symbol, short or only digits are left out '''
+
+        result = self.matcher.find("TUMSTATIN 12 NPHS2 ATS2 APO-L")
+
+        self.assertEqual([(m.hgnc_id, m.name, m.kind) for m in result],
+                         [("HGNC:13394", "NPHS2", "symbol"), ("HGNC:2204", "ATS2", "alias"),
+                          ("HGNC:618", "APO-L", "alias")])
+        self.assertEqual(len(self.matcher), 18)
+
+    def test_suffix_names(self):
+        ''' test names ending inside a longer name that failed to match are still found '''
+
+        matcher = GeneNameMatcher([("HGNC:1", "ABCDE", []), ("HGNC:2", "BCD", []), ("HGNC:3", "BCDF", [])])
+
+        result = matcher.find("ABCD BCDF A BCD")
+
+        self.assertEqual([(m.name, m.start) for m in result], [("BCDF", 5), ("BCD", 12)])
+
+    def test_short_symbols(self):
+        ''' test two-letter symbols, which are mostly abbreviations of other things, are not matched '''
+
+        matcher = GeneNameMatcher([("HGNC:1", "AR", []), ("HGNC:2", "ARX", [])])
+
+        result = matcher.find("AR and ARX")
+
+        self.assertEqual([m.name for m in result], ["ARX"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,10 @@
 import unittest
 import os
+import time
+import requests
 from unittest.mock import patch, mock_open, MagicMock
-from gene_metadata import read_pdf_file, extract_hgnc_gene_ids, add_metadata_to_gene, parse_pdf, GeneDisease
+from gene_metadata import (read_pdf_file, iter_pdf_pages, extract_hgnc_gene_ids, add_metadata_to_gene, get_diseases,
+                           get_gene_records, parse_pdf, collect_traits, filter_diseases, GeneDisease, GenomicPosition)
 
 class TestGeneMetadata(unittest.TestCase):
     def setUp(self):
@@ -17,7 +20,7 @@ class TestGeneMetadata(unittest.TestCase):
         self.diseases_csv = os.path.join(self.output_dir, "gene_diseases.csv")
 
     @patch("gene_metadata.os.path.exists")
-    @patch("gene_metadata.PyPDF2.PdfReader")
+    @patch("PyPDF2.PdfReader")
     def test_read_pdf_file(self, mock_pdf_reader, mock_exists):
         '''
         test pdf read
@@ -41,6 +44,34 @@ class TestGeneMetadata(unittest.TestCase):
         mock_page.extract_text.assert_called_once()
 
 
+    @patch("gene_metadata.os.path.exists")
+    @patch("PyPDF2.PdfReader")
+    def test_iter_pdf_pages(self, mock_pdf_reader, mock_exists):
+        ''' test pages are yielded in order and failed pages are skipped '''
+
+        mock_exists.return_value = True
+        pages = [MagicMock(), MagicMock(), MagicMock()]
+        pages[0].extract_text.return_value = "Page 1 HGNC:618"
+        pages[1].extract_text.side_effect = ValueError("bad page")
+        pages[2].extract_text.return_value = "Page 3"
+        mock_pdf_reader.return_value.pages = pages
+
+        # invoke method for testing
+        with patch("builtins.open", mock_open()), self.assertLogs("gene_metadata", level="WARNING") as logs:
+            result = list(iter_pdf_pages("test.pdf"))
+
+        # assert contents
+        self.assertEqual(result, ["Page 1 HGNC:618", "", "Page 3"])
+        self.assertIn("page 2", logs.output[0])
+
+    @patch("gene_metadata.PDF_PARALLEL_MIN_PAGES", 1)
+    def test_read_pdf_file_parallel(self):
+        ''' test pages extracted by a process pool are joined in order '''
+
+        pdf = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pub.pdf")
+
+        self.assertEqual(read_pdf_file(pdf, workers=2), read_pdf_file(pdf, workers=1))
+
     def test_extract_hgnc_gene_ids(self):
         ''' test extracting hgnc_ids from text '''
 
@@ -48,14 +79,13 @@ class TestGeneMetadata(unittest.TestCase):
 
         self.assertEqual(result, self.sample_hgnc_ids)
 
-    @patch("gene_metadata.mygene.MyGeneInfo")
+    @patch("gene_metadata.get_response_cache", return_value=None)
+    @patch("gene_metadata.http_client.get")
     @patch("gene_metadata.get_diseases")
-    def test_add_metadata_to_gene(self, mock_get_diseases, mock_mygene):
+    def test_add_metadata_to_gene(self, mock_get_diseases, mock_get, mock_cache):
         ''' test gene metadata '''
 
-        mock_mygene_instance = MagicMock()
-        mock_mygene.return_value = mock_mygene_instance
-        mock_mygene_instance.query.return_value = {
+        mock_get.return_value.json.return_value = {
             "hits": [{
                 "symbol": "APOL1",
                 "alias": ["APOL2", "APOL3"],
@@ -77,28 +107,172 @@ class TestGeneMetadata(unittest.TestCase):
         self.assertEqual(result.aliases, ["APOL2", "APOL3"])
         self.assertEqual(result.hg38, "chr22:36661906-36676353")
         self.assertEqual(result.hg19, "chr22:36649329-36663776")
+        self.assertEqual(result.hg38_pos, GenomicPosition("22", 36661906, 36676353))
+        self.assertEqual(result.hg19_pos, GenomicPosition("22", 36649329, 36663776))
         self.assertEqual(result.flt_diseases, ["Alport syndrome"])
 
 
+    @patch("gene_metadata.get_reference_store", return_value=None)
+    @patch("gene_metadata.get_response_cache", return_value=None)
+    @patch("gene_metadata.http_client.get", side_effect=requests.ConnectionError("reset"))
+    def test_get_diseases_failed(self, mock_get, mock_cache, mock_store):
+        ''' test a failed disease lookup returns None, which tells it from a gene without diseases '''
+
+        with self.assertLogs("gene_metadata", level="ERROR"):
+            self.assertIsNone(get_diseases("NPHS2"))
+
+    def test_collect_traits(self):
+        ''' test trait names are collected from esummary XML split into arbitrary chunks '''
+
+        xml = b"""<?xml version="1.0"?>
+        <eSummaryResult><DocumentSummarySet status="OK">
+        <DocumentSummary uid="1"><germline_classification><trait_set>
+            <trait><trait_xrefs/><trait_name>Alport syndrome</trait_name></trait>
+            <trait><trait_name>not provided</trait_name></trait>
+        </trait_set></germline_classification>
+        <oncogenicity_classification><trait_set><trait><trait_name>Neoplasm</trait_name></trait></trait_set>
+        </oncogenicity_classification></DocumentSummary>
+        <DocumentSummary uid="2"><germline_classification><trait_set>
+            <trait><trait_name>Hematuria</trait_name></trait>
+            <trait><trait_name>Alport syndrome</trait_name></trait>
+        </trait_set></germline_classification></DocumentSummary>
+        <DocumentSummary uid="3"></DocumentSummary>
+        </DocumentSummarySet></eSummaryResult>"""
+        traits = set()
+
+        # invoke method for testing
+        collect_traits((xml[i:i + 7] for i in range(0, len(xml), 7)), traits)
+
+        # run assertions
+        self.assertEqual(traits, {"Alport syndrome", "Hematuria"})
+
+    @patch("gene_metadata.get_response_cache", return_value=None)
+    @patch("gene_metadata.http_client.post")
+    def test_get_gene_records(self, mock_post, mock_cache):
+        ''' test HGNC IDs are resolved in batches '''
+
+        mock_post.return_value.json.side_effect = [
+            [{"query": "618", "symbol": "APOL1"}, {"query": "618", "symbol": "APOL1-AS"},
+             {"query": "2204", "symbol": "COL4A3"}],
+            [{"query": "99999", "notfound": True}],
+        ]
+
+        # invoke method for testing
+        result = get_gene_records(["HGNC:618", "HGNC:2204", "HGNC:99999"], batch_size=2)
+
+        # run assertions
+        self.assertEqual(result, {"HGNC:618": {"query": "618", "symbol": "APOL1"},
+                                  "HGNC:2204": {"query": "2204", "symbol": "COL4A3"}})
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(mock_post.call_args_list[0].kwargs["data"]["q"], "618,2204")
+
+    @patch("gene_metadata.get_response_cache", return_value=None)
+    @patch("gene_metadata.http_client.get")
+    @patch("gene_metadata.http_client.post")
+    def test_get_gene_records_failed_batch(self, mock_post, mock_get, mock_cache):
+        ''' test the IDs of a failed batch are queried one at a time, and only those not found are left out '''
+
+        mock_post.side_effect = requests.ConnectionError("reset")
+        mock_get.return_value.json.side_effect = [{"hits": [{"symbol": "APOL1"}]}, {"hits": []}]
+
+        # invoke method for testing
+        with self.assertLogs("gene_metadata", level="WARNING"):
+            result = get_gene_records(["HGNC:618", "HGNC:99999"])
+
+        # run assertions
+        self.assertEqual(result, {"HGNC:618": {"symbol": "APOL1"}})
+        self.assertEqual([c.kwargs["params"]["q"] for c in mock_get.call_args_list], ["HGNC:618", "HGNC:99999"])
+
+    @patch("gene_metadata.get_response_cache", return_value=None)
+    @patch("gene_metadata.http_client.get")
+    @patch("gene_metadata.http_client.post")
+    def test_get_gene_records_failed_id(self, mock_post, mock_get, mock_cache):
+        ''' test an ID that fails inside a failed batch is logged and skipped, and the others are resolved '''
+
+        mock_post.side_effect = requests.ConnectionError("reset")
+        mock_get.return_value.json.side_effect = [{"hits": [{"symbol": "APOL1"}]},
+                                                  requests.exceptions.JSONDecodeError("bad", "", 0),
+                                                  {"hits": [{"symbol": "NPHS2"}]}]
+
+        # invoke method for testing
+        with self.assertLogs("gene_metadata", level="WARNING") as logs:
+            result = get_gene_records(["HGNC:618", "HGNC:2204", "HGNC:13394"])
+
+        # run assertions
+        self.assertEqual(result, {"HGNC:618": {"symbol": "APOL1"}, "HGNC:13394": {"symbol": "NPHS2"}})
+        self.assertTrue(any("HGNC:2204" in line and "ERROR" in line for line in logs.output))
+
+    @patch("gene_metadata.get_diseases")
+    def test_add_metadata_to_gene_with_record(self, mock_get_diseases):
+        ''' test gene metadata from an already resolved MyGene record '''
+
+        mock_get_diseases.return_value = set()
+        gene_data = {"symbol": "NPHS2", "alias": "SRN1", "genomic_pos": [], "genomic_pos_hg19": {}}
+
+        # invoke method for testing
+        result = add_metadata_to_gene("HGNC:13394", "", gene_data)
+
+        # run assertions
+        self.assertEqual(result.symbol, "NPHS2")
+        self.assertEqual(result.aliases, ["SRN1"])
+        self.assertEqual(result.hg38, "N/A")
+        self.assertIsNone(result.hg38_pos)
+        self.assertIsNone(result.hg19_pos)
+        mock_get_diseases.assert_called_once_with("NPHS2")
+
+    def test_filter_diseases_window(self):
+        ''' test diseases are only matched near the mentions of the gene with DISEASE_WINDOW '''
+
+        text = ("Results\nRRAGD variants were found in one family with\nhypomagnesemia\nin 2020.\n"
+                "Discussion\nThe review covered\ninborn genetic diseases\nand NPHS2 in\nnephrotic syndrome\n")
+        diseases = ["Hypomagnesemia", "Inborn genetic diseases", "Nephrotic syndrome"]
+
+        gene = GeneDisease(symbol="RRAGD", hgnc_id="HGNC:19903", aliases=[], diseases=diseases)
+        filter_diseases(gene, text)
+        self.assertEqual(gene.flt_diseases, diseases)
+
+        with patch("gene_metadata.DISEASE_WINDOW", "0"):
+            gene = GeneDisease(symbol="RRAGD", hgnc_id="HGNC:19903", aliases=[], diseases=diseases)
+            filter_diseases(gene, text)
+        self.assertEqual(gene.flt_diseases, ["Hypomagnesemia"])
+
+    @patch("gene_metadata.DISEASE_WINDOW", "foo")
+    @patch("gene_metadata.load_pdf")
+    @patch("gene_metadata.del_file")
+    def test_parse_pdf_invalid_window(self, mock_del_file, mock_load_pdf):
+        ''' test an invalid DISEASE_WINDOW fails the run before any output is touched '''
+
+        with self.assertRaises(ValueError):
+            parse_pdf("pub.pdf")
+        mock_del_file.assert_not_called()
+        mock_load_pdf.assert_not_called()
+
+    @patch("gene_metadata.JOURNAL_DIR", "")
+    @patch("gene_metadata.get_pdf_cache", return_value=None)
+    @patch("gene_metadata.get_response_cache", return_value=None)
     @patch("gene_metadata.read_pdf_file")
     @patch("gene_metadata.extract_hgnc_gene_ids")
+    @patch("gene_metadata.get_gene_records")
     @patch("gene_metadata.add_metadata_to_gene")
     @patch("gene_metadata.os.path.exists")
     @patch("gene_metadata.os.makedirs")
     @patch("gene_metadata.del_file")
-    def test_parse_pdf(self, mock_del_file, mock_makedirs, mock_exists, mock_add_metadata, mock_extract_ids, mock_read_pdf):
+    def test_parse_pdf(self, mock_del_file, mock_makedirs, mock_exists, mock_add_metadata, mock_get_records,
+                       mock_extract_ids, mock_read_pdf, mock_cache, mock_pdf_cache):
         ''' test parse pdf'''
 
         mock_exists.side_effect = [True, False]  # PDF exists, output dir does not
         mock_read_pdf.return_value = self.sample_text
         mock_extract_ids.return_value = self.sample_hgnc_ids
+        mock_get_records.return_value = {"HGNC:618": {"symbol": "APOL1"}}
         mock_add_metadata.return_value = GeneDisease(
             symbol="APOL1",
             hgnc_id="HGNC:618",
             aliases=["APOL2", "APOL3"],
             hg38="chr22:36661906-36676353",
             hg19="chr22:36649329-36663776",
-            flt_diseases=["Alport syndrome"]
+            flt_diseases=["Alport syndrome"],
+            hg38_pos=GenomicPosition("22", 36661906, 36676353, 1)
         )
         mock_open_files = mock_open()
 
@@ -110,18 +284,90 @@ class TestGeneMetadata(unittest.TestCase):
             parse_pdf("test.pdf")
 
             # Assert
-            mock_read_pdf.assert_called_once_with("test.pdf")
+            mock_read_pdf.assert_called_once_with("test.pdf", None)
             mock_extract_ids.assert_called_once_with(self.sample_text)
             mock_makedirs.assert_called_once_with(self.output_dir)
             self.assertEqual(mock_del_file.call_count, 3)  # Called for each CSV
-            mock_writer_instance.writerow.assert_any_call(['hgnc_id', 'hgnc_gene_name', 'hg38', 'hg19'])
+            mock_writer_instance.writerow.assert_any_call(['hgnc_id', 'hgnc_gene_name', 'hg38', 'hg19',
+                                                           'hg38_chr', 'hg38_start', 'hg38_end', 'hg38_strand',
+                                                           'hg19_chr', 'hg19_start', 'hg19_end', 'hg19_strand'])
             mock_writer_instance.writerow.assert_any_call(['hgnc_id', 'alias'])
             mock_writer_instance.writerow.assert_any_call(['hgnc_id', 'disease'])
-            mock_writer_instance.writerow.assert_any_call(['HGNC:618', 'APOL1', 'chr22:36661906-36676353', 'chr22:36649329-36663776'])
+            mock_writer_instance.writerow.assert_any_call(['HGNC:618', 'APOL1', 'chr22:36661906-36676353', 'chr22:36649329-36663776',
+                                                           '22', 36661906, 36676353, 1, None, None, None, None])
             mock_writer_instance.writerow.assert_any_call(['HGNC:618', 'APOL2'])
             mock_writer_instance.writerow.assert_any_call(['HGNC:618', 'APOL3'])
             mock_writer_instance.writerow.assert_any_call(['HGNC:618', 'Alport syndrome'])
 
+    @patch("gene_metadata.JOURNAL_DIR", "")
+    @patch("gene_metadata.get_pdf_cache", return_value=None)
+    @patch("gene_metadata.get_response_cache", return_value=None)
+    @patch("gene_metadata.read_pdf_file")
+    @patch("gene_metadata.extract_hgnc_gene_ids")
+    @patch("gene_metadata.get_gene_records")
+    @patch("gene_metadata.add_metadata_to_gene")
+    @patch("gene_metadata.os.path.exists")
+    @patch("gene_metadata.os.makedirs")
+    @patch("gene_metadata.del_file")
+    def test_parse_pdf_concurrent_order(self, mock_del_file, mock_makedirs, mock_exists, mock_add_metadata,
+                                        mock_get_records, mock_extract_ids, mock_read_pdf, mock_cache, mock_pdf_cache):
+        ''' test genes fetched concurrently are written in HGNC ID order '''
+
+        mock_exists.side_effect = [True, False]
+        mock_read_pdf.return_value = self.sample_text
+        hgnc_ids = {"HGNC:13394", "HGNC:618", "HGNC:2204", "HGNC:19903"}
+        mock_extract_ids.return_value = hgnc_ids
+        mock_get_records.return_value = {hgnc_id: {} for hgnc_id in hgnc_ids}
+
+        def add_metadata(hgnc_id, text, gene_data, journal=None):
+            # the lowest IDs finish last
+            time.sleep(0.1 if hgnc_id in ("HGNC:618", "HGNC:2204") else 0)
+            return GeneDisease(symbol=hgnc_id, hgnc_id=hgnc_id, aliases=[], hg38="N/A", hg19="N/A")
+
+        mock_add_metadata.side_effect = add_metadata
+
+        with patch("builtins.open", mock_open()), patch("gene_metadata.csv.writer") as mock_csv_writer:
+            mock_writer_instance = MagicMock()
+            mock_csv_writer.return_value = mock_writer_instance
+
+            # invoke method for testing
+            parse_pdf("test.pdf", workers=4)
+
+            # Assert
+            gene_rows = [c.args[0][0] for c in mock_writer_instance.writerow.call_args_list
+                         if c.args[0][0].startswith("HGNC:")]
+            self.assertEqual(gene_rows, ["HGNC:618", "HGNC:2204", "HGNC:13394", "HGNC:19903"])
+
+    @patch("gene_metadata.JOURNAL_DIR", "")
+    @patch("gene_metadata.get_pdf_cache", return_value=None)
+    @patch("gene_metadata.get_response_cache", return_value=None)
+    @patch("gene_metadata.read_pdf_file")
+    @patch("gene_metadata.extract_hgnc_gene_ids")
+    @patch("gene_metadata.get_gene_records")
+    @patch("gene_metadata.add_metadata_to_gene")
+    @patch("gene_metadata.os.path.exists")
+    @patch("gene_metadata.del_file")
+    def test_parse_pdf_loader(self, mock_del_file, mock_exists, mock_add_metadata, mock_get_records,
+                              mock_extract_ids, mock_read_pdf, mock_cache, mock_pdf_cache):
+        ''' test rows are streamed to a loader without writing CSV files '''
+
+        mock_exists.return_value = True
+        mock_read_pdf.return_value = self.sample_text
+        mock_extract_ids.return_value = {"HGNC:618"}
+        mock_get_records.return_value = {"HGNC:618": {"symbol": "APOL1"}}
+        mock_add_metadata.return_value = GeneDisease(symbol="APOL1", hgnc_id="HGNC:618", aliases=["APOL2"],
+                                                     hg38="N/A", hg19="N/A", flt_diseases=["Alport syndrome"])
+        loader = MagicMock()
+
+        with patch("builtins.open", mock_open()) as mock_open_files:
+            parse_pdf("test.pdf", loader=loader, write_csv=False)
+
+        mock_open_files.assert_not_called()
+        mock_del_file.assert_not_called()
+        loader.add_rows.assert_any_call('hgnc_gene', [['HGNC:618', 'APOL1', 'N/A', 'N/A'] + [None] * 8])
+        loader.add_rows.assert_any_call('gene_aliases', [['HGNC:618', 'APOL2']])
+        loader.add_rows.assert_any_call('gene_diseases', [['HGNC:618', 'Alport syndrome']])
+
     # TODO test when pdf file is missing
 
 if __name__ == '__main__':
@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from urllib.parse import urlsplit, parse_qs
+import http_client
+import metrics
+from gene_metadata import get_diseases, get_gene_records
+
+TRAITS = ["Alport syndrome", "not provided", "Nephrotic syndrome", "Alport syndrome", "Hematuria"]
+
+
+def esummary_xml(traits):
+    """ClinVar esummary XML with one variant per trait name."""
+    docs = "".join(f"<DocumentSummary><trait_set><trait><trait_name>{t}</trait_name></trait></trait_set>"
+                   f"</DocumentSummary>" for t in traits)
+    return f'<?xml version="1.0"?><eSummaryResult><DocumentSummarySet>{docs}</DocumentSummarySet></eSummaryResult>'.encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves canned E-utilities and MyGene responses, failing the first `failures` requests with a 503."""
+    failures = 0
+    requests = []
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        self.respond(url.path, parse_qs(url.query))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+        self.respond(urlsplit(self.path).path, parse_qs(body))
+
+    def respond(self, path, params):
+        StubHandler.requests.append((path, params))
+        if StubHandler.failures > 0:
+            StubHandler.failures -= 1
+            self.send_response(503)
+            self.end_headers()
+            return
+        if path.endswith("/query"):
+            body = json.dumps([{"query": q, "symbol": f"GENE{q}"} for q in params["q"][0].split(",")]).encode()
+        elif path.endswith("esearch.fcgi"):
+            body = json.dumps({"esearchresult": {"count": str(len(TRAITS)), "webenv": "MCID_1", "querykey": "1"}}).encode()
+        else:
+            retstart = int(params["retstart"][0])
+            body = esummary_xml(TRAITS[retstart:retstart + int(params["retmax"][0])])
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestHttpClient(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StubHandler.failures = 0
+        StubHandler.requests = []
+
+    def test_retry_failed_request(self):
+        ''' test 503 responses are retried until one succeeds '''
+
+        StubHandler.failures = 2
+
+        response = http_client.get(f"{self.url}/esearch.fcgi", retries=3, backoff=0)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(StubHandler.requests), 3)
+
+    def test_retries_exhausted(self):
+        ''' test the last failed response is returned once retries run out '''
+
+        StubHandler.failures = 5
+
+        response = http_client.get(f"{self.url}/esearch.fcgi", retries=1, backoff=0)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(StubHandler.requests), 2)
+
+    def test_rate_limit(self):
+        ''' test requests to a rate limited host are spaced out '''
+
+        host = urlsplit(self.url).netloc
+        http_client.set_rate_limit(host, 20)
+        try:
+            start = time.monotonic()
+            for _ in range(5):
+                http_client.get(f"{self.url}/esearch.fcgi")
+            elapsed = time.monotonic() - start
+        finally:
+            http_client.set_rate_limit(host, None)
+
+        self.assertGreaterEqual(elapsed, 0.2)
+
+    def test_get_diseases(self):
+        ''' test diseases are fetched from a stub E-utilities server '''
+
+        metrics.reset()
+        with patch("gene_metadata.EUTILS_URL", self.url), patch("gene_metadata.get_response_cache", return_value=None), \
+                patch("gene_metadata.CLINVAR_BATCH_SIZE", 2):
+            result = get_diseases("COL4A3")
+
+        self.assertEqual(result, {"Alport syndrome", "Nephrotic syndrome", "Hematuria"})
+        self.assertEqual(StubHandler.requests[0][1]["term"], ["COL4A3[gene]"])
+        self.assertEqual(StubHandler.requests[0][1]["usehistory"], ["y"])
+        # 5 variants are summarized in pages of 2 from the history server
+        pages = StubHandler.requests[1:]
+        self.assertEqual([p[1]["retstart"] for p in pages], [["0"], ["2"], ["4"]])
+        self.assertEqual(pages[0][1]["WebEnv"], ["MCID_1"])
+        self.assertEqual(metrics.counter('http_requests', upstream='esearch', status=200), 1)
+        self.assertEqual(metrics.counter('http_requests', upstream='esummary', status=200), 3)
+        self.assertGreater(metrics.counter('http_response_bytes', upstream='esummary'), 0)
+
+    def test_get_gene_records(self):
+        ''' test MyGene batches are retried and counted like other upstreams '''
+
+        StubHandler.failures = 1
+        metrics.reset()
+        with patch("gene_metadata.MYGENE_URL", self.url), patch("gene_metadata.get_response_cache", return_value=None), \
+                patch.dict(os.environ, {"HTTP_BACKOFF": "0"}):
+            result = get_gene_records(["HGNC:618", "HGNC:2204"])
+
+        self.assertEqual(set(result), {"HGNC:618", "HGNC:2204"})
+        self.assertEqual(len(StubHandler.requests), 2)
+        self.assertEqual(metrics.counter('http_requests', upstream='mygene', status=503), 1)
+        self.assertEqual(metrics.counter('http_requests', upstream='mygene', status=200), 1)
+        self.assertGreater(metrics.counter('http_response_bytes', upstream='mygene'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
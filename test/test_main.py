@@ -1,7 +1,11 @@
 import unittest
 import os
+import sys
+import subprocess
 from unittest.mock import patch, mock_open, MagicMock
-from main import wait_for_db, populate_db, main
+from main import wait_for_db, populate_db, load_direct, main, cli
+from db_pool import close_pools, get_pool
+import psycopg2
 from psycopg2 import OperationalError
 
 class TestMain(unittest.TestCase):
@@ -28,11 +32,14 @@ class TestMain(unittest.TestCase):
             "hgnc_id,alias\nHGNC:618,APOL2\nHGNC:618,APOL3\n"
         ]
 
-    @patch("main.psycopg2.connect")
+    def tearDown(self):
+        close_pools()
+
+    @patch("psycopg2.connect")
     @patch("main.time.sleep")
     def test_wait_for_db_success(self, mock_sleep, mock_connect):
         # mocks
-        mock_conn = MagicMock()
+        mock_conn = MagicMock(closed=0)
         mock_connect.return_value = mock_conn
 
         # invoke method for testing
@@ -41,11 +48,124 @@ class TestMain(unittest.TestCase):
         # assertions
         self.assertTrue(result)
         mock_connect.assert_called_once_with(**self.db_config)
-        mock_conn.close.assert_called_once()
+        mock_conn.close.assert_not_called()
+        # the connection is kept for the load
+        with get_pool(self.db_config).connection() as conn:
+            self.assertIs(conn, mock_conn)
+        mock_connect.assert_called_once()
+
+
+    @patch("main.DB_LOAD_WORKERS", 1)
+    @patch("psycopg2.connect")
+    @patch("main.os.path.exists")
+    def test_populate_db(self, mock_exists, mock_connect):
+        ''' test CSV files are staged and merged in a transaction per table, over a pooled connection '''
+
+        mock_exists.return_value = True
+        mock_conn = MagicMock(closed=0)
+        mock_connect.return_value = mock_conn
+        mock_cursor = mock_conn.cursor.return_value
+        # staged rows per table, and whether each merged row was inserted
+        mock_cursor.fetchone.side_effect = [(2,), (1,), (3,)]
+        # the merged rows
+        mock_cursor.fetchall.side_effect = [[(True,), (False,)], [], [(True,), (True,)]]
+
+        # invoke method for testing
+        with patch("builtins.open", mock_open(read_data=self.sample_csv_content[0])):
+            stats = populate_db()
+
+        # assertions
+        self.assertEqual(stats, {
+            'hgnc_gene': {'inserted': 1, 'updated': 1, 'skipped': 0},
+            'gene_diseases': {'inserted': 0, 'updated': 0, 'skipped': 1},
+            'gene_aliases': {'inserted': 2, 'updated': 0, 'skipped': 1},
+        })
+        mock_connect.assert_called_once()
+        # one per table, and one notifying lookups of the load
+        self.assertEqual(mock_conn.__enter__.call_count, 4)
+        mock_conn.close.assert_not_called()
+        self.assertEqual(mock_cursor.copy_expert.call_count, 3)
+        statements = [c.args[0] for c in mock_cursor.execute.call_args_list]
+        self.assertIn("CREATE TEMP TABLE stage_hgnc_gene (LIKE hgnc_gene) ON COMMIT DROP", statements)
+        self.assertTrue(any(sql.startswith("INSERT INTO gene_aliases") and "ON CONFLICT (hgnc_id, alias_id) DO NOTHING" in sql
+                            for sql in statements))
+        # without DB_REBUILD_INDEXES, no index bookkeeping happens
+        self.assertFalse(any("dropped_indexes" in sql for sql in statements))
+
+    @patch("psycopg2.connect")
+    @patch("main.os.path.exists")
+    def test_populate_db_rolls_back(self, mock_exists, mock_connect):
+        ''' test a failed load is raised, and its transaction rolled back '''
+
+        mock_exists.return_value = True
+        mock_conn = MagicMock(closed=0)
+        mock_connect.return_value = mock_conn
+        mock_conn.cursor.return_value.copy_expert.side_effect = psycopg2.DataError("bad row")
+
+        with patch("builtins.open", mock_open(read_data=self.sample_csv_content[0])):
+            with self.assertRaises(psycopg2.DataError):
+                populate_db()
+
+        # hgnc_gene failed, so the other tables were not loaded
+        mock_conn.__exit__.assert_called_once()
+        self.assertIsNotNone(mock_conn.__exit__.call_args.args[0])
+        # the connection is rolled back as it returns to the pool
+        mock_conn.rollback.assert_called_once()
+
+    @patch("main.DB_LOAD_WORKERS", 1)
+    @patch("gene_lookup.notify_loaded", side_effect=psycopg2.OperationalError("server closed the connection"))
+    @patch("psycopg2.connect")
+    @patch("main.os.path.exists")
+    def test_populate_db_notify_fails(self, mock_exists, mock_connect, mock_notify):
+        ''' test a failed notification of the load is logged, and never hides the error of the load '''
+
+        mock_exists.return_value = True
+        mock_conn = MagicMock(closed=0)
+        mock_connect.return_value = mock_conn
+        mock_cursor = mock_conn.cursor.return_value
+        mock_cursor.fetchone.return_value = (0,)
+        mock_cursor.fetchall.side_effect = [[], [], psycopg2.DataError("bad row")]
 
+        with patch("builtins.open", mock_open(read_data=self.sample_csv_content[0])):
+            with self.assertLogs('main', level='ERROR') as logs, self.assertRaises(psycopg2.DataError):
+                populate_db()
+        self.assertTrue(any("Failed to notify" in line for line in logs.output))
+
+    @patch("main.DB_REBUILD_INDEXES", True)
+    @patch("main.DB_LOAD_WORKERS", 1)
+    @patch("psycopg2.connect")
+    @patch("main.os.path.exists")
+    def test_populate_db_rebuilds_indexes(self, mock_exists, mock_connect):
+        ''' test secondary indexes and foreign keys are dropped during the load and added back after it '''
+
+        mock_exists.return_value = True
+        mock_conn = MagicMock(closed=0)
+        mock_connect.return_value = mock_conn
+        mock_cursor = mock_conn.cursor.return_value
+        mock_cursor.fetchone.return_value = (0,)
+        index = "CREATE INDEX hgnc_gene_hg38_range ON public.hgnc_gene USING gist (hg38_chr)"
+        foreign_key = "FOREIGN KEY (hgnc_id) REFERENCES hgnc_gene(hgnc_id)"
+        add_foreign_key = f"ALTER TABLE gene_aliases ADD CONSTRAINT fk_gene_alias_hgnc_id {foreign_key}"
+        mock_cursor.fetchall.side_effect = [[], [('hgnc_gene_hg38_range', index)],
+                                            [('gene_aliases', 'fk_gene_alias_hgnc_id', foreign_key)], [], [], [],
+                                            [(index,), (add_foreign_key,)]]
+
+        with patch("builtins.open", mock_open(read_data=self.sample_csv_content[0])):
+            populate_db()
+
+        statements = [c.args[0] for c in mock_cursor.execute.call_args_list]
+        drop = statements.index("DROP INDEX hgnc_gene_hg38_range")
+        self.assertLess(statements.index("ALTER TABLE gene_aliases DROP CONSTRAINT fk_gene_alias_hgnc_id"), drop)
+        self.assertLess(drop, statements.index("CREATE TEMP TABLE stage_hgnc_gene (LIKE hgnc_gene) ON COMMIT DROP"))
+        self.assertLess(statements.index("INSERT INTO dropped_indexes (statement) VALUES (%s)"), drop)
+        # the name indexes of the dimensions are dropped too
+        self.assertIn(("FROM pg_indexes", (['hgnc_gene', 'gene_diseases', 'gene_aliases', 'disease', 'alias'],)),
+                      [("FROM pg_indexes", c.args[1]) for c in mock_cursor.execute.call_args_list
+                       if "FROM pg_indexes" in c.args[0]])
+        self.assertEqual(statements[-4:], [index, add_foreign_key, "DELETE FROM dropped_indexes", "NOTIFY gene_tables_loaded"])
 
     @patch("main.wait_for_db")
-    @patch("main.parse_pdf")
+    @patch("gene_metadata.parse_pdf")
     @patch("main.populate_db")
     @patch("main.os.getenv")
     def test_main(self, mock_getenv, mock_populate_db, mock_parse_pdf, mock_wait_for_db):
@@ -61,6 +181,133 @@ class TestMain(unittest.TestCase):
         mock_parse_pdf.assert_called_once()
         mock_populate_db.assert_called_once()
 
+    @patch("main.wait_for_db")
+    @patch("corpus.parse_corpus")
+    @patch("gene_metadata.parse_pdf")
+    @patch("main.populate_db")
+    @patch("main.os.getenv")
+    def test_main_corpus(self, mock_getenv, mock_populate_db, mock_parse_pdf, mock_parse_corpus, mock_wait_for_db):
+        env = dict(self.db_config, pdf_corpus="/app/corpus")
+        mock_getenv.side_effect = lambda key, default: env.get(key.lower(), default)
+        mock_wait_for_db.return_value = True
+
+        # invoke method for testing
+        main()
+
+        # assertions
+        mock_parse_corpus.assert_called_once_with("/app/corpus")
+        mock_parse_pdf.assert_not_called()
+        mock_populate_db.assert_called_once()
+
+    @patch("main.wait_for_db")
+    @patch("main.load_direct")
+    @patch("gene_metadata.parse_pdf")
+    @patch("main.populate_db")
+    @patch("main.os.getenv")
+    def test_main_direct(self, mock_getenv, mock_populate_db, mock_parse_pdf, mock_load_direct, mock_wait_for_db):
+        env = dict(self.db_config, db_load_mode="direct")
+        mock_getenv.side_effect = lambda key, default: env.get(key.lower(), default)
+        mock_wait_for_db.return_value = True
+
+        # invoke method for testing
+        main()
+
+        # assertions
+        mock_load_direct.assert_called_once_with('', write_csv=False)
+        mock_parse_pdf.assert_not_called()
+        mock_populate_db.assert_not_called()
+
+    @patch("psycopg2.connect")
+    @patch("gene_metadata.parse_pdf")
+    def test_load_direct(self, mock_parse_pdf, mock_connect):
+        ''' test rows streamed by parse_pdf are COPYed outside a transaction, and merged in one '''
+
+        mock_conn = MagicMock(closed=0, autocommit=False)
+        mock_connect.return_value = mock_conn
+        mock_cursor = mock_conn.cursor.return_value
+        mock_cursor.fetchone.return_value = (0,)
+        mock_cursor.fetchall.return_value = []
+
+        stats = load_direct()
+
+        loader = mock_parse_pdf.call_args.kwargs['loader']
+        mock_parse_pdf.assert_called_once_with(loader=loader, write_csv=False)
+        self.assertEqual(set(stats), {'hgnc_gene', 'gene_diseases', 'gene_aliases'})
+        statements = [c.args[0] for c in mock_cursor.execute.call_args_list]
+        self.assertTrue(all(s.endswith("ON COMMIT PRESERVE ROWS") for s in statements if s.startswith("CREATE TEMP")))
+        self.assertIn("DROP TABLE IF EXISTS stage_hgnc_gene", statements)
+        self.assertFalse(mock_conn.autocommit)
+        self.assertFalse(any("dropped_indexes" in s for s in statements))
+        mock_conn.__enter__.assert_called_once()
+        close_pools()
+        mock_conn.close.assert_called_once()
+
+    @patch("main.DB_REBUILD_INDEXES", True)
+    @patch("psycopg2.connect")
+    @patch("gene_metadata.parse_pdf")
+    def test_load_direct_rebuilds_indexes(self, mock_parse_pdf, mock_connect):
+        ''' test DB_REBUILD_INDEXES drops the indexes for the merge of a direct load, as for populate_db '''
+
+        mock_conn = MagicMock(closed=0, autocommit=False)
+        mock_connect.return_value = mock_conn
+        mock_cursor = mock_conn.cursor.return_value
+        mock_cursor.fetchone.return_value = (0,)
+        index = "CREATE INDEX disease_name_trgm ON public.disease USING gin (name gin_trgm_ops)"
+        mock_cursor.fetchall.side_effect = [[], [('disease_name_trgm', index)], [], [], [], [], [(index,)]]
+
+        load_direct()
+
+        statements = [c.args[0] for c in mock_cursor.execute.call_args_list]
+        drop = statements.index("DROP INDEX disease_name_trgm")
+        self.assertLess(drop, next(i for i, s in enumerate(statements) if s.startswith("INSERT INTO hgnc_gene")))
+        self.assertEqual(statements[-2:], [index, "DELETE FROM dropped_indexes"])
+        close_pools()
+
+
+    @patch("main.metrics.export")
+    @patch("main.wait_for_db")
+    @patch("main.populate_db")
+    @patch("main.main")
+    def test_cli_load(self, mock_main, mock_populate_db, mock_wait_for_db, mock_export):
+        ''' test the load command only loads the database, and no command runs the whole pipeline '''
+
+        mock_wait_for_db.return_value = True
+
+        self.assertEqual(cli(['--output-dir', '/tmp/csv', 'load']), 0)
+        mock_populate_db.assert_called_once_with('/tmp/csv')
+        mock_main.assert_not_called()
+        mock_export.assert_called_once()
+
+        mock_wait_for_db.return_value = False
+        self.assertEqual(cli(['load']), 1)
+
+        self.assertEqual(cli([]), 0)
+        mock_main.assert_called_once()
+
+    @patch.dict(os.environ, {'REFERENCE_STORE': '/tmp/reference.sqlite'})
+    @patch("main.metrics.export")
+    @patch("reference_store.update_from_env")
+    @patch("stages.match")
+    @patch("stages.fetch")
+    def test_cli_fetch_updates_reference_store(self, mock_fetch, mock_match, mock_update, mock_export):
+        ''' test the fetch command brings the reference store up to date first, as main does, and match does not '''
+
+        self.assertEqual(cli(['--work-dir', '/tmp/work', 'fetch']), 0)
+        mock_update.assert_called_once_with('/tmp/reference.sqlite')
+        mock_fetch.assert_called_once_with(work_dir='/tmp/work')
+
+        self.assertEqual(cli(['match']), 0)
+        mock_update.assert_called_once()
+
+    def test_lazy_imports(self):
+        ''' test importing main does not import the database driver or the pipeline '''
+
+        code = "import sys, main; print(sorted(m for m in ('psycopg2', 'gene_metadata', 'PyPDF2', 'mygene', 'fuzzywuzzy') if m in sys.modules))"
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+        self.assertEqual(result.stdout.strip(), "[]")
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
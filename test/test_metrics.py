@@ -0,0 +1,75 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def test_stage_and_counters(self):
+        ''' test stage times and counters add up over calls '''
+
+        for _ in range(2):
+            with metrics.stage('match'):
+                sum(range(10000))
+        metrics.inc('rows_copied', 3, table='gene_aliases')
+        metrics.inc('rows_copied', 2, table='gene_aliases')
+
+        run = metrics.summary()
+        self.assertEqual(run['stages']['match']['calls'], 2)
+        self.assertGreater(run['stages']['match']['seconds'], 0)
+        self.assertEqual(metrics.counter('rows_copied', table='gene_aliases'), 5)
+        self.assertEqual(run['counters']['rows_copied'], [{'labels': {'table': 'gene_aliases'}, 'value': 5}])
+
+    def test_prometheus(self):
+        ''' test requests are exported as counters and a cumulative latency histogram '''
+
+        metrics.observe_request('esearch', 0.07, 200, 100)
+        metrics.observe_request('esearch', 3.0, 503, 20)
+        metrics.observe_request('esearch', 0.01)
+        with metrics.gene('HGNC:618'):
+            pass
+
+        text = metrics.prometheus()
+        self.assertIn('pipeline_http_requests_total{status="200",upstream="esearch"} 1', text)
+        self.assertIn('pipeline_http_requests_total{status="error",upstream="esearch"} 1', text)
+        self.assertIn('pipeline_http_response_bytes_total{upstream="esearch"} 120', text)
+        self.assertIn('pipeline_http_request_seconds_bucket{le="0.05",upstream="esearch"} 1', text)
+        self.assertIn('pipeline_http_request_seconds_bucket{le="0.1",upstream="esearch"} 2', text)
+        self.assertIn('pipeline_http_request_seconds_bucket{le="+Inf",upstream="esearch"} 3', text)
+        self.assertIn('pipeline_gene_seconds_count 1', text)
+        self.assertIn('# TYPE pipeline_http_request_seconds histogram', text)
+
+    def test_export(self):
+        ''' test the textfile and the run summary are written to the metrics directory '''
+
+        metrics.inc('fuzzy_comparisons', 7)
+        with tempfile.TemporaryDirectory() as tmp:
+            metrics.export(tmp)
+            with open(os.path.join(tmp, metrics.SUMMARY_FILE)) as file:
+                run = json.load(file)
+            with open(os.path.join(tmp, metrics.PROMETHEUS_FILE)) as file:
+                text = file.read()
+
+        self.assertEqual(run['counters']['fuzzy_comparisons'][0]['value'], 7)
+        self.assertIn('pipeline_fuzzy_comparisons_total 7', text)
+
+    def test_profile(self):
+        ''' test profiles are written once, for the outermost profiled block '''
+
+        with tempfile.TemporaryDirectory() as tmp:
+            with patch("metrics.PROFILE_DIR", tmp):
+                with metrics.profile('outer', 'cpu,memory'):
+                    with metrics.profile('inner', 'cpu,memory'):
+                        [str(i) for i in range(1000)]
+            files = sorted(os.listdir(tmp))
+
+        self.assertEqual(files, ['outer.prof', 'outer.tracemalloc.txt'])
+
+
+if __name__ == '__main__':
+    unittest.main()
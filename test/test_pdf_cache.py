@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+from pdf_cache import PdfText, PdfTextCache, file_digest
+from gene_metadata import load_pdf
+
+
+class TestPdfCache(unittest.TestCase):
+    def setUp(self):
+        # setup a cache in a temporary directory
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = PdfTextCache(os.path.join(self.tmp_dir, "pdf"), "1")
+        self.pdf_text = PdfText.from_pages(["Page 1 HGNC:618\n", "", "Page 3"], ["HGNC:618"])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_pages(self):
+        ''' test pages are recovered from the text and page offsets '''
+
+        self.assertEqual(self.pdf_text.page_offsets, [0, 16, 16])
+        self.assertEqual(self.pdf_text.pages(), ["Page 1 HGNC:618\n", "", "Page 3"])
+
+    def test_get_put(self):
+        ''' test entries are read back by digest '''
+
+        self.assertIsNone(self.cache.get("abc"))
+        self.cache.put("abc", self.pdf_text)
+
+        self.assertEqual(self.cache.get("abc"), self.pdf_text)
+
+    def test_version_invalidates(self):
+        ''' test entries from another extractor version are ignored '''
+
+        self.cache.put("abc", self.pdf_text)
+        newer = PdfTextCache(self.cache.directory, "2")
+
+        self.assertIsNone(newer.get("abc"))
+
+    def test_file_digest(self):
+        ''' test files with the same content have the same digest '''
+
+        paths = [os.path.join(self.tmp_dir, name) for name in ("a.pdf", "b.pdf", "c.pdf")]
+        for path, content in zip(paths, (b"same", b"same", b"other")):
+            with open(path, "wb") as f:
+                f.write(content)
+
+        self.assertEqual(file_digest(paths[0]), file_digest(paths[1]))
+        self.assertNotEqual(file_digest(paths[0]), file_digest(paths[2]))
+
+    @patch("gene_metadata.iter_pdf_pages")
+    def test_load_pdf_cached(self, mock_iter_pages):
+        ''' test a PDF is only parsed once '''
+
+        pdf = os.path.join(self.tmp_dir, "test.pdf")
+        with open(pdf, "wb") as f:
+            f.write(b"%PDF-1.4")
+        mock_iter_pages.return_value = iter(["HGNC:2204 and ", "HGNC:618"])
+
+        with patch("gene_metadata.get_pdf_cache", return_value=self.cache):
+            first = load_pdf(pdf)
+            second = load_pdf(pdf)
+
+        self.assertEqual(first, ("HGNC:2204 and HGNC:618", {"HGNC:618", "HGNC:2204"}))
+        self.assertEqual(second, first)
+        mock_iter_pages.assert_called_once_with(pdf, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
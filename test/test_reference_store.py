@@ -0,0 +1,130 @@
+import gzip
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import gene_metadata
+from reference_store import ReferenceStore, update_store
+
+HGNC_TSV = (
+    "hgnc_id\tsymbol\tname\talias_symbol\tprev_symbol\n"
+    "HGNC:618\tAPOL1\tapolipoprotein L1\t\"APO-L|APOL\"\tFSGS4\n"
+    "HGNC:13394\tNPHS2\tNPHS2 stomatin family member\tSRN1\t\n"
+)
+VARIANT_SUMMARY = (
+    "#AlleleID\tType\tGeneSymbol\tPhenotypeList\tAssembly\n"
+    "1\tsingle nucleotide variant\tAPOL1\tFocal segmental glomerulosclerosis 4|not provided\tGRCh37\n"
+    "1\tsingle nucleotide variant\tAPOL1\tFocal segmental glomerulosclerosis 4|not provided\tGRCh38\n"
+    "2\tDeletion\tAPOL1;APOL2\tHypertensive nephropathy;Inborn genetic diseases\tGRCh38\n"
+    "3\tsingle nucleotide variant\tNPHS2\tNephrotic syndrome, type 2\tGRCh38\n"
+)
+BIOMART_TSV = (
+    "Gene stable ID\tHGNC ID\tChromosome/scaffold name\tGene start (bp)\tGene end (bp)\tStrand\n"
+    "ENSG00000100342\tHGNC:618\tCHR_HSCHR22_1_CTG7\t36250000\t36260000\t1\n"
+    "ENSG00000100342\tHGNC:618\t22\t36253071\t36267530\t1\n"
+)
+
+
+class TestReferenceStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store_path = os.path.join(self.tmp.name, "reference.sqlite")
+        self.hgnc = self.write("hgnc_complete_set.txt", HGNC_TSV)
+        self.clinvar = self.write("variant_summary.txt.gz", VARIANT_SUMMARY)
+        self.positions = self.write("mart_export.txt", BIOMART_TSV)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp.name, name)
+        with (gzip.open(path, 'wt') if name.endswith('.gz') else open(path, 'w')) as file:
+            file.write(content)
+        return path
+
+    def test_build(self):
+        ''' test genes, positions and traits are loaded from the bulk files '''
+
+        update_store(self.store_path, {'hgnc': self.hgnc, 'clinvar': self.clinvar, 'positions_hg38': self.positions})
+        store = ReferenceStore(self.store_path)
+
+        records = store.gene_records(["HGNC:618", "HGNC:13394", "HGNC:1"])
+        self.assertEqual(set(records), {"HGNC:618", "HGNC:13394"})
+        self.assertEqual(records["HGNC:618"]["alias"], ["APO-L", "APOL", "FSGS4"])
+        self.assertEqual(records["HGNC:618"]["genomic_pos"], {'chr': '22', 'start': 36253071, 'end': 36267530, 'strand': 1})
+        self.assertNotIn("genomic_pos_hg19", records["HGNC:618"])
+        self.assertEqual(store.traits("APOL1"), {"Focal segmental glomerulosclerosis 4", "Hypertensive nephropathy",
+                                                 "Inborn genetic diseases"})
+        self.assertEqual(store.traits("APOL2"), {"Hypertensive nephropathy", "Inborn genetic diseases"})
+        store.close()
+
+    def test_incremental_update(self):
+        ''' test unchanged files are skipped and changed files only write their differences '''
+
+        first = update_store(self.store_path, {'hgnc': self.hgnc, 'clinvar': self.clinvar})
+        self.assertEqual(first['clinvar'], {'written': 6, 'deleted': 0, 'total': 6})
+
+        self.assertEqual(update_store(self.store_path, {'hgnc': self.hgnc, 'clinvar': self.clinvar}),
+                         {'hgnc': None, 'clinvar': None})
+
+        self.write("variant_summary.txt.gz", VARIANT_SUMMARY.replace("Nephrotic syndrome, type 2", "Nephrotic syndrome"))
+        second = update_store(self.store_path, {'hgnc': self.hgnc, 'clinvar': self.clinvar})
+        self.assertIsNone(second['hgnc'])
+        self.assertEqual(second['clinvar'], {'written': 1, 'deleted': 1, 'total': 6})
+
+        # rows are compared per assembly, and a NULL strand is unchanged when loaded again
+        update_store(self.store_path, {'positions_hg38': self.positions, 'positions_hg19': self.positions})
+        self.write("mart_export.txt", BIOMART_TSV.replace("36267530\t1", "36267530\t"))
+        third = update_store(self.store_path, {'positions_hg38': self.positions})
+        self.assertEqual(third['positions_hg38'], {'written': 1, 'deleted': 0, 'total': 1})
+        forced = update_store(self.store_path, {'positions_hg38': self.positions}, force=True)
+        self.assertEqual(forced['positions_hg38'], {'written': 0, 'deleted': 0, 'total': 1})
+        store = ReferenceStore(self.store_path)
+        self.assertEqual(store.gene_records(["HGNC:618"])["HGNC:618"]["genomic_pos_hg19"]["strand"], 1)
+        store.close()
+
+    def test_pipeline_uses_store(self):
+        ''' test genes and diseases are resolved from the store without going to the network '''
+
+        update_store(self.store_path, {'hgnc': self.hgnc, 'clinvar': self.clinvar})
+        gene_metadata.get_reference_store.cache_clear()
+        try:
+            with patch("gene_metadata.REFERENCE_STORE", self.store_path), \
+                    patch("gene_metadata.http_client.post", side_effect=AssertionError("network")), \
+                    patch("gene_metadata.http_client.get", side_effect=AssertionError("network")):
+                records = gene_metadata.get_gene_records(["HGNC:13394"])
+                gene = gene_metadata.resolve_gene("HGNC:13394", records["HGNC:13394"])
+                gene_metadata.get_reference_store().close()
+        finally:
+            gene_metadata.get_reference_store.cache_clear()
+
+        self.assertEqual(gene.symbol, "NPHS2")
+        self.assertEqual(gene.aliases, ["SRN1"])
+        self.assertEqual(gene.hg38, "N/A")
+        self.assertEqual(gene.diseases, ["Nephrotic syndrome, type 2"])
+
+    @patch("gene_metadata.get_pdf_cache", return_value=None)
+    @patch("gene_metadata.read_pdf_file")
+    def test_gene_names(self, mock_read_pdf, mock_pdf_cache):
+        ''' test genes named by symbol or alias in the store are found with HGNC IDs '''
+
+        update_store(self.store_path, {'hgnc': self.hgnc})
+        mock_read_pdf.return_value = "Podocin (SRN1) and APOL1 variants, see HGNC:2204."
+        gene_metadata.get_reference_store.cache_clear()
+        gene_metadata.get_gene_name_matcher.cache_clear()
+        try:
+            with patch("gene_metadata.REFERENCE_STORE", self.store_path), patch("gene_metadata.GENE_NAMES", True):
+                _, hgnc_ids = gene_metadata.load_pdf("test.pdf")
+                mentions = gene_metadata.find_gene_mentions(mock_read_pdf.return_value)
+                gene_metadata.get_reference_store().close()
+        finally:
+            gene_metadata.get_reference_store.cache_clear()
+            gene_metadata.get_gene_name_matcher.cache_clear()
+
+        self.assertEqual(hgnc_ids, {"HGNC:13394", "HGNC:618", "HGNC:2204"})
+        self.assertEqual([(m.hgnc_id, m.start, m.kind) for m in mentions],
+                         [("HGNC:13394", 9, "alias"), ("HGNC:618", 19, "symbol"), ("HGNC:2204", 39, "id")])
+
+
+if __name__ == '__main__':
+    unittest.main()
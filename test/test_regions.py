@@ -0,0 +1,40 @@
+import unittest
+from unittest.mock import MagicMock
+from regions import GeneRegion, genes_in_region, genes_overlapping, normalize_chromosome, parse_region
+
+
+class TestRegions(unittest.TestCase):
+    def test_parse_region(self):
+        ''' test regions are parsed with or without chr prefix and thousands separators '''
+
+        self.assertEqual(parse_region("chr22:36,600,000-36,700,000"), ("22", 36600000, 36700000))
+        self.assertEqual(parse_region("X:1-10"), ("X", 1, 10))
+        self.assertEqual(normalize_chromosome("chrM"), "MT")
+        with self.assertRaises(ValueError):
+            parse_region("chr22:200-100")
+        with self.assertRaises(ValueError):
+            parse_region("chr22")
+
+    def test_genes_overlapping(self):
+        ''' test the overlap query uses the indexed range expression of the assembly '''
+
+        conn = MagicMock()
+        cursor = conn.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = [("HGNC:618", "APOL1", "22", 36253133, 36267530, 1)]
+
+        genes = genes_in_region(conn, "chr22:36,250,000-36,260,000", assembly="hg19")
+
+        self.assertEqual(genes, [GeneRegion("HGNC:618", "APOL1", "22", 36253133, 36267530, 1)])
+        sql, params = cursor.execute.call_args.args
+        self.assertIn("WHERE hg19_chr = %s AND int8range(hg19_start, hg19_end, '[]') && int8range(%s, %s, '[]')", sql)
+        self.assertEqual(params, ("22", 36250000, 36260000))
+
+    def test_unknown_assembly(self):
+        ''' test assemblies are checked before they are put in SQL '''
+
+        with self.assertRaises(ValueError):
+            genes_overlapping(MagicMock(), "1", 1, 2, assembly="hg38; DROP TABLE hgnc_gene")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+from response_cache import MISS, ResponseCache, cache_key
+from gene_metadata import get_diseases, get_gene_records
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        # setup a cache in a temporary directory
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "responses.sqlite")
+        self.cache = ResponseCache(self.path)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_cache_key(self):
+        ''' test keys do not depend on parameter order '''
+
+        self.assertEqual(cache_key("mygene", a=1, b=2), cache_key("mygene", b=2, a=1))
+        self.assertNotEqual(cache_key("mygene", a=1), cache_key("clinvar", a=1))
+        self.assertTrue(cache_key("mygene", a=1).startswith("mygene:"))
+
+    def test_get_put(self):
+        ''' test values persist across cache instances and hits and misses are counted '''
+
+        key = cache_key("clinvar", term="COL4A3[gene]")
+        self.assertIs(self.cache.get(key), MISS)
+        self.cache.put(key, ["Alport syndrome"])
+
+        reopened = ResponseCache(self.path)
+        self.assertEqual(reopened.get(key), ["Alport syndrome"])
+        reopened.close()
+        self.assertEqual(self.cache.misses["clinvar"], 1)
+
+    def test_ttl(self):
+        ''' test expired entries are misses '''
+
+        key = cache_key("clinvar", term="COL4A3[gene]")
+        self.cache.put(key, [])
+        self.cache.ttl = -1
+
+        self.assertIs(self.cache.get(key), MISS)
+
+    def test_lru_eviction(self):
+        ''' test the least recently used entries are evicted when the cache is full '''
+
+        self.cache.max_bytes = 25
+        self.cache.put("a:1", "x" * 8)
+        self.cache.put("a:2", "y" * 8)
+        self.cache.get("a:1")
+        self.cache.put("a:3", "z" * 8)
+
+        self.assertEqual(self.cache.get("a:1"), "x" * 8)
+        self.assertIs(self.cache.get("a:2"), MISS)
+        self.assertEqual(self.cache.get("a:3"), "z" * 8)
+
+    @patch("gene_metadata.http_client.get")
+    def test_get_diseases_cached(self, mock_get):
+        ''' test diseases are fetched once and then served from the cache '''
+
+        esearch = MagicMock()
+        esearch.json.return_value = {"esearchresult": {"idlist": []}}
+        mock_get.return_value = esearch
+
+        with patch("gene_metadata.get_response_cache", return_value=self.cache):
+            self.assertEqual(get_diseases("NPHS2"), set())
+            self.assertEqual(get_diseases("NPHS2"), set())
+
+        mock_get.assert_called_once()
+        self.assertEqual(self.cache.hits["clinvar"], 1)
+
+    @patch("gene_metadata.CACHE_ONLY", True)
+    @patch("gene_metadata.http_client.post")
+    def test_get_gene_records_cache_only(self, mock_post):
+        ''' test cache-only mode resolves cached IDs and skips the others '''
+
+        with patch("gene_metadata.get_response_cache", return_value=self.cache):
+            self.cache.put(cache_key("mygene", hgnc_id="HGNC:618", species="human",
+                                     fields="symbol,alias,genomic_pos_hg19,genomic_pos"), {"symbol": "APOL1"})
+
+            result = get_gene_records(["HGNC:618", "HGNC:2204"])
+
+        self.assertEqual(result, {"HGNC:618": {"symbol": "APOL1"}})
+        mock_post.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
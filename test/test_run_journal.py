@@ -0,0 +1,195 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import gene_metadata
+from run_journal import RunJournal, content_run, open_journal
+
+PUB_PDF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pub.pdf")
+
+
+class Killed(BaseException):
+    """Stands for the process being killed, which resolve_gene does not catch as it catches Exception."""
+
+
+HGNC_IDS = ["HGNC:618", "HGNC:2204", "HGNC:11621", "HGNC:13394", "HGNC:19903"]
+
+
+def gene_record(hgnc_id):
+    number = int(hgnc_id.split(':')[1])
+    return {'symbol': f"GENE{number}", 'alias': [f"ALIAS{number}"],
+            'genomic_pos': {'chr': '22', 'start': number, 'end': number + 100, 'strand': -1}}
+
+
+class TestRunJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "journal", "run.jsonl")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_reopen(self):
+        ''' test recorded entries are read back by the next journal of the run '''
+
+        journal = RunJournal(self.path, "pdf:a")
+        journal.record("HGNC:618", {"symbol": "APOL1"})
+        journal.close()
+
+        journal = RunJournal(self.path, "pdf:a")
+        self.assertIn("HGNC:618", journal)
+        self.assertEqual(journal.get("HGNC:618"), {"symbol": "APOL1"})
+        self.assertIsNone(journal.get("HGNC:13394"))
+        journal.close()
+
+    def test_incomplete_entry(self):
+        ''' test an entry partly written by a crash is dropped, and entries recorded after it are kept '''
+
+        journal = RunJournal(self.path, "pdf:a")
+        journal.record("HGNC:618", {"symbol": "APOL1"})
+        journal.close()
+        with open(self.path, "ab") as f:
+            f.write(b'{"key": "HGNC:13394", "val')
+
+        with self.assertLogs("run_journal", level="WARNING"):
+            journal = RunJournal(self.path, "pdf:a")
+        self.assertEqual(journal.keys(), ["HGNC:618"])
+        journal.record("HGNC:2204", {"symbol": "COL4A3"})
+        journal.close()
+
+        journal = RunJournal(self.path, "pdf:a")
+        self.assertEqual(journal.keys(), ["HGNC:618", "HGNC:2204"])
+        journal.close()
+
+    def test_other_run(self):
+        ''' test the journal of another run is started over '''
+
+        journal = RunJournal(self.path, "pdf:a")
+        journal.record("HGNC:618", {"symbol": "APOL1"})
+        journal.close()
+
+        journal = RunJournal(self.path, "pdf:b")
+        self.assertEqual(journal.keys(), [])
+        journal.close()
+
+    def test_complete(self):
+        ''' test a completed run removes its journal, and an empty directory disables journaling '''
+
+        journal = open_journal(os.path.join(self.tmp.name, "journal"), "pdf:a")
+        self.assertTrue(os.path.exists(journal.path))
+        journal.complete()
+        self.assertFalse(os.path.exists(journal.path))
+        self.assertIsNone(open_journal("", "pdf:a"))
+
+    def test_content_run(self):
+        ''' test a file changed in place names another run, so its journal is not resumed '''
+
+        path = os.path.join(self.tmp.name, "pub.pdf")
+        with open(path, "wb") as f:
+            f.write(b"first")
+        run = content_run('pdf', path, [path])
+        self.assertTrue(run.startswith(f"pdf:{os.path.abspath(path)}:"))
+        self.assertEqual(content_run('pdf', path, [path]), run)
+
+        with open(path, "wb") as f:
+            f.write(b"second")
+        self.assertNotEqual(content_run('pdf', path, [path]), run)
+
+
+@patch("gene_metadata.get_pdf_cache", return_value=None)
+@patch("gene_metadata.get_response_cache", return_value=None)
+class TestResumeParsePdf(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.journal_dir = os.path.join(self.tmp.name, "journal")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_pdf(self, output_dir, get_diseases):
+        with patch("gene_metadata.get_gene_records") as mock_get_records, \
+                patch("gene_metadata.get_diseases", side_effect=get_diseases):
+            mock_get_records.side_effect = lambda hgnc_ids: {hgnc_id: gene_record(hgnc_id) for hgnc_id in hgnc_ids}
+            try:
+                gene_metadata.parse_pdf(PUB_PDF, workers=1, output_dir=output_dir, journal_dir=self.journal_dir)
+            finally:
+                requested = [hgnc_id for call in mock_get_records.call_args_list for hgnc_id in call.args[0]]
+        return requested
+
+    def read_output(self, output_dir):
+        output = {}
+        for table in gene_metadata.CSV_HEADERS:
+            with open(os.path.join(output_dir, f"{table}.csv"), "rb") as f:
+                output[table] = f.read()
+        return output
+
+    def test_resume(self, mock_cache, mock_pdf_cache):
+        ''' test a run interrupted on the third gene resumes without resolving finished genes again '''
+
+        fetched = []
+        killed = []
+
+        def get_diseases(symbol):
+            fetched.append(symbol)
+            if symbol == "GENE11621" and not killed:
+                killed.append(symbol)
+                raise Killed()
+            return {"Nephrotic syndrome, type 2", f"Disease of {symbol}"}
+
+        clean_dir = os.path.join(self.tmp.name, "clean")
+        self.run_pdf(clean_dir, lambda symbol: {"Nephrotic syndrome, type 2", f"Disease of {symbol}"})
+        self.assertEqual(os.listdir(self.journal_dir), [])
+
+        output_dir = os.path.join(self.tmp.name, "output")
+        with self.assertRaises(Killed):
+            self.run_pdf(output_dir, get_diseases)
+        self.assertEqual(len(os.listdir(self.journal_dir)), 1)
+        finished = [f"HGNC:{symbol[4:]}" for symbol in fetched if symbol != "GENE11621"]
+        self.assertIn("HGNC:618", finished)
+
+        fetched.clear()
+        requested = self.run_pdf(output_dir, get_diseases)
+
+        self.assertEqual(sorted(requested), sorted(set(HGNC_IDS) - set(finished)))
+        self.assertIn("GENE11621", fetched)
+        self.assertNotIn("GENE618", fetched)
+        self.assertEqual(self.read_output(output_dir), self.read_output(clean_dir))
+        self.assertEqual(os.listdir(self.journal_dir), [])
+
+    def test_resume_failed_diseases(self, mock_cache, mock_pdf_cache):
+        ''' test a gene whose disease lookup failed is not journaled, so a resumed run fetches it again '''
+
+        fetched = []
+        failed = []
+        killed = []
+
+        def get_diseases(symbol):
+            fetched.append(symbol)
+            if symbol == "GENE2204" and not failed:
+                # get_diseases returns None when the lookup failed
+                failed.append(symbol)
+                return None
+            if symbol == "GENE11621" and not killed:
+                killed.append(symbol)
+                raise Killed()
+            return {"Nephrotic syndrome, type 2", f"Disease of {symbol}"}
+
+        clean_dir = os.path.join(self.tmp.name, "clean")
+        self.run_pdf(clean_dir, lambda symbol: {"Nephrotic syndrome, type 2", f"Disease of {symbol}"})
+
+        output_dir = os.path.join(self.tmp.name, "output")
+        with self.assertRaises(Killed):
+            self.run_pdf(output_dir, get_diseases)
+        self.assertEqual(fetched[:3], ["GENE618", "GENE2204", "GENE11621"])
+
+        fetched.clear()
+        requested = self.run_pdf(output_dir, get_diseases)
+
+        self.assertIn("HGNC:2204", requested)
+        self.assertNotIn("HGNC:618", requested)
+        self.assertIn("GENE2204", fetched)
+        self.assertEqual(self.read_output(output_dir), self.read_output(clean_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
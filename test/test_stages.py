@@ -0,0 +1,102 @@
+import os
+import json
+import tempfile
+import unittest
+from unittest.mock import patch
+import stages
+from gene_metadata import CSV_HEADERS, parse_pdf
+
+PUB_PDF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pub.pdf")
+
+
+def gene_records(hgnc_ids):
+    return {hgnc_id: {'symbol': f"GENE{hgnc_id[5:]}", 'alias': [f"ALIAS{hgnc_id[5:]}"]} for hgnc_id in hgnc_ids}
+
+
+def get_diseases(symbol):
+    return {"Nephrotic syndrome", "Alport syndrome", f"Disease of {symbol}"}
+
+
+@patch("gene_metadata.JOURNAL_DIR", "")
+@patch("gene_metadata.get_pdf_cache", return_value=None)
+@patch("gene_metadata.get_response_cache", return_value=None)
+@patch("gene_metadata.get_diseases", side_effect=get_diseases)
+@patch("gene_metadata.get_gene_records", side_effect=gene_records)
+class TestStages(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.work_dir = os.path.join(self.tmp.name, "work")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read_csvs(self, output_dir):
+        output = {}
+        for table in CSV_HEADERS:
+            with open(os.path.join(output_dir, f"{table}.csv"), "rb") as f:
+                output[table] = f.read()
+        return output
+
+    @patch("stages.get_gene_records", side_effect=gene_records)
+    @patch("stages.get_response_cache", return_value=None)
+    def test_stages(self, mock_stage_cache, mock_stage_records, mock_get_records, mock_get_diseases, mock_cache,
+                    mock_pdf_cache):
+        ''' test extract, fetch and match write their artifacts and the same CSV files as parse_pdf '''
+
+        output_dir = os.path.join(self.tmp.name, "output")
+
+        extracted = stages.extract(PUB_PDF, work_dir=self.work_dir)
+        stages.fetch(work_dir=self.work_dir, journal_dir="")
+        matches = stages.match(work_dir=self.work_dir, output_dir=output_dir, workers=1)
+
+        entry = extracted['publications'][0]
+        self.assertEqual(entry['name'], "pub.pdf")
+        self.assertEqual(entry['hgnc_ids'], ["HGNC:618", "HGNC:2204", "HGNC:11621", "HGNC:13394", "HGNC:19903"])
+        with open(os.path.join(self.work_dir, "genes.json")) as f:
+            self.assertEqual(json.load(f)['genes']["HGNC:618"]['symbol'], "GENE618")
+        self.assertEqual(matches["pub.pdf"]["HGNC:618"], ["Alport syndrome", "Nephrotic syndrome"])
+
+        parse_dir = os.path.join(self.tmp.name, "parse_pdf")
+        parse_pdf(PUB_PDF, output_dir=parse_dir)
+        self.assertEqual(self.read_csvs(output_dir), self.read_csvs(parse_dir))
+
+    @patch("stages.get_gene_records", side_effect=gene_records)
+    @patch("stages.get_response_cache", return_value=None)
+    def test_match_skips_publication(self, mock_stage_cache, mock_stage_records, mock_get_records, mock_get_diseases,
+                                     mock_cache, mock_pdf_cache):
+        ''' test a publication that fails to match is logged and skipped, as parse_corpus does '''
+
+        extracted = stages.extract(PUB_PDF, work_dir=self.work_dir)
+        stages.fetch(work_dir=self.work_dir, journal_dir="")
+        os.remove(os.path.join(self.work_dir, extracted['publications'][0]['text']))
+
+        with self.assertLogs("stages", level="ERROR"):
+            matches = stages.match(work_dir=self.work_dir, output_dir=os.path.join(self.tmp.name, "output"), workers=1)
+
+        self.assertEqual(matches, {})
+
+    def test_extract_skips_publication(self, mock_get_records, mock_get_diseases, mock_cache, mock_pdf_cache):
+        ''' test a publication that cannot be read is logged and skipped, and the others are extracted '''
+
+        corpus = os.path.join(self.tmp.name, "corpus")
+        os.makedirs(corpus)
+        with open(PUB_PDF, "rb") as src, open(os.path.join(corpus, "a.pdf"), "wb") as dst:
+            dst.write(src.read())
+        with open(os.path.join(corpus, "b.pdf"), "wb") as f:
+            f.write(b"not a PDF")
+
+        with self.assertLogs("stages", level="ERROR"):
+            extracted = stages.extract(corpus, work_dir=self.work_dir, workers=1)
+
+        self.assertEqual([entry['name'] for entry in extracted['publications']], ["a.pdf"])
+        self.assertTrue(os.path.exists(os.path.join(self.work_dir, extracted['publications'][0]['text'])))
+
+    def test_missing_artifact(self, mock_get_records, mock_get_diseases, mock_cache, mock_pdf_cache):
+        ''' test a stage run before the one it depends on fails '''
+
+        with self.assertRaises(FileNotFoundError):
+            stages.fetch(work_dir=self.work_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
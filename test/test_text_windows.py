@@ -0,0 +1,61 @@
+import unittest
+from text_windows import TextSegments, parse_window
+
+TEXT = """Diagnostic yield of exome sequencing
+Abstract
+Background Patients with kidney disease were sequenced. A variant in RRAGD was found (Fig. 1).
+It causes hypomagnesemia. Inborn genetic diseases were excluded.
+Results
+NPHS2 variants cause nephrotic syndrome, e.g. in children. They were
+found in two families. Alport syndrome was not seen.
+
+Discussion
+The RRAGD variant is novel."""
+
+
+class TestTextSegments(unittest.TestCase):
+    def setUp(self):
+        self.segments = TextSegments(TEXT)
+
+    def test_sections(self):
+        ''' test headings on a line of their own start sections '''
+
+        self.assertEqual([section.title for section in self.segments.sections], ['', 'abstract', 'results', 'discussion'])
+        self.assertEqual(self.segments.section_at(TEXT.index("NPHS2")).title, 'results')
+
+    def test_sentences(self):
+        ''' test sentences end at punctuation before a capital, but not after abbreviations '''
+
+        first = self.segments.sentence_index(TEXT.index("A variant"))
+
+        self.assertEqual(self.segments.sentence_index(TEXT.index("(Fig. 1)")), first)
+        self.assertEqual(self.segments.sentence_index(TEXT.index("It causes")), first + 1)
+        self.assertEqual(self.segments.sentence_index(TEXT.index("in children")),
+                         self.segments.sentence_index(TEXT.index("NPHS2")))
+
+    def test_window(self):
+        ''' test windows are the whole lines around mentions, within their section '''
+
+        offsets = [TEXT.index("RRAGD"), TEXT.rindex("RRAGD")]
+
+        self.assertEqual(self.segments.window(offsets, 0).splitlines(), [
+            "Background Patients with kidney disease were sequenced. A variant in RRAGD was found (Fig. 1).",
+            "The RRAGD variant is novel."])
+        self.assertEqual(len(self.segments.window(offsets, 1).splitlines()), 3)
+        self.assertNotIn("NPHS2", self.segments.window(offsets, 5))
+        self.assertIn("Inborn genetic diseases", self.segments.window(offsets[:1], None))
+        self.assertEqual(self.segments.window([], 1), "")
+
+    def test_parse_window(self):
+        ''' test DISEASE_WINDOW settings '''
+
+        self.assertEqual(parse_window(""), (False, None))
+        self.assertEqual(parse_window("document"), (False, None))
+        self.assertEqual(parse_window("Section"), (True, None))
+        self.assertEqual(parse_window("2"), (True, 2))
+        with self.assertRaises(ValueError):
+            parse_window("paragraph")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import re
+import bisect
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+
+# Section headings of research articles, on a line of their own, optionally numbered or followed by a colon
+SECTION_HEADINGS = (
+    'abstract', 'background', 'introduction', 'methods', 'materials and methods', 'patients and methods',
+    'results', 'discussion', 'conclusion', 'conclusions', 'references', 'acknowledgements', 'acknowledgments',
+    'supplementary information', 'supplementary material', 'declarations', 'abbreviations', 'case report',
+    'case presentation',
+)
+HEADING_PATTERN = re.compile(
+    r"^[ \t]*(?:\d+(?:\.\d+)*\.?[ \t]+)?(" + "|".join(re.escape(h) for h in SECTION_HEADINGS) + r")[ \t]*:?[ \t]*$",
+    re.IGNORECASE | re.MULTILINE)
+
+# A sentence ends at ., ! or ? followed by space and an upper case letter, digit or bracket, or at a blank line
+SENTENCE_END_PATTERN = re.compile(r"[.!?][\"')\]]*\s+(?=[A-Z0-9(\[])|\n[ \t]*\n")
+# Abbreviations whose period does not end a sentence
+ABBREVIATIONS = ('et al.', 'e.g.', 'i.e.', 'fig.', 'figs.', 'ref.', 'refs.', 'no.', 'vs.', 'approx.', 'ca.', 'dr.')
+
+
+@dataclass
+class Section:
+    title: str
+    start: int
+    end: int
+
+
+class TextSegments:
+    """Sentences and sections of a document's text, to restrict disease matching to the text around
+    a gene's mentions.
+
+    Windows are returned as whole lines of the text, the unit DiseaseMatcher scores, so matching
+    in a window finds a subset of the diseases found in the whole document.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self._sentence_starts = [0] + [end for end in self._sentence_ends(text) if end < len(text)]
+        self._sentence_ends_list = self._sentence_starts[1:] + [len(text)]
+        self.sections = self._sections(text)
+        self._section_starts = [section.start for section in self.sections]
+        self._line_starts = [0] + [match.end() for match in re.finditer(r"\n", text)]
+
+    @staticmethod
+    def _sentence_ends(text: str) -> Iterable[int]:
+        for match in SENTENCE_END_PATTERN.finditer(text):
+            if match.group().startswith('.'):
+                head = text[max(0, match.start() - 8):match.start() + 1].lower()
+                if any(head.endswith(abbreviation) for abbreviation in ABBREVIATIONS):
+                    continue
+            yield match.end()
+
+    @staticmethod
+    def _sections(text: str) -> List[Section]:
+        sections = [Section('', 0, len(text))]
+        for match in HEADING_PATTERN.finditer(text):
+            sections[-1].end = match.start()
+            # the heading line itself is left out of the section, as it is not about any gene
+            sections.append(Section(match.group(1).lower(), min(match.end() + 1, len(text)), len(text)))
+        return [section for section in sections if section.end > section.start] or sections[:1]
+
+    def sentence_count(self) -> int:
+        return len(self._sentence_starts)
+
+    def sentence_index(self, offset: int) -> int:
+        """Index of the sentence holding a text offset."""
+        return max(0, bisect.bisect_right(self._sentence_starts, offset) - 1)
+
+    def section_at(self, offset: int) -> Section:
+        return self.sections[max(0, bisect.bisect_right(self._section_starts, offset) - 1)]
+
+    def span(self, offset: int, sentences: Optional[int]) -> Tuple[int, int]:
+        """Text span around an offset: the sentences on each side of it, or its section when sentences is None,
+        never crossing into another section."""
+        section = self.section_at(offset)
+        if sentences is None:
+            return section.start, section.end
+        index = self.sentence_index(offset)
+        start = self._sentence_starts[max(0, index - sentences)]
+        end = self._sentence_ends_list[min(len(self._sentence_ends_list) - 1, index + sentences)]
+        return max(start, section.start), min(end, section.end)
+
+    def window(self, offsets: Iterable[int], sentences: Optional[int]) -> str:
+        """The lines of text overlapping the spans around offsets, in order and each once."""
+        lines = set()
+        for offset in offsets:
+            start, end = self.span(offset, sentences)
+            first = bisect.bisect_right(self._line_starts, start) - 1
+            last = bisect.bisect_right(self._line_starts, max(start, end - 1)) - 1
+            lines.update(range(first, last + 1))
+        ends = self._line_starts[1:] + [len(self.text) + 1]
+        return "\n".join(self.text[self._line_starts[i]:ends[i] - 1] for i in sorted(lines))
+
+
+def parse_window(value: str) -> Tuple[bool, Optional[int]]:
+    """Parse a DISEASE_WINDOW setting: '' for the whole document, 'section', or a number of sentences.
+
+    Returns whether matching is windowed, and the sentences on each side of a mention (None for sections).
+    """
+    value = value.strip().lower()
+    if not value or value == 'document':
+        return False, None
+    if value == 'section':
+        return True, None
+    try:
+        sentences = int(value)
+    except ValueError:
+        raise ValueError(f"Invalid DISEASE_WINDOW {value!r}, expected 'document', 'section' or a number of sentences")
+    if sentences < 0:
+        raise ValueError(f"Invalid DISEASE_WINDOW {value!r}, the number of sentences cannot be negative")
+    return True, sentences